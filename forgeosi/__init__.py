@@ -1,3 +1,3 @@
-from forgeosi import *
+from .forgeosi import *
 
 __all__ = ['forgeosi', 'lib']
@@ -11,14 +11,29 @@ from __future__ import print_function
 import virtualbox
 import os
 import subprocess
-from lib import logger  # local import
-from lib import oslinux  # local import
-from lib import oswindows  # local import
-from lib.param import *  # local import
+from .lib import logger  # local import
+from .lib import oslinux  # local import
+from .lib import oswindows  # local import
+from .lib import isocache  # local import
+from .lib import readiness  # local import
+from .lib import sessionpool  # local import
+from .lib import diff  # local import
+from .lib import vdi  # local import
+from .lib import rawexport  # local import
+from .lib import blockhash  # local import
+from .lib import archive  # local import
+from .lib.param import *  # local import
 import shutil
 import time
+import threading
+import uuid
 from decorator import decorator
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 
 __doc__ = """\
 This library should simplify automating the control of virtual machines with
@@ -50,6 +65,139 @@ USERTOKEN = ""
 empty string for no separation
 """
 
+_snapshot_locks = {}
+_snapshot_locks_guard = threading.Lock()
+
+_guest_session_cache = {}
+"""healthy guest sessions by (machine id, username, password), shared by all
+Vbox instances of this process"""
+_guest_session_cache_guard = threading.Lock()
+
+_NOT_SUPPORTED = (virtualbox.library.OleErrorNotimpl,
+                  virtualbox.library.VBoxErrorNotSupported)
+"""Errors of VirtualBox versions, lacking an operation"""
+
+
+def _guest_session_healthy(guestsession):
+    """checks if a guest session can still be used
+    """
+    try:
+        return int(guestsession.status) == \
+            int(virtualbox.library.GuestSessionStatus.started)
+    except:
+        return False
+
+
+def _session_error_text(events):
+    """returns the error text of the last state change of a guest session,
+    reported to the readiness.VboxEventSource events, None if there was none
+    """
+    ret = None
+    event = events.event_source.get_event(events.listener, 0)
+    while event:
+        try:
+            error = virtualbox.library.IGuestSessionStateChangedEvent(
+                event).error
+            if error is not None and error.text:
+                ret = error.text
+        except:
+            pass
+        events.event_source.event_processed(events.listener, event)
+        event = events.event_source.get_event(events.listener, 0)
+    return ret
+
+
+def _parallel(func, items, workers=4):
+    """calls func on every item with a bounded number of threads
+
+    Returns the results in the order of items, the first exception is raised
+    after all calls finished.
+    """
+    items = list(items)
+    jobs = queue.Queue()
+    for index, item in enumerate(items):
+        jobs.put((index, item))
+    results = [None] * len(items)
+    errors = []
+
+    def worker():
+        while True:
+            try:
+                index, item = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception as e:
+                errors.append(e)
+
+    threads = []
+    for _ in range(min(workers, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def _to_text(data):
+    """returns output read from a guest process as text, the API returns
+    bytes on Python 3
+    """
+    if isinstance(data, str):
+        return data
+    return bytes(data).decode("utf-8", "replace")
+
+
+def _host_tree(path):
+    """returns the directories and files below path, relative to it
+    """
+    dirs = []
+    files = []
+    for root, dirnames, filenames in os.walk(path):
+        rel = os.path.relpath(root, path)
+        for name in sorted(dirnames):
+            dirs.append(os.path.normpath(os.path.join(rel, name)))
+        for name in sorted(filenames):
+            files.append(os.path.normpath(os.path.join(rel, name)))
+    return dirs, files
+
+
+def _find_or_take_snapshot(vb, basename, linked_name, prepare=None,
+                           finish=None):
+    """returns the snapshot of the base vm, linked clones are created from
+
+    The snapshot is taken, if it does not exist yet. Only one thread per base
+    vm gets to check and take it, so concurrent clones share one snapshot.
+
+    Arguments:
+        prepare - optional callable, run before taking a new snapshot
+        finish - optional callable, run after taking a new snapshot
+    """
+    with _snapshot_locks_guard:
+        lock = _snapshot_locks.setdefault((basename, linked_name),
+                                          threading.Lock())
+    with lock:
+        orig = vb.find_machine(basename)
+        try:
+            return orig.find_snapshot(linked_name)
+        except:
+            if prepare:
+                prepare()
+            orig_session = orig.create_session()
+            try:
+                progress = orig_session.console.take_snapshot(linked_name, "")
+                progress.wait_for_completion()
+            finally:
+                orig_session.unlock_machine()
+            if finish:
+                finish()
+            return orig.find_snapshot(linked_name)
+
 
 class VboxInfo():
     """Helper class, not changing machine state
@@ -224,19 +372,11 @@ class Vbox():
         if mode == VboxMode.clone:
 
             _orig = self.vb.find_machine(basename)
-            _orig_session = _orig.create_session()
 
             self.vm = self.vb.create_machine("", clonename, [],
                                              _orig.os_type_id, "")
 
-            try:
-                _snap = _orig.find_snapshot(linked_name)
-            except:
-
-                self.progress = _orig_session.console.take_snapshot(linked_name,
-                                                                    "")
-                self.progress.wait_for_completion()
-                _snap = _orig.find_snapshot(linked_name)
+            _snap = _find_or_take_snapshot(self.vb, basename, linked_name)
 
             self.progress = _snap.machine.clone_to(
                     self.vm,virtualbox.library.CloneMode.machine_state,
@@ -255,6 +395,11 @@ class Vbox():
 
         self.session = self.vm.create_session()
         self.guestsession = None  # will be created by create_guest_session()
+        # additional guest sessions for run_process(username=...)
+        self.guest_sessions = sessionpool.GuestSessionPool(
+            create=self._open_guest_session,
+            healthy=_guest_session_healthy,
+            close=lambda gs: gs.close())
         self.os = None  # will be created by create_guest_session()
         self.basename = basename
         self.running = False
@@ -264,21 +409,25 @@ class Vbox():
         self.username = ""
         self.password = ""
         self.network = None  # Network will be stored here if needed
+        self.login_stats = {}  # filled by create_guest_session()
 
         self.log = logger.Logger()
         self.log.add_vm(clonename, basename, self.os_type)
 
 
     @check_stopped
-    def start(self, session_type=SessionType.headless, wait=True):
+    def start(self, session_type=SessionType.headless, wait=True,
+              target=BootTarget.additions, timeout=600):
         """start a machine
 
         Arguments:
             session_type - SessionType.headless means, the machine runs without
                 any gui, the only sensible way on a remote server. This
                 parameter is changeable to SessionType.gui for debugging only
-            wait - waits till the machine is initialized, it will not have
-                finished booting yet.
+            wait - waits till the machine reached target, see wait_for_boot
+            target - stage of booting to wait for, of type BootTarget
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
         """
         if not isinstance(session_type, SessionType):
             raise TypeError("session_type needs to be of type SessionType")
@@ -289,15 +438,129 @@ class Vbox():
                                                   session_type.name, '')
 
         self.running = True
+        # the guest clock starts at host time plus offset, at normal speed
+        self.speedup = 100
+        self.log.add_time_rate(self.speedup, self.offset / 1000.0, anchor=True,
+                               time_offset=self.offset,
+                               time_rate=self.speedup)
 
         if wait:
             self.progress.wait_for_completion()
-            while (self.session.console.guest.additions_run_level < 2):
-                time.sleep(5)
+            self.wait_for_boot(target=target, timeout=timeout)
         else:
             return self.progress
 
 
+    @check_running
+    def wait_for_boot(self, target=BootTarget.additions, timeout=600,
+                      username="default", password="12345"):
+        """Blocks until the machine reached a certain stage of booting
+
+        Instead of polling, this listens to the guest additions and machine
+        state events of VirtualBox and checks the stage whenever one arrives.
+
+        Arguments:
+            target - BootTarget to wait for:
+                launched - the vm process is running
+                additions - the guest additions are loaded
+                desktop - the guest additions report a logged in desktop
+                session - a guest session can be created, it will be kept,
+                    as if create_guest_session had been called
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
+            username - only used with BootTarget.session
+            password - only used with BootTarget.session
+
+        Returns:
+            dict with the time in seconds it took to reach each stage
+        """
+        if not isinstance(target, BootTarget):
+            raise TypeError("target needs to be of type BootTarget")
+
+        event_types = [virtualbox.library.VBoxEventType.on_additions_state_changed,
+                       virtualbox.library.VBoxEventType.on_state_changed]
+        events = readiness.VboxEventSource(self.session.console.event_source,
+                                           event_types)
+
+        checks = self._boot_checks(username, password)
+
+        waiter = readiness.ReadinessWaiter(events, checks)
+        try:
+            return waiter.wait(target, timeout)
+        finally:
+            waiter.close()
+
+
+    def _boot_checks(self, username, password):
+        """returns a dict mapping each BootTarget to a callable, returning
+        True once the stage is reached
+        """
+
+        def guest_session_created():
+            if self.guestsession:
+                return True
+            try:
+                self.create_guest_session(username, password, wait=False)
+            except sessionpool.SessionError as e:
+                if e.kind != sessionpool.TRANSIENT:
+                    raise
+                return False
+            return True
+
+        return {BootTarget.launched: lambda: self.progress.completed,
+                BootTarget.additions: lambda:
+                    self.session.console.guest.additions_run_level >= 2,
+                BootTarget.desktop: lambda:
+                    self.session.console.guest.additions_run_level >= 3,
+                BootTarget.session: guest_session_created}
+
+
+    def _confirm_shutdown(self, confirm):
+        """sends the keys, confirming the shutdown dialog of the guest
+        """
+        if confirm is StopConfirm.unity:
+            # Confirms Unity shutdown dialog in Ubuntu 13.10
+            self.keyboard_combination(['left'])
+            self.keyboard_combination(['enter'])
+        elif confirm is StopConfirm.simple:
+            self.keyboard_combination(['enter'])
+        elif confirm is StopConfirm.xfce:
+            # Confirms xfce shutdown dialog in Xubuntu 12.04
+            self.keyboard_combination(['right'])
+            self.keyboard_combination(['right'])
+            self.keyboard_combination(['enter'])
+
+
+    def _wait_for_shutdown_dialog(self, confirm, timeout=20):
+        """waits until the shutdown dialog of the guest shows up
+
+        Only the xfce dialog is a window of its own, which can be found in the
+        guest, for all others, or without guest session, timeout is waited.
+        """
+        if confirm is StopConfirm.xfce and isinstance(self.os,
+                                                      oslinux.OSLinux):
+            try:
+                self.os.wait_for_window(window_class="xfce4-session-logout",
+                                        timeout=timeout)
+                return
+            except readiness.ReadinessTimeout:
+                return
+        time.sleep(timeout)
+
+
+    def _mark_stopped(self):
+        """resets the state, which is only valid for a running machine
+        """
+        self.running = False
+        self.guestsession = False
+        self.os = False
+        self.guest_sessions.clear()
+        with _guest_session_cache_guard:
+            for key in list(_guest_session_cache):
+                if key[0] == self.vm.id_p:
+                    del _guest_session_cache[key]
+
+
     @check_running
     def stop(self, stop_mode=StopMode.shutdown, confirm=StopConfirm.none,
              wait=True):
@@ -325,53 +588,39 @@ class Vbox():
             raise TypeError("stop_mode needs to be of type StopConfirm")
 
         if stop_mode is StopMode.shutdown:
+            # register before pressing the button, to not miss the event
+            events = readiness.VboxEventSource(self.vb.event_source,
+                [virtualbox.library.VBoxEventType.on_machine_state_changed])
             self.session.console.power_button()
-            if confirm is StopConfirm.unity:
-                # Confirms Unity shutdown dialog in Ubuntu 13.10
-                time.sleep(20)
-                self.keyboard_combination(['left'])
-                self.keyboard_combination(['enter'])
-            elif confirm is StopConfirm.simple:
-                time.sleep(20)
-                self.keyboard_combination(['enter'])
-            elif confirm is StopConfirm.xfce:
-                # Confirms xfce shutdown dialog in Xubuntu 12.04
-                time.sleep(20)
-                self.keyboard_combination(['right'])
-                self.keyboard_combination(['right'])
-                self.keyboard_combination(['enter'])
-            if wait:
-                while (self.vm.state > 1):
-                    time.sleep(5)
-            self.running = False
-            self.guestsession = False
-            self.os = False
+            if confirm is not StopConfirm.none:
+                self._wait_for_shutdown_dialog(confirm)
+                self._confirm_shutdown(confirm)
+            waiter = readiness.ReadinessWaiter(events)
+            try:
+                if wait:
+                    waiter.wait_for(lambda: self.vm.state <= 1,
+                                    name="machine powered off")
+            finally:
+                waiter.close()
+            self._mark_stopped()
 
         elif stop_mode is StopMode.poweroff:
             progress = self.session.console.power_down()
             if wait:
                 progress.wait_for_completion()
                 self.unlock()
-                self.running = False
-                self.guestsession = False
-                self.os = False
+                self._mark_stopped()
             else:
-                self.running = False
-                self.guestsession = False
-                self.os = False
+                self._mark_stopped()
                 return progress
 
         elif stop_mode is StopMode.save_state:
             progress = self.session.console.save_state()
             if wait:
                 progress.wait_for_completion()
-                self.running = False
-                self.guestsession = False
-                self.os = False
+                self._mark_stopped()
             else:
-                self.running = False
-                self.guestsession = False
-                self.os = False
+                self._mark_stopped()
                 return progress
 
 
@@ -400,24 +649,51 @@ class Vbox():
 
     @check_stopped
     def export(self, path="/tmp/disk.vdi", controller=ControllerType.SATA,
-               port=0, disk=0, raw=False, wait=True):
+               port=0, disk=0, raw=False, wait=True, workers=4, hashes=(),
+               block_hashes=False):
         """Export a VirtualBox hard disk image
 
         By default, it will export the first disk on the sata controller, which
         is usually the boot device, in the default config of virtualbox.
         This operation will take some time
 
+        RAW images of VDI disks are written by this library, as sparse files
+        with only the stored blocks written by a pool of threads, see
+        lib/rawexport.py. Other formats fall back to vboxmanage.
+
         Arguments:
             path - path to the exported disk, format .vdi
             controller - controller, where the virtual drive is attached
             port - port number of the controller
             disk - disk number of the controller
             raw - if a raw or a normal vdi file should be created
-        """
+            wait - with wait=False, a progress object is returned, for raw
+                exports a rawexport.RawExport, which also reports the
+                throughput
+            workers - number of threads writing a raw export
+            hashes - hashlib algorithms, like ('md5', 'sha256'), to hash a
+                raw export while it is written, raw only
+            block_hashes - write a digest per block of a raw export to
+                path + ".blockhashes", see lib/blockhash.py, raw only
 
+        Returns:
+            for raw exports with hashes or block_hashes and wait=True, a
+            blockhash.BlockHashes with the digests
+        """
         if not isinstance(controller, ControllerType):
             raise TypeError("controller must be of type ControllerType")
 
+        sidecar = path + blockhash.SIDECAR_SUFFIX if block_hashes else None
+
+        if raw:
+            progress = self._raw_export(path, controller, port, disk, workers,
+                                        hashes, sidecar)
+            if progress is not None:
+                if wait:
+                    progress.wait_for_completion()
+                    return progress.block_hashes
+                return progress
+
         self.lock()
 
         cur_hdd = self.session.machine.get_medium(controller.name, port, disk)
@@ -431,6 +707,8 @@ class Vbox():
                                      'RAW', cur_hdd.location, path])
              # after cloning, we want also to remove the medium from VirtualBox
             subprocess.check_output(['vboxmanage', 'closemedium', 'disk', path])
+            if hashes or block_hashes:
+                return blockhash.hash_image(path, hashes, sidecar=sidecar)
         else:
             clone_hdd = self.vb.create_hard_disk("", path)
             variant = virtualbox.library.MediumVariant.standard
@@ -443,6 +721,131 @@ class Vbox():
                 return progress
 
 
+    def _raw_export(self, path, controller, port, disk, workers, hashes,
+                    sidecar):
+        """starts a rawexport.RawExport of the disk, returns None if it is no
+        VDI image
+        """
+        try:
+            chain = vdi.VdiChain(self._disk_chain(controller, port, disk))
+        except vdi.VdiError:
+            return None
+        return rawexport.RawExport(chain, path, workers, close_image=True,
+                                   hashes=hashes, sidecar=sidecar).start()
+
+
+    @check_stopped
+    def diff_disk(self, reader, report=None, controller=ControllerType.SATA,
+                  port=0, disk=0, compare=False):
+        """Finds the files changed on the disk of a linked clone
+
+        Only the blocks written to the differencing image of the clone are
+        read, no export is needed. The files of the base image come from a
+        file system reader, usually the DFXML of the base image, created once
+        with fiwalk, see lib/diff.py for details.
+
+        Arguments:
+            reader - file system reader of the base image, like
+                diff.DfxmlReader("base.dfxml")
+            report - optional path for a DFXML report of the changes
+            controller - controller, where the virtual drive is attached
+            port - port number of the controller
+            disk - disk number of the controller
+            compare - compare the written blocks with the parent image, to
+                report changed sectors instead of whole blocks
+
+        Returns:
+            diff.DiffReport
+        """
+        if not self.is_clone:
+            raise TypeError("only linked clones have a differencing image")
+
+        chain = self._disk_chain(controller, port, disk)
+        return diff.diff_image(chain[0], reader, report,
+                               chain[1:] if compare else None)
+
+
+    def _disk_chain(self, controller, port, disk):
+        """returns the locations of the attached image and all its parents
+        """
+        if not isinstance(controller, ControllerType):
+            raise TypeError("controller must be of type ControllerType")
+
+        self.lock()
+        try:
+            medium = self.session.machine.get_medium(controller.name, port,
+                                                     disk)
+            ret = []
+            while medium:
+                ret.append(medium.location)
+                medium = medium.parent
+        finally:
+            self.unlock()
+        return ret
+
+
+    @check_stopped
+    def open_disk(self, controller=ControllerType.SATA, port=0, disk=0):
+        """Opens the disk of the machine for reading, without exporting it
+
+        The image and all its parents are memory mapped, see lib/vdi.py. Use
+        raw() of the returned chain for a seekable file object of the whole
+        disk, and close the chain before starting the machine again.
+
+        Arguments:
+            controller - controller, where the virtual drive is attached
+            port - port number of the controller
+            disk - disk number of the controller
+
+        Returns:
+            vdi.VdiChain
+        """
+        return vdi.VdiChain(self._disk_chain(controller, port, disk))
+
+
+    @check_stopped
+    def archive_disk(self, store, name, base="base",
+                     controller=ControllerType.SATA, port=0, disk=0):
+        """Adds the disk of the linked clone to a deduplicating archive
+
+        Only the blocks written to the differencing image of the clone are
+        read, everything else is taken from the base image in the archive. If
+        the archive has no image named base yet, the parent of the clone's
+        disk is added as base first, which reads the whole base disk once.
+        The base is stored with the creation and modification UUIDs of the
+        parent image, a base of another parent raises ValueError.
+
+        Arguments:
+            store - archive.Archive
+            name - name of the disk in the archive, like the number of the run
+            base - name of the base disk in the archive
+            controller - controller, where the virtual drive is attached
+            port - port number of the controller
+            disk - disk number of the controller
+
+        Returns:
+            number of bytes newly stored in the archive
+        """
+        if not self.is_clone:
+            raise TypeError("only linked clones have a differencing image")
+
+        paths = self._disk_chain(controller, port, disk)
+        with vdi.VdiChain(paths[1:]) as parent:
+            identity = "%s %s" % (parent.images[0].uuid_create,
+                                  parent.images[0].uuid_modify)
+            if base not in [x[0] for x in store.images()]:
+                store.add(base, parent.raw(), identity=identity)
+            elif store.identity(base) != identity:
+                raise ValueError("%s in the archive is not the parent of the "
+                                 "disk of %s" % (base, self.vm.name))
+
+        with vdi.VdiChain(paths) as chain:
+            clone = chain.images[0]
+            changed = [(x * clone.block_size, clone.block_size)
+                       for x in clone.allocated_blocks()]
+            return store.add(name, chain.raw(), base, changed)
+
+
     @check_running
     def dump_memory(self, path="/tmp/dump.elf"):
         """Creates a memory dump in 64bit elf format
@@ -503,8 +906,8 @@ class Vbox():
             offset - time in seconds
         """
 
-        self.session.machine.bios_settings.time_offset = offset * 1000L
-        self.offset = offset * 1000L
+        self.session.machine.bios_settings.time_offset = offset * 1000
+        self.offset = offset * 1000
 
 
     @check_running
@@ -520,6 +923,8 @@ class Vbox():
 
         self.session.console.debugger.virtual_time_rate = speedup
         self.speedup = speedup
+        self.log.add_time_rate(speedup, self.offset / 1000.0,
+                               time_offset=self.offset, time_rate=speedup)
 
 
     @lock_if_not_running
@@ -552,34 +957,91 @@ class Vbox():
         self.session.machine.save_settings()
 
 
+    def _open_guest_session(self, username, password, timeout_ms=30000):
+        """creates a guest session and waits until it started
+
+        Raises sessionpool.SessionError for errors, which do not go away by
+        retrying
+        """
+        library = virtualbox.library
+        if int(self.vm.state) != int(library.MachineState.running):
+            raise sessionpool.SessionError(sessionpool.GONE,
+                                           "machine is not running")
+
+        guestsession = self.session.console.guest.create_session(username,
+                                                                  password)
+        events = readiness.VboxEventSource(
+            guestsession.event_source,
+            [library.VBoxEventType.on_guest_session_state_changed])
+        try:
+            guestsession.wait_for_array(
+                [library.GuestSessionWaitForFlag.start], timeout_ms)
+            if _guest_session_healthy(guestsession):
+                return guestsession
+            error = _session_error_text(events)
+        finally:
+            events.close()
+
+        try:
+            status = int(guestsession.status)
+        except:
+            status = None
+        try:
+            guestsession.close()
+        except:
+            pass
+        # only the error reported by the guest tells a bad login apart from
+        # a guest, which is not ready yet
+        if status == int(library.GuestSessionStatus.error) and error:
+            raise sessionpool.SessionError(sessionpool.classify_error(error),
+                                           "guest session for %s failed: %s"
+                                           % (username, error))
+        raise sessionpool.SessionError(sessionpool.TRANSIENT,
+                                       "guest session for %s did not start"
+                                       % username)
+
+
     @check_running
     def create_guest_session(self, username="default", password="12345",
-                             home="", wait=True):
+                             home="", wait=True, timeout=300):
         """creates a guest session for issuing commands to the guest system
 
-        While the VirtualBox API would support up to 256 simultaneous guest
-        sessions, here only one simultaneous guestsession is supported, if more
-        than one guestsession are needed, they need to be manged by hand.
+        This creates the default guest session, used by Vbox.os and most
+        methods. Additional guest sessions, also of other users, are managed by
+        self.guest_sessions, see run_process(username=...).
+        A healthy session of the same user, created by another Vbox instance
+        for the same machine, is reused. Timing information about the login is
+        stored in self.login_stats, see sessionpool.establish_session.
 
         Arguments:
             username - username for the vm user, the session should belong to
             password - password for the vm user, the session should belong to
+            wait - retry with backoff, until the guest accepts the login,
+                otherwise only try once
+            timeout - time in seconds for retrying, only used with wait=True
+
+        Raises sessionpool.SessionError, if no session could be created, right
+        away for bad credentials or a machine, which is not running
         """
 
         self.username = username
         self.password = password
 
-        if wait:
-            while not self.guestsession:
-                time.sleep(5)
-                try:
-                    self.guestsession = self.session.console.guest.create_session(
-                        self.username, self.password)
-                except:
-                    pass
+        key = (self.vm.id_p, username, password)
+        with _guest_session_cache_guard:
+            cached = _guest_session_cache.get(key)
+        if cached is not None and _guest_session_healthy(cached):
+            self.guestsession = cached
+            self.login_stats = {'attempts': 0, 'attempt_times': [],
+                                'waited': 0.0, 'errors': [], 'total': 0.0,
+                                'cached': True}
         else:
-            self.guestsession = self.session.console.guest.create_session(
-                self.username, self.password)
+            self.login_stats = {'cached': False}
+            self.guestsession = sessionpool.establish_session(
+                lambda: self._open_guest_session(username, password),
+                timeout=timeout if wait else 0, stats=self.login_stats)
+            with _guest_session_cache_guard:
+                _guest_session_cache[key] = self.guestsession
 
         #use vm property to find systemtype
         #we create the self.os at this point, because it needs a running guest
@@ -598,21 +1060,27 @@ class Vbox():
 
 
     @check_running
-    def mount_folder_as_cd(self, folder_path, iso_path="/tmp/cd.iso",
-                           cdlabel="MyCD"):
+    def mount_folder_as_cd(self, folder_path, iso_path=None, cdlabel="MyCD",
+                           cache=None):
         """Creates a iso-image based on directory and mounts it to the VM
 
         If the operating system inside the vm does no automounting, further
         action will be needed. For Ubuntu and Windows, the files should be
         accessible without further action.
-        Depends on mkisofs from genisoimage, should be installed by default on
-        ubuntu hosts
+        Uses mkisofs from genisoimage, should be installed by default on
+        ubuntu hosts, or pycdlib, if mkisofs is missing.
+
+        By default, the image comes from an isocache.IsoCache, so it is only
+        built again, if the folder changed, and all VMs mounting the same
+        folder share one read-only image.
 
         Arguments:
             folder_path - path to the folder, which's content should be inside
                 the image
-            iso_path - path, where the iso image should be created
+            iso_path - path, where the iso image should be created, bypasses
+                the cache, the image is deleted on cleanup
             cdlabel - label, which will be shown inside the vm
+            cache - isocache.IsoCache to use, default isocache.default_cache
         """
 
         #basic sanity check
@@ -620,12 +1088,13 @@ class Vbox():
             print("Error: Path does not exist")
             return
 
-        args = ["-J", "-l", "-R", "-V", cdlabel, "-iso-level", "4", "-o",
-                iso_path, folder_path]
-
-        subprocess.check_output(["mkisofs"]+args)
-
-        self.mount_cd(path=iso_path, remove_image=True)
+        if iso_path:
+            isocache.build_iso(folder_path, iso_path, cdlabel)
+            self.mount_cd(path=iso_path, remove_image=True)
+        else:
+            cache = cache or isocache.default_cache
+            self.mount_cd(path=cache.get(folder_path, cdlabel),
+                          remove_image=False)
 
 
     @check_running
@@ -637,10 +1106,19 @@ class Vbox():
             remove_image - decides, if the image should be deleted on cleanup
         """
 
-        self.medium = self.vb.open_medium(path,
+        try:
+            self.medium = self.vb.open_medium(path,
                                           virtualbox.library.DeviceType.dvd,
                                           virtualbox.library.AccessMode.read_only,
                                           False)
+        except Exception:
+            # images shared with other VMs are opened already
+            matching = [x for x in self.vb.dvd_images
+                        if os.path.realpath(x.location) ==
+                        os.path.realpath(path)]
+            if not matching:
+                raise
+            self.medium = matching[0]
         self.session.machine.mount_medium(ControllerType.IDE.name, 1, 0,
                                           self.medium, True)
 
@@ -655,14 +1133,18 @@ class Vbox():
         self.session.machine.mount_medium(ControllerType.IDE.name, 1, 0,
                                           virtualbox.library.IMedium(), True)
         if self.medium:
-            self.medium.close()
+            # shared images stay open, while other VMs use them
+            if not self.medium.machine_ids:
+                self.medium.close()
+            self.medium = None
 
 
     @check_running
     @check_guestsession
     def run_process(self, command, arguments=[], stdin='', key_input='',
                     environment=[], native_input=False, timeout=0, wait_time=10,
-                    wait=True):
+                    wait=True, capture_output=False, callback=None,
+                    spool=None, log=True, username=None, password=None):
         """Runs a process with arguments and stdin in the VM
 
         This method requires the VirtualBox Guest Additions to be installed.
@@ -682,57 +1164,351 @@ class Vbox():
                 if no alternative is available
             timeout - This is a timeout in milliseconds, which determines, when
                 the process will be killed, 0 will disable the timeout
-            wait_time - time to wait, until input is send via keyboard, only
-                relevant in combination with wait=False/keyinput
+            wait_time - maximum time to wait for a window of the process,
+                before input is send via keyboard, only relevant in combination
+                with key_input
             wait - selects if the process should be created synchronous with
                 input or if this function will return, while the process inside
                 the VM is still running
+            capture_output - keep stdout and stderr of processes started with
+                wait=False or key_input, needed for wait_for_output
+            callback - called as callback(handle, data) for every chunk of
+                output while the process runs, handle is 1 for stdout and 2
+                for stderr, only used with wait=True
+            spool - path on the host, stdout is written to, stderr goes to
+                spool + ".stderr", the output is not kept in memory or in the
+                log then, only used with wait=True
+            log - add an entry to the log, batches of Vbox.os log their single
+                operations instead
+            username - run the process in a guest session of this user, taken
+                from self.guest_sessions, instead of the default guest session.
+                Processes in different sessions can run in parallel, when
+                run_process is called from several threads
+            password - password of username
 
         Returns:
-            pid, stdout, stdin
+            pid, stdout, stdin - stdout and stderr are empty, if spool is used
         """
 
         stdin = ""  # stdin input is broken in pyvbox!
 
+        if username:
+            with self.guest_sessions.session(username, password) as gs:
+                return self._run_process(gs, command, arguments, stdin,
+                                         key_input, environment, native_input,
+                                         timeout, wait_time, wait,
+                                         capture_output, callback, spool, log)
+        return self._run_process(self.guestsession, command, arguments, stdin,
+                                 key_input, environment, native_input,
+                                 timeout, wait_time, wait, capture_output,
+                                 callback, spool, log)
+
+
+    def _run_process(self, guestsession, command, arguments, stdin, key_input,
+                     environment, native_input, timeout, wait_time, wait,
+                     capture_output, callback, spool, log):
+        """implementation of run_process, running in the given guest session
+        """
+        streaming = wait and (callback or spool)
+
         # for this combination, the comfort of pyvbox can be used
-        if wait and not key_input:
-            process, stdout, stderr = self.guestsession.execute(command=command,
+        if wait and not key_input and not streaming:
+            process, stdout, stderr = guestsession.execute(command=command,
                 arguments=arguments, stdin=stdin, environment=environment,
                 timeout_ms=timeout)
 
         else:
             flags = [virtualbox.library.ProcessCreateFlag.wait_for_process_start_only,
                      virtualbox.library.ProcessCreateFlag.ignore_orphaned_processes]
+            if capture_output or streaming:
+                flags += [virtualbox.library.ProcessCreateFlag.wait_for_std_out,
+                          virtualbox.library.ProcessCreateFlag.wait_for_std_err]
 
-            process = self.guestsession.process_create(command=command,
-                                                       arguments=arguments,
-                                                       environment=environment,
-                                                       flags=flags,
-                                                       timeout_ms=timeout)
+            process = guestsession.process_create(command=command,
+                                                  arguments=arguments,
+                                                  environment=environment,
+                                                  flags=flags,
+                                                  timeout_ms=timeout)
 
             if key_input:
-                time.sleep(wait_time)
+                self._wait_for_input_window(process.pid, wait_time)
                 if native_input:
                     self.os.keyboard_input(key_input=key_input, pid=process.pid)
                 else:
                     self.keyboard_input(key_input=key_input)
 
-            if wait:
+            if streaming:
+                result = {}
+                for _ in self._stream_output(process, command, arguments,
+                                             key_input, callback, spool,
+                                             result, log):
+                    pass
+                return process.pid, result['stdout'], result['stderr']
+            elif wait:
                 process.wait_for(int(virtualbox.library.ProcessWaitForFlag.terminate),
                                  10000)
-                stdout = process.read(1, 65000, timeout)
-                stderr = process.read(2, 65000, timeout)
+                stdout = _to_text(process.read(1, 65000, timeout))
+                stderr = _to_text(process.read(2, 65000, timeout))
             else:
                 stdout = ""
                 stderr = ""
 
-        self.log.add_process(process, command, arguments, stdin, key_input,
-                             stdout, stderr, process.pid,
-                             time_offset=self.offset, time_rate=self.speedup)
+        if log:
+            self.log.add_process(self._running_or_none(process), command,
+                                 arguments, stdin, key_input, stdout, stderr,
+                                 process.pid, time_offset=self.offset,
+                                 time_rate=self.speedup)
 
         return process.pid, stdout, stderr
 
 
+    def _running_or_none(self, process):
+        """returns the process, if it is still running, the log keeps no
+        references to finished ones
+        """
+        try:
+            if self._terminated(process):
+                return None
+        except:
+            pass
+        return process
+
+
+    @staticmethod
+    def _terminated(process):
+        """checks if a guest process ended, paused or terminating processes
+        still count as running
+        """
+        status = virtualbox.library.ProcessStatus
+        return int(process.status) in [int(x) for x in
+                                       (status.terminated_normally,
+                                        status.terminated_signal,
+                                        status.terminated_abnormally,
+                                        status.timed_out_killed,
+                                        status.timed_out_abnormally,
+                                        status.down, status.error)]
+
+
+    def _read_chunks(self, process, chunk_size=65000, poll_ms=1000):
+        """yields (handle, data) for output of a process, as it arrives,
+        until the process terminated and all output is read
+        """
+        library = virtualbox.library
+        wait_flags = [library.ProcessWaitForFlag.std_out,
+                      library.ProcessWaitForFlag.std_err,
+                      library.ProcessWaitForFlag.terminate]
+
+        while True:
+            running = not self._terminated(process)
+            if running:
+                process.wait_for_array(wait_flags, poll_ms)
+            for handle in (1, 2):
+                data = _to_text(process.read(handle, chunk_size, 0))
+                while data:
+                    yield handle, data
+                    data = _to_text(process.read(handle, chunk_size, 0))
+            if not running:
+                return
+
+
+    def _stream_output(self, process, command, arguments, key_input='',
+                       callback=None, spool=None, result=None, log=True):
+        """yields the output of a process and logs it, once it terminated
+
+        The output is passed to callback and written to spool, if given.
+        stdout and stderr are stored in result, for run_process.
+        """
+        if result is None:
+            result = {}
+        output = {1: [], 2: []}
+        files = {}
+        if spool:
+            files = {1: open(spool, 'wb'), 2: open(spool + '.stderr', 'wb')}
+        try:
+            for handle, data in self._read_chunks(process):
+                if callback:
+                    callback(handle, data)
+                if spool:
+                    # the spool files are binary, data is text on Python 3
+                    if not isinstance(data, bytes):
+                        files[handle].write(data.encode("utf-8"))
+                    else:
+                        files[handle].write(data)
+                else:
+                    output[handle].append(data)
+                yield handle, data
+        finally:
+            for each in files.values():
+                each.close()
+            result['stdout'] = "".join(output[1])
+            result['stderr'] = "".join(output[2])
+            if log:
+                self.log.add_process(self._running_or_none(process), command,
+                                     arguments, '', key_input, result['stdout'],
+                                     result['stderr'], process.pid,
+                                     time_offset=self.offset,
+                                     time_rate=self.speedup,
+                                     spool=spool or '')
+
+
+    @check_running
+    @check_guestsession
+    def stream_process(self, command, arguments=[], environment=[], timeout=0,
+                       callback=None, spool=None):
+        """Runs a process in the VM and yields its output, as it arrives
+
+        Unlike run_process, output is not limited in size. The process is
+        logged, once the generator is exhausted or closed.
+
+        Example:
+            for handle, data in vbox.stream_process("/usr/bin/find", ["/"]):
+                sys.stdout.write(data)
+
+        Arguments:
+            command - full path to the binary, that should be executed
+            arguments - arguments passed to the binary, passed as an array of
+                single arguments
+            environment - user environment for the program
+            timeout - This is a timeout in milliseconds, which determines, when
+                the process will be killed, 0 will disable the timeout
+            callback - see run_process
+            spool - see run_process
+
+        Returns:
+            generator of (handle, data), handle is 1 for stdout, 2 for stderr
+        """
+        flags = [virtualbox.library.ProcessCreateFlag.wait_for_std_out,
+                 virtualbox.library.ProcessCreateFlag.wait_for_std_err,
+                 virtualbox.library.ProcessCreateFlag.ignore_orphaned_processes]
+
+        process = self.guestsession.process_create(command=command,
+                                                   arguments=arguments,
+                                                   environment=environment,
+                                                   flags=flags,
+                                                   timeout_ms=timeout)
+
+        return self._stream_output(process, command, arguments,
+                                   callback=callback, spool=spool)
+
+
+    def _wait_for_input_window(self, pid, timeout):
+        """waits until the process owns a window, which can take keyboard input
+
+        If the window can not be found, timeout is waited, since some
+        programs, like terminals, do not expose their pid to the window system
+        """
+        if self.os:
+            try:
+                self.os.wait_for_window(pid=pid, timeout=timeout)
+                return
+            except readiness.ReadinessTimeout:
+                return
+        time.sleep(timeout)
+
+
+    @check_running
+    @check_guestsession
+    def wait_for_file(self, path, timeout=60):
+        """Waits until a file exists in the guest
+
+        Arguments:
+            path - path of the file in the vm
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
+
+        Returns:
+            time in seconds it took for the file to show up
+        """
+        return readiness.poll_until(lambda: self.guestsession.file_exists(path),
+                                    timeout, "file " + path)
+
+
+    def _get_process_entry(self, pid):
+        """returns the log entry of a process started with run_process
+        """
+        entries = self.log.get_process(pid)
+        if not entries:
+            raise ValueError("no process with pid %d was started" % pid)
+        return entries[-1]
+
+
+    @check_running
+    @check_guestsession
+    def wait_for_process(self, pid, timeout=60):
+        """Waits until a process started with run_process(wait=False) exited
+
+        Arguments:
+            pid - process-id of the process
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
+
+        Returns:
+            time in seconds it took for the process to exit
+        """
+        entry = self._get_process_entry(pid)
+        process = entry.process
+        if process is None:
+            # finished already, when it was logged
+            return 0
+        waited = readiness.poll_until(lambda: self._terminated(process),
+                                      timeout, "exit of process %d" % pid)
+        entry.release_process()
+        return waited
+
+
+    @check_running
+    @check_guestsession
+    def wait_for_output(self, pid, text, timeout=60):
+        """Waits until a process wrote a string to stdout, like a prompt
+
+        The process needs to be started with run_process(capture_output=True),
+        the output read is appended to the log entry of the process.
+
+        Arguments:
+            pid - process-id of the process
+            text - string to wait for
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
+
+        Returns:
+            time in seconds it took for the text to show up
+        """
+        entry = self._get_process_entry(pid)
+
+        def text_found():
+            if entry.process is not None:
+                entry.stdout += _to_text(entry.process.read(1, 65000, 0))
+            return text in entry.stdout
+
+        return readiness.poll_until(text_found, timeout,
+                                    "output %r of process %d" % (text, pid))
+
+
+    @check_running
+    def wait_for_ip(self, adapter=0, timeout=120, previous=None):
+        """Waits until the guest reports an IPv4 address for the adapter
+
+        Needs guest additions installed, see get_ip
+
+        Arguments:
+            adapter - internal number of the network adapter, range 0-7
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
+            previous - an address to ignore, for example the one from before
+                changing the network
+
+        Returns:
+            ip-address
+        """
+        def lease():
+            ip = self.get_ip(adapter)
+            return ip and ip != previous
+
+        readiness.poll_until(lease, timeout, "ip address of adapter %d"
+                             % adapter)
+        return self.get_ip(adapter)
+
+
     @check_running
     @check_guestsession
     def kill_and_check_output(self, pid=0, timeout=0):
@@ -744,14 +1520,17 @@ class Vbox():
             pid - process-id of the process to kill
             timeout - timeout in milliseconds
         """
-        plist = self.log.get_log_object_by_type(logger.LogProcess)
         # this list should only contain 1 entry, since pid collisions are very
         # unlikely
-        po = [each for each in plist if each.pid == pid][0]
+        po = self.log.get_process(pid)[0]
 
+        if po.process is None:
+            # finished already, all output is logged
+            return
         po.process.terminate()
-        po.stdin += po.process.read(1, 65000, timeout)
-        po.stderr += po.process.read(2, 65000, timeout)
+        po.stdin += _to_text(po.process.read(1, 65000, timeout))
+        po.stderr += _to_text(po.process.read(2, 65000, timeout))
+        po.release_process()
 
 
     @check_running
@@ -769,7 +1548,7 @@ class Vbox():
 
     @check_running
     @check_guestsession
-    def copy_to_vm(self, source, dest, wait=True):
+    def copy_to_vm(self, source, dest, wait=True, extra_hashes=[]):
         """Copy a file form outside into the VM
 
         This leaves no plausible trace for faking, so use with care
@@ -777,12 +1556,15 @@ class Vbox():
         Arguments:
             source - source path on the host
             dest - destination path in the vm
+            extra_hashes - hashlib names of digests to log in addition to md5
+                and sha256, like 'sha1' or 'blake2b'
         """
 
         progress = self.guestsession.copy_to(source, dest, [])
 
         self.log.add_file(source=source, destination=dest,
-                          time_offset=self.offset, time_rate=self.speedup)
+                          time_offset=self.offset, time_rate=self.speedup,
+                          extra_hashes=extra_hashes)
 
         if wait:
             progress.wait_for_completion()
@@ -810,6 +1592,178 @@ class Vbox():
             return progress
 
 
+    def _guest_sep(self):
+        """returns the path separator of the guest
+        """
+        if isinstance(self.os, oswindows.OSWindows):
+            return "\\"
+        return "/"
+
+
+    def _wait_tree_progress(self, progress):
+        """waits for a directory copy, returns False if it failed
+        """
+        progress.wait_for_completion()
+        return progress.result_code == 0
+
+
+    def _list_guest_tree(self, path):
+        """returns the directories and files below path in the guest, relative
+        to it, using the guest separator
+        """
+        sep = self._guest_sep()
+        # pyvbox appends _p to names of builtins, file is one on Python 2
+        obj_type = virtualbox.library.FsObjType
+        regular_file = getattr(obj_type, 'file_p', None) or obj_type.file
+        dirs = []
+        files = []
+        pending = [""]
+        while pending:
+            rel = pending.pop()
+            directory = self.guestsession.directory_open(
+                path + sep + rel if rel else path, "", [])
+            try:
+                while True:
+                    try:
+                        info = directory.read()
+                    except Exception:
+                        # VBOX_E_OBJECT_NOT_FOUND marks the end of the listing
+                        break
+                    if info.name in (".", ".."):
+                        continue
+                    child = rel + sep + info.name if rel else info.name
+                    if info.type_p == virtualbox.library.FsObjType.directory:
+                        dirs.append(child)
+                        pending.append(child)
+                    elif info.type_p == regular_file:
+                        files.append(child)
+            finally:
+                directory.close()
+        return sorted(dirs), sorted(files)
+
+
+    @check_running
+    @check_guestsession
+    def copy_tree_to_vm(self, source, dest, workers=4, extra_hashes=[]):
+        """Copy a directory tree from outside into the VM
+
+        The guest session copies the whole directory at once, if VirtualBox
+        supports it, otherwise up to workers files are copied at the same
+        time. Meanwhile the files are hashed on the host in parallel and
+        logged as a single copiedTree entry, containing one copiedFile entry
+        per file.
+
+        This leaves no plausible trace for faking, so use with care
+
+        Arguments:
+            source - source directory on the host
+            dest - destination directory in the vm
+            workers - maximum number of files copied or hashed at the same time
+            extra_hashes - hashlib names of digests to log in addition to md5
+                and sha256, like 'sha1' or 'blake2b'
+        """
+        sep = self._guest_sep()
+        dirs, files = _host_tree(source)
+
+        try:
+            progress = self.guestsession.directory_copy_to_guest(
+                source, dest,
+                [virtualbox.library.DirectoryCopyFlag.copy_into_existing])
+        except _NOT_SUPPORTED:
+            # not implemented before VirtualBox 5.0
+            progress = None
+
+        # entries hold references in the file store, which are released
+        # again, unless the tree is logged
+        created = []
+
+        def log_file(rel):
+            entry = logger.LogCopiedFile(
+                source=os.path.join(source, rel),
+                destination=dest + sep + rel.replace(os.sep, sep),
+                time_offset=self.offset, time_rate=self.speedup,
+                extra_hashes=extra_hashes, store=self.log.store)
+            created.append(entry)
+            return entry
+
+        logged = False
+        try:
+            entries = _parallel(log_file, files, workers)
+
+            if progress is None or not self._wait_tree_progress(progress):
+                flags = [virtualbox.library.DirectoryCreateFlag.parents]
+                self.guestsession.directory_create(dest, 0o755, flags)
+                for rel in dirs:
+                    self.guestsession.directory_create(
+                        dest + sep + rel.replace(os.sep, sep), 0o755, flags)
+
+                def copy_file(entry):
+                    progress = self.guestsession.copy_to(entry.source,
+                                                         entry.destination,
+                                                         [])
+                    progress.wait_for_completion()
+
+                _parallel(copy_file, entries, workers)
+
+            self.log.add_tree(source=source, destination=dest, files=entries,
+                              time_offset=self.offset, time_rate=self.speedup)
+            logged = True
+        finally:
+            if not logged:
+                for entry in created:
+                    entry.cleanup()
+
+
+    @check_running
+    @check_guestsession
+    def copy_tree_from_vm(self, source, dest, workers=4,
+                          hashes=('md5', 'sha256')):
+        """Copy a directory tree from the VM to the host
+
+        Like copy_tree_to_vm, the whole directory is copied at once, if
+        VirtualBox supports it, otherwise up to workers files at the same
+        time. Creates no log, since it should not alter the guest, the digests
+        of the copied files are returned instead.
+
+        Arguments:
+            source - source directory in the vm
+            dest - destination directory on the host
+            workers - maximum number of files copied or hashed at the same time
+            hashes - hashlib names of the digests to calculate
+
+        Returns:
+            dict mapping paths relative to dest to dicts of hex digests
+        """
+        try:
+            progress = self.guestsession.directory_copy_from_guest(
+                source, dest,
+                [virtualbox.library.DirectoryCopyFlag.copy_into_existing])
+        except _NOT_SUPPORTED:
+            progress = None
+
+        if progress is None or not self._wait_tree_progress(progress):
+            sep = self._guest_sep()
+            dirs, files = self._list_guest_tree(source)
+            for rel in [""] + dirs:
+                path = os.path.join(dest, *rel.split(sep))
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+
+            def copy_file(rel):
+                progress = self.guestsession.copy_from(
+                    source + sep + rel, os.path.join(dest, *rel.split(sep)))
+                progress.wait_for_completion()
+
+            _parallel(copy_file, files, workers)
+
+        _, files = _host_tree(dest)
+
+        def hash_one(rel):
+            return logger.hash_file(os.path.join(dest, rel), hashes)[1]
+
+        return dict(zip(files, _parallel(hash_one, files, workers)))
+
+
     @check_running
     def keyboard_input(self, key_input):
         """sends raw key-presses to the vm
@@ -916,7 +1870,7 @@ class Vbox():
 
     @check_running
     def add_to_nat_network(self, network_name="test_net", adapter=0,
-                           wait_time=20):
+                           wait_time=20, wait_for_ip=False):
         """Adds the VM to a NAT-network
 
         This enables multiple virtual machines to see each other and exchange
@@ -927,7 +1881,11 @@ class Vbox():
         Arguments:
             network_name - name of the the network the vm should be added to
             adapter - internal number of the network adapter, range 0-7
-            wait_time - time in seconds, how long the cable should be unplugged
+            wait_time - maximum time in seconds, how long the cable should be
+                unplugged, it is plugged in again as soon as the guest reports
+                the link as down
+            wait_for_ip - wait until the guest got a new address, see
+                wait_for_ip
         """
 
         network_name = network_name + USERTOKEN
@@ -938,13 +1896,23 @@ class Vbox():
         #allow VMs to see each other
         self.network.promisc_mode_policy = virtualbox.library.NetworkAdapterPromiscModePolicy.allow_network
         self.network.enabled = True
-        # to ensure the vm notices the network changes, we remove the cable for
-        # 5 seconds
+        # to ensure the vm notices the network changes, we remove the cable,
+        # until the guest reports the link as down
+        previous = self.get_ip(adapter)
         self.network.cable_connected = False
-        time.sleep(wait_time)
+        status = "/VirtualBox/GuestInfo/Net/" + str(adapter) + "/Status"
+        try:
+            readiness.poll_until(
+                lambda: self.session.machine.get_guest_property_value(status)
+                == "Down", wait_time, "link down")
+        except readiness.ReadinessTimeout:
+            pass
         self.network.cable_connected = True
         self.session.machine.save_settings()
 
+        if wait_for_ip:
+            self.wait_for_ip(adapter, previous=previous)
+
 
     @check_running
     def get_ip(self, adapter=0):
@@ -987,7 +1955,9 @@ class Vbox():
             rm_clone - remove the cloned virtual machine
         """
 
-        #Remove paths, which are stored in the log, works for files and dirs
+        #Remove paths, which are stored in the log, works for files and dirs,
+        #copied files are only released, the file store deletes them once no
+        #other vm refers to them anymore
         path = self.log.cleanup()
         while path:
             if os.path.isdir(path):
@@ -1019,3 +1989,304 @@ class Vbox():
                         return progress
                 except:
                     print("failed to remove disk")
+
+
+class ClonePool():
+    """Creates linked clones concurrently
+
+    Every clone is a Vbox in VboxMode.clone, created by one of a bounded
+    number of worker threads. Since linked clones only need the snapshot of
+    the base vm, setting up several machines takes about as long as a single
+    one. The snapshot is taken only once per base vm.
+
+    Example:
+        pool = ClonePool(workers=4)
+        for vbox in pool.create([("ubuntu-lts-base", "client1"),
+                                 ("windows-7-base", "client2")]):
+            vbox.start(wait=False)
+    """
+
+    def __init__(self, workers=4, linked_name="Forensig20Linked"):
+        """Initializes the pool
+
+        Arguments:
+            workers - maximum number of clones created at the same time
+            linked_name - name of the snapshot in the base vms
+        """
+        self.workers = workers
+        self.linked_name = linked_name
+
+
+    def _worker(self, jobs, results):
+        """takes (index, basename, clonename) from jobs until it is empty
+        """
+        while True:
+            try:
+                index, basename, clonename = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                vbox = Vbox(basename=basename, clonename=clonename,
+                            mode=VboxMode.clone, linked_name=self.linked_name)
+                results.put((index, vbox, None))
+            except Exception as e:
+                results.put((index, None, e))
+
+
+    def _run(self, specs):
+        """starts the workers and yields (index, vbox) in completion order
+        """
+        jobs = queue.Queue()
+        results = queue.Queue()
+        for index, (basename, clonename) in enumerate(specs):
+            jobs.put((index, basename, clonename))
+
+        threads = []
+        for _ in range(min(self.workers, len(specs))):
+            thread = threading.Thread(target=self._worker,
+                                      args=(jobs, results))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for _ in range(len(specs)):
+            index, vbox, error = results.get()
+            if error is not None:
+                raise error
+            yield index, vbox
+
+
+    def create(self, specs):
+        """Creates clones, yielding each Vbox as soon as it is ready
+
+        If creating one clone fails, the exception is raised, when its result
+        would have been yielded. Clones still in progress are finished by the
+        workers and need to be cleaned up by hand.
+
+        Arguments:
+            specs - list of (basename, clonename) tuples
+
+        Returns:
+            generator of Vbox instances, in order of completion
+        """
+        specs = list(specs)
+        for _, vbox in self._run(specs):
+            yield vbox
+
+
+    def create_all(self, specs):
+        """Creates clones and waits for all of them
+
+        Arguments:
+            specs - list of (basename, clonename) tuples
+
+        Returns:
+            list of Vbox instances, in the same order as specs
+        """
+        specs = list(specs)
+        ret = [None] * len(specs)
+        for index, vbox in self._run(specs):
+            ret[index] = vbox
+        return ret
+
+
+class WarmPool():
+    """Keeps booted clones of one base vm ready for use
+
+    On first use, the base vm is booted until a guest session can be created
+    and then frozen with StopMode.save_state into the snapshot warm_name.
+    The saved state of the base vm itself is discarded afterwards, so it is
+    powered off again, as before.
+    Linked clones of this snapshot resume the logged in desktop instead of
+    booting, the pool keeps size of them running with a guest session and
+    refills itself in the background, whenever one is handed out.
+
+    Example:
+        pool = WarmPool("ubuntu-lts-base", size=2)
+        vbox = pool.acquire()
+        vbox.os.open_browser("github.com")
+        vbox.stop()
+        vbox.cleanup_and_delete()
+        pool.close()
+    """
+
+    def __init__(self, basename, size=2, username="default", password="12345",
+                 session_type=SessionType.headless,
+                 warm_name="Forensig20Warm", timeout=600, max_failures=3):
+        """Initializes the pool and starts filling it
+
+        Arguments:
+            basename - must be in VboxInfo.list_vms(), needs to be stopped
+            size - number of clones kept ready
+            username - user of the guest sessions
+            password - password of the guest sessions
+            session_type - SessionType used to start the clones
+            warm_name - name of the saved state snapshot in the base vm
+            timeout - time in seconds, a clone may take to get ready
+            max_failures - refilling stops after this many failures in a row
+        """
+        if not isinstance(session_type, SessionType):
+            raise TypeError("session_type needs to be of type SessionType")
+
+        self.basename = basename
+        self.size = size
+        self.username = username
+        self.password = password
+        self.session_type = session_type
+        self.warm_name = warm_name
+        self.timeout = timeout
+        self.max_failures = max_failures
+
+        self.ready = []
+        self.pending = 0
+        self.failures = 0
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+
+        self.refill_thread = threading.Thread(target=self._refill)
+        self.refill_thread.daemon = True
+        self.refill_thread.start()
+
+
+    def _prepare_base(self):
+        """boots the base vm to a logged in desktop and saves its state
+        """
+        base = Vbox(basename=self.basename, mode=VboxMode.use)
+        base.start(session_type=self.session_type, target=BootTarget.launched)
+        base.wait_for_boot(target=BootTarget.session, timeout=self.timeout,
+                           username=self.username, password=self.password)
+        base.stop(stop_mode=StopMode.save_state)
+        base.unlock()
+
+
+    def _discard_base_state(self):
+        """powers off the base vm again, once the snapshot holds its state
+        """
+        base = virtualbox.VirtualBox().find_machine(self.basename)
+        session = base.create_session(
+            lock_type=virtualbox.library.LockType.write)
+        try:
+            session.machine.discard_saved_state(True)
+        finally:
+            session.unlock_machine()
+
+
+    def _make_warm(self):
+        """creates one clone and resumes it until a guest session is ready
+        """
+        vbox = None
+        try:
+            _find_or_take_snapshot(virtualbox.VirtualBox(), self.basename,
+                                   self.warm_name, prepare=self._prepare_base,
+                                   finish=self._discard_base_state)
+            clonename = "warm_%s_%s%s" % (self.basename, uuid.uuid4().hex[:8],
+                                          USERTOKEN)
+            vbox = Vbox(basename=self.basename, clonename=clonename,
+                        mode=VboxMode.clone, linked_name=self.warm_name)
+            vbox.start(session_type=self.session_type,
+                       target=BootTarget.launched)
+            vbox.wait_for_boot(target=BootTarget.session, timeout=self.timeout,
+                               username=self.username, password=self.password)
+        except Exception as e:
+            print("warm clone of " + self.basename + " failed: " + str(e))
+            if vbox is not None:
+                # the clone is registered already
+                self._discard(vbox)
+            with self.condition:
+                self.pending -= 1
+                self.failures += 1
+                self.error = e
+                self.condition.notify_all()
+            return
+
+        with self.condition:
+            self.pending -= 1
+            self.failures = 0
+            closed = self.closed
+            if not closed:
+                self.ready.append(vbox)
+            self.condition.notify_all()
+        if closed:
+            self._discard(vbox)
+
+
+    def _refill(self):
+        """background thread, creating clones until the pool is full
+        """
+        while True:
+            with self.condition:
+                while not self.closed and \
+                        (len(self.ready) + self.pending >= self.size or
+                         self.failures >= self.max_failures):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                missing = self.size - len(self.ready) - self.pending
+                self.pending += missing
+
+            for _ in range(missing):
+                thread = threading.Thread(target=self._make_warm)
+                thread.daemon = True
+                thread.start()
+
+
+    def _discard(self, vbox):
+        """powers off and deletes a clone, which is not needed anymore
+        """
+        try:
+            vbox.stop(stop_mode=StopMode.poweroff)
+        except Exception as e:
+            print("failed to power off warm clone: " + str(e))
+            # the clone is removed anyway
+            vbox.unlock()
+            vbox._mark_stopped()
+        try:
+            vbox.cleanup_and_delete()
+        except Exception as e:
+            print("failed to remove warm clone: " + str(e))
+
+
+    def acquire(self, timeout=None):
+        """Hands out a running clone with a guest session
+
+        The clone belongs to the caller afterwards, it needs to be stopped and
+        removed with cleanup_and_delete() as any other clone.
+
+        Arguments:
+            timeout - time in seconds to wait for a clone, None waits forever
+
+        Returns:
+            Vbox instance, or None on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not self.ready:
+                if self.closed:
+                    raise RuntimeError("WarmPool is closed")
+                if self.failures >= self.max_failures and not self.pending:
+                    raise self.error
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait(remaining)
+            vbox = self.ready.pop(0)
+            self.condition.notify_all()
+            return vbox
+
+
+    def close(self):
+        """Stops refilling and removes all clones, which were not handed out
+
+        Clones still booting are removed, as soon as they are ready
+        """
+        with self.condition:
+            self.closed = True
+            ready = self.ready
+            self.ready = []
+            self.condition.notify_all()
+        for vbox in ready:
+            self._discard(vbox)
@@ -1 +1,5 @@
-__all__ = ["logger", "oslinux", "oswindows", "param"]
+__all__ = ["logger", "oslinux", "oswindows", "param", "readiness", "scenario",
+           "batch", "sessionpool", "filestore",
+           "isocache", "exporters", "analysis", "timeline",
+           "vdi", "diff", "rawexport",
+           "blockhash", "archive"]
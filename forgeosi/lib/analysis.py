@@ -0,0 +1,376 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+#python 2 compatibility
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+try:
+    from . import logger  # local import
+    from . import exporters  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    import logger  # local import
+    import exporters  # local import
+
+__doc__ = """\
+Collects the logs of many test runs into a SQLite database and answers
+questions across all runs, see class documentation for details
+
+Usage as a script:
+    analysis.py scan <output dir> [--db runs.sqlite] [--workers 8]
+    analysis.py warnings [--db runs.sqlite]
+    analysis.py keyboard [--db runs.sqlite]
+    analysis.py differing-files [--db runs.sqlite]
+    analysis.py sql "<query>" [--db runs.sqlite]
+"""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    run_id INTEGER,
+    mtime REAL,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS entries (
+    source TEXT,
+    run_id INTEGER,
+    seq INTEGER,
+    type TEXT,
+    time REAL,
+    pid INTEGER,
+    path TEXT,
+    text TEXT,
+    key_input TEXT,
+    fields TEXT
+);
+CREATE TABLE IF NOT EXISTS copied (
+    source TEXT,
+    run_id INTEGER,
+    destination TEXT,
+    sha256sum TEXT,
+    md5sum TEXT,
+    filesize INTEGER
+);
+CREATE TABLE IF NOT EXISTS idiff (
+    source TEXT,
+    run_id INTEGER,
+    section TEXT,
+    line TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_type ON entries (type, run_id, seq);
+CREATE INDEX IF NOT EXISTS entries_run ON entries (run_id, seq);
+CREATE INDEX IF NOT EXISTS entries_source ON entries (source);
+CREATE INDEX IF NOT EXISTS copied_destination ON copied (destination);
+CREATE INDEX IF NOT EXISTS copied_source ON copied (source);
+CREATE INDEX IF NOT EXISTS idiff_source ON idiff (source);
+"""
+
+NODE_NAMES = dict((cls.__name__, cls.node_name)
+                  for cls in logger._LogEntry.__subclasses__())
+"""XML node names by entry class, to store exported logs like XML logs"""
+
+TEXT_FIELDS = {'keyboard_input': 'key_input', 'warning': 'warning',
+               'process': 'path', 'ReadableArg': 'args', 'cd': 'path',
+               'copiedFile': 'destination', 'copiedTree': 'destination'}
+"""field of each type, stored in the column text for easy queries"""
+
+
+def is_log(name):
+    """checks if a file name belongs to a log written by Logger
+    """
+    for ext in (".xml", ".xml.gz", ".jsonl", ".jsonl.gz"):
+        if name.startswith("log") and name.endswith(ext):
+            return True
+    return False
+
+
+def _xml_entries(path):
+    """yields (type, fields) of a log written with write_xml_log
+    """
+    def walk(node):
+        fields = {}
+        children = []
+        for child in node:
+            if len(child):
+                children.append(child)
+            else:
+                fields[child.tag] = child.text or ''
+        yield node.tag, fields
+        for child in children:
+            for each in walk(child):
+                yield each
+
+    root = logger.read_xml_log(path)
+    for node in root:
+        for each in walk(node):
+            yield each
+
+
+def _jsonl_entries(path):
+    """yields (type, fields) of a log exported with Logger.export
+    """
+    for record in exporters.get_exporter("jsonl").load(path):
+        kind = NODE_NAMES.get(record.pop("type"), "entry")
+        files = record.pop("files", [])
+        yield kind, record
+        for each in files:
+            yield NODE_NAMES["LogCopiedFile"], each
+
+
+def _idiff_lines(path):
+    """yields (section, line) of the output of idifference
+
+    Lines ending with a colon start a new section, like "New files:".
+    """
+    section = ""
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip()
+            if not line:
+                continue
+            if line.endswith(":") and not line.startswith(" "):
+                section = line[:-1]
+                continue
+            yield section, line
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_source(path):
+    """Parses one file of a run, runs in the worker processes
+
+    Returns:
+        dict with lists of rows for the tables entries, copied and idiff
+    """
+    ret = {'entries': [], 'copied': [], 'idiff': []}
+    name = os.path.basename(path)
+    if name == "idiff.log":
+        ret['idiff'] = list(_idiff_lines(path))
+        return ret
+
+    if ".jsonl" in name:
+        entries = _jsonl_entries(path)
+    else:
+        entries = _xml_entries(path)
+    for seq, (kind, fields) in enumerate(entries):
+        text = fields.get(TEXT_FIELDS.get(kind, ''), '')
+        ret['entries'].append((seq, kind, _to_float(fields.get('time')),
+                               _to_int(fields.get('pid')),
+                               fields.get('path'),
+                               text if isinstance(text, str) else str(text),
+                               fields.get('key_input') or None,
+                               json.dumps(fields, default=str)))
+        if kind == 'copiedFile':
+            ret['copied'].append((fields.get('destination'),
+                                  fields.get('sha256sum'),
+                                  fields.get('md5sum'),
+                                  _to_int(fields.get('filesize'))))
+    return ret
+
+
+class RunDatabase():
+    """SQLite database of the logs of many runs
+
+    Every directory below the scanned one, which contains a log (log*.xml,
+    log*.jsonl, optionally gzip compressed) or an idiff.log, is a run. The
+    files are parsed in parallel worker processes. Every file is remembered
+    with its size and mtime, so scanning again only parses new or changed
+    files.
+
+    Example:
+        db = RunDatabase("runs.sqlite")
+        db.scan("/data/testcase01")
+        for path, count in db.runs_with_warnings():
+            print(path, count)
+    """
+
+    def __init__(self, path="runs.sqlite"):
+        """
+        Arguments:
+            path - file of the database, created if missing
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+
+    def close(self):
+        self.db.close()
+
+
+    def _run_id(self, path):
+        self.db.execute("INSERT OR IGNORE INTO runs (path) VALUES (?)",
+                        (path,))
+        return self.db.execute("SELECT id FROM runs WHERE path = ?",
+                               (path,)).fetchone()[0]
+
+
+    def _changed_sources(self, root):
+        """returns (run directory, file, mtime, size) of all new or changed
+        files below root
+        """
+        known = dict((row[0], (row[1], row[2])) for row in
+                     self.db.execute("SELECT path, mtime, size FROM sources"))
+        ret = []
+        for directory, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                if not (is_log(name) or name == "idiff.log"):
+                    continue
+                path = os.path.abspath(os.path.join(directory, name))
+                stat = os.stat(path)
+                if known.get(path) != (stat.st_mtime, stat.st_size):
+                    ret.append((os.path.abspath(directory), path,
+                                stat.st_mtime, stat.st_size))
+        return ret
+
+
+    def scan(self, root, workers=None):
+        """Adds all new or changed logs below root
+
+        Arguments:
+            root - directory, usually the output directory of runtest.sh
+            workers - number of worker processes, default one per cpu
+
+        Returns:
+            number of parsed files
+        """
+        changed = self._changed_sources(root)
+        if not changed:
+            return 0
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.imap(parse_source, [x[1] for x in changed])
+            for (directory, path, mtime, size), rows in zip(changed, results):
+                run_id = self._run_id(directory)
+                for table in ("entries", "copied", "idiff"):
+                    self.db.execute("DELETE FROM %s WHERE source = ?" % table,
+                                    (path,))
+                self.db.executemany(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(path, run_id) + row for row in rows['entries']])
+                self.db.executemany(
+                    "INSERT INTO copied VALUES (?, ?, ?, ?, ?, ?)",
+                    [(path, run_id) + row for row in rows['copied']])
+                self.db.executemany(
+                    "INSERT INTO idiff VALUES (?, ?, ?, ?)",
+                    [(path, run_id) + row for row in rows['idiff']])
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                    (path, run_id, mtime, size))
+            self.db.commit()
+        finally:
+            pool.close()
+            pool.join()
+        return len(changed)
+
+
+    def query(self, sql, args=()):
+        """Runs any query, returns a list of rows
+        """
+        return self.db.execute(sql, args).fetchall()
+
+
+    def runs_with_warnings(self):
+        """Returns (run directory, number of warnings) of all runs with
+        warnings
+        """
+        return self.query(
+            "SELECT runs.path, COUNT(*) FROM entries "
+            "JOIN runs ON runs.id = entries.run_id "
+            "WHERE entries.type = 'warning' "
+            "GROUP BY runs.path ORDER BY runs.path")
+
+
+    def keyboard_timeline(self):
+        """Returns (run directory, log file, position, time, input) of all
+        keyboard input of all runs, including input to processes
+
+        XML logs do not contain times, their entries are ordered by position.
+        """
+        return self.query(
+            "SELECT runs.path, entries.source, entries.seq, entries.time, "
+            "entries.key_input FROM entries "
+            "JOIN runs ON runs.id = entries.run_id "
+            "WHERE entries.key_input IS NOT NULL "
+            "ORDER BY runs.path, entries.source, entries.seq")
+
+
+    def differing_files(self):
+        """Returns (destination, number of distinct sha256sums, runs) of all
+        files, which were copied with different content in different runs
+        """
+        return self.query(
+            "SELECT destination, COUNT(DISTINCT sha256sum), "
+            "GROUP_CONCAT(DISTINCT run_id) FROM copied "
+            "GROUP BY destination HAVING COUNT(DISTINCT sha256sum) > 1 "
+            "ORDER BY destination")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="query logs of many runs")
+    parser.add_argument("--db", default="runs.sqlite",
+                        help="database file, default runs.sqlite")
+    commands = parser.add_subparsers(dest="command")
+    scan = commands.add_parser("scan", help="add new runs below a directory")
+    scan.add_argument("root")
+    scan.add_argument("--workers", type=int, default=None)
+    commands.add_parser("warnings", help="runs with warnings")
+    commands.add_parser("keyboard", help="keyboard input of all runs")
+    commands.add_parser("differing-files",
+                        help="copied files, which differ between runs")
+    sql = commands.add_parser("sql", help="run any query")
+    sql.add_argument("query")
+    args = parser.parse_args(argv)
+
+    db = RunDatabase(args.db)
+    try:
+        if args.command == "scan":
+            print("parsed %d files" % db.scan(args.root, args.workers))
+            return
+        elif args.command == "warnings":
+            rows = db.runs_with_warnings()
+        elif args.command == "keyboard":
+            rows = db.keyboard_timeline()
+        elif args.command == "differing-files":
+            rows = db.differing_files()
+        elif args.command == "sql":
+            rows = db.query(args.query)
+        else:
+            parser.print_help()
+            return
+        for row in rows:
+            print("\t".join([str(x) for x in row]))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,525 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+#python 2 compatibility
+from __future__ import print_function
+
+import argparse
+import bisect
+import collections
+import hashlib
+import io
+import os
+import sqlite3
+import struct
+import sys
+import zlib
+try:
+    from .vdi import is_zero  # local import
+    from .blockhash import BlockHashes  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    from vdi import is_zero  # local import
+    from blockhash import BlockHashes  # local import
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__doc__ = """\
+Deduplicating archive for the disk images of many runs of the same base VM,
+see class documentation for details
+
+Usage as a script:
+    archive.py <archive> add <name> <image> [--base <name>]
+        [--changed <base.blockhashes> <image.blockhashes>]
+    archive.py <archive> restore <name> <image>
+    archive.py <archive> list
+"""
+
+
+MIN_CHUNK = 16 * 1024
+AVERAGE_CHUNK = 64 * 1024
+MAX_CHUNK = 256 * 1024
+"""Sizes of the chunks, their boundaries are found by a rolling hash"""
+
+READ_SIZE = 8 * 1024 * 1024
+"""Bytes read at once from an image, while chunking it"""
+
+PACK_SIZE = 1024 * 1024 * 1024
+"""Size, after which a new pack file is started"""
+
+CACHED_CHUNKS = 64
+"""Decompressed chunks kept by an archive for random access"""
+
+_MASK = AVERAGE_CHUNK - 1
+_WINDOW = 32
+_GEAR = [struct.unpack("<I", hashlib.sha256(struct.pack("B", i)).digest()[:4])[0]
+         for i in range(256)]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    digest TEXT PRIMARY KEY,
+    pack INTEGER,
+    offset INTEGER,
+    stored INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    base TEXT,
+    identity TEXT
+);
+CREATE TABLE IF NOT EXISTS extents (
+    image TEXT,
+    offset INTEGER,
+    size INTEGER,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS extents_image ON extents (image, offset);
+"""
+
+ZERO_PACK = -1
+"""Pack number of chunks containing only zeros, which are not stored"""
+
+
+def _cut_candidates(data, skip):
+    """returns the positions in data, after which the rolling hash allows a
+    chunk boundary, the first skip bytes are only used as context
+
+    The hash of a position depends on the 32 bytes up to it only, it is the
+    gear hash of FastCDC. With NumPy, the sums over the window are built by
+    doubling the window five times, instead of looping over every byte.
+    """
+    if numpy is not None:
+        h = numpy.array(_GEAR, dtype=numpy.uint32)[
+            numpy.frombuffer(data, dtype=numpy.uint8)]
+        width = 1
+        while width < _WINDOW:
+            h[width:] = h[width:] + (h[:-width] << numpy.uint32(width))
+            width *= 2
+        ret = numpy.nonzero((h[skip:] & _MASK) == 0)[0] + skip + 1
+        return ret.tolist()
+
+    ret = []
+    h = 0
+    for position, byte in enumerate(bytearray(data)):
+        h = ((h << 1) + _GEAR[byte]) & 0xffffffff
+        if position >= skip and not h & _MASK:
+            ret.append(position + 1)
+    return ret
+
+
+def chunk_stream(source, length):
+    """Splits the next length bytes of a file object into chunks, whose
+    boundaries depend on their content only, so inserting or removing data
+    only changes the chunks around it
+
+    Yields:
+        chunks as bytes
+    """
+    context = b""
+    buf = b""
+    remaining = length
+    while True:
+        new = source.read(min(READ_SIZE, remaining)) if remaining else b""
+        remaining -= len(new)
+        end = not new
+        buf += new
+        if not end and len(buf) < MAX_CHUNK:
+            continue
+
+        candidates = [x - len(context) for x in
+                      _cut_candidates(context + buf, len(context))]
+        start = 0
+        while True:
+            position = bisect.bisect_left(candidates, start + MIN_CHUNK)
+            if position < len(candidates) and \
+                    candidates[position] - start <= MAX_CHUNK:
+                cut = candidates[position]
+            elif len(buf) - start >= MAX_CHUNK:
+                cut = start + MAX_CHUNK
+            else:
+                break
+            yield buf[start:cut]
+            start = cut
+        context = (context + buf[:start])[-(_WINDOW - 1):]
+        buf = buf[start:]
+        if end:
+            if buf:
+                yield buf
+            return
+
+
+def _open_source(source):
+    if hasattr(source, "read"):
+        return source, False
+    return open(source, "rb"), True
+
+
+class Archive():
+    """Stores disk images, which mostly share their content, only once
+
+    Images are split into chunks of 16 to 256 KiB with content defined
+    boundaries, every distinct chunk is stored once, compressed, in large
+    pack files. The first image, usually the base image of the VM, stores
+    most chunks, the disks of the runs only add the chunks they changed. An
+    SQLite index maps the extents of every image to chunks, so any image can
+    be restored or read at any offset, without restoring others.
+
+    Runs only write to a few parts of the disk. If these parts are known,
+    from the differencing image of the clone or from block digests, see
+    lib/blockhash.py, only they are read and chunked, everything else is
+    taken from the base image. The archive is meant to be written by one
+    process at a time.
+
+    Example:
+        archive = Archive("/data/testcase01.archive")
+        archive.add("base", "base.img")
+        archive.add("run1", "1/disk.img", base="base")
+        archive.restore("run1", "/tmp/disk.img")
+        disk = archive.open("run1")
+        disk.seek(1024 * 1024)
+        data = disk.read(512)
+    """
+
+    def __init__(self, path, compression=3):
+        """
+        Arguments:
+            path - directory of the archive, created if missing
+            compression - zlib level of the stored chunks
+        """
+        self.path = path
+        self.compression = compression
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"))
+        self.db.executescript(SCHEMA)
+        columns = [x[1] for x in self.db.execute("PRAGMA table_info(images)")]
+        if "identity" not in columns:
+            # archives written before images had an identity
+            self.db.execute("ALTER TABLE images ADD COLUMN identity TEXT")
+        self.packs = {}
+        self.cache = collections.OrderedDict()
+        row = self.db.execute("SELECT MAX(pack) FROM chunks").fetchone()
+        self.pack = max(row[0] or 0, 0)
+
+
+    def close(self):
+        for f in self.packs.values():
+            f.close()
+        self.packs = {}
+        self.db.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _pack_path(self, pack):
+        return os.path.join(self.path, "pack-%06d" % pack)
+
+
+    def _pack_file(self, pack):
+        if pack not in self.packs:
+            path = self._pack_path(pack)
+            if not os.path.exists(path):
+                open(path, "wb").close()
+            self.packs[pack] = open(path, "r+b")
+        return self.packs[pack]
+
+
+    def _store(self, data):
+        """stores a chunk, unless it is known, returns its digest and the
+        number of newly stored bytes
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if self.db.execute("SELECT 1 FROM chunks WHERE digest = ?",
+                           (digest,)).fetchone():
+            return digest, 0
+        if is_zero(data):
+            self.db.execute("INSERT INTO chunks VALUES (?, ?, 0, 0, ?)",
+                            (digest, ZERO_PACK, len(data)))
+            return digest, 0
+
+        stored = zlib.compress(data, self.compression)
+        f = self._pack_file(self.pack)
+        f.seek(0, os.SEEK_END)
+        if f.tell() + len(stored) > PACK_SIZE and f.tell():
+            self.pack += 1
+            f = self._pack_file(self.pack)
+        offset = f.tell()
+        f.write(stored)
+        self.db.execute("INSERT INTO chunks VALUES (?, ?, ?, ?, ?)",
+                        (digest, self.pack, offset, len(stored), len(data)))
+        return digest, len(stored)
+
+
+    def read_chunk(self, digest):
+        """Returns the data of a chunk, recently used chunks are cached
+        """
+        if digest in self.cache:
+            data = self.cache.pop(digest)
+            self.cache[digest] = data
+            return data
+        pack, offset, stored, size = self.db.execute(
+            "SELECT pack, offset, stored, size FROM chunks WHERE digest = ?",
+            (digest,)).fetchone()
+        if pack == ZERO_PACK:
+            data = b"\0" * size
+        else:
+            f = self._pack_file(pack)
+            f.seek(offset)
+            data = zlib.decompress(f.read(stored))
+        self.cache[digest] = data
+        if len(self.cache) > CACHED_CHUNKS:
+            self.cache.popitem(last=False)
+        return data
+
+
+    def extents(self, name):
+        """Returns (offset, size, digest) of all chunks of an image in order
+        """
+        return self.db.execute(
+            "SELECT offset, size, digest FROM extents WHERE image = ? "
+            "ORDER BY offset", (name,)).fetchall()
+
+
+    def images(self):
+        """Returns (name, size, base) of all images
+        """
+        return self.db.execute(
+            "SELECT name, size, base FROM images ORDER BY name").fetchall()
+
+
+    def identity(self, name):
+        """Returns the identity given, when the image was added, or None
+        """
+        row = self.db.execute("SELECT identity FROM images WHERE name = ?",
+                              (name,)).fetchone()
+        if row is None:
+            raise KeyError("no image %s in %s" % (name, self.path))
+        return row[0]
+
+
+    def size(self, name):
+        row = self.db.execute("SELECT size FROM images WHERE name = ?",
+                              (name,)).fetchone()
+        if row is None:
+            raise KeyError("no image %s in %s" % (name, self.path))
+        return row[0]
+
+
+    def _regions(self, size, base, changed):
+        """returns the extents reused from base and the regions, which need
+        to be chunked, both as sorted lists
+        """
+        if base is None or changed is None or self.size(base) != size:
+            return [], [(0, size)]
+
+        changed = sorted(changed)
+        reused = []
+        regions = []
+        position = 0
+        for offset, length, digest in self.extents(base):
+            end = offset + length
+            # changed parts ending before this extent are done
+            while position < len(changed) and \
+                    changed[position][0] + changed[position][1] <= offset:
+                position += 1
+            dirty = position < len(changed) and changed[position][0] < end
+            if not dirty:
+                reused.append((offset, length, digest))
+            elif regions and regions[-1][0] + regions[-1][1] == offset:
+                regions[-1] = (regions[-1][0], regions[-1][1] + length)
+            else:
+                regions.append((offset, length))
+        return reused, regions
+
+
+    def add(self, name, source, base=None, changed=None, identity=None):
+        """Adds an image to the archive, replacing an image of the same name
+
+        Arguments:
+            name - name of the image in the archive
+            source - path of a RAW image or a seekable file object, like
+                vdi.VdiChain.raw()
+            base - name of an archived image, source was derived from
+            changed - list of (offset, length) of all parts of source, which
+                may differ from base, everything else is taken from base
+                without reading it. Without, the whole source is read.
+            identity - optional string, identifying the source, like the
+                UUIDs of a VDI image, to check later, if an image was made
+                from it, see identity()
+
+        Returns:
+            number of bytes newly stored in the archive
+        """
+        source, opened = _open_source(source)
+        try:
+            size = source.seek(0, os.SEEK_END)
+            if size is None:
+                size = source.tell()
+            extents, regions = self._regions(size, base, changed)
+            stored = 0
+            for offset, length in regions:
+                source.seek(offset)
+                for data in chunk_stream(source, length):
+                    digest, new = self._store(data)
+                    extents.append((offset, len(data), digest))
+                    offset += len(data)
+                    stored += new
+        finally:
+            if opened:
+                source.close()
+
+        for f in self.packs.values():
+            f.flush()
+        self.db.execute("DELETE FROM extents WHERE image = ?", (name,))
+        self.db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                        (name, size, base, identity))
+        self.db.executemany("INSERT INTO extents VALUES (?, ?, ?, ?)",
+                            [(name,) + x for x in extents])
+        self.db.commit()
+        return stored
+
+
+    def open(self, name):
+        """Returns a read only, seekable file object of an archived image
+        """
+        return ArchivedImage(self, name)
+
+
+    def restore(self, name, path):
+        """Writes an archived image to path as a sparse RAW image
+        """
+        zero = set(x[0] for x in self.db.execute(
+            "SELECT digest FROM chunks WHERE pack = ?", (ZERO_PACK,)))
+        with open(path, "wb") as f:
+            f.truncate(self.size(name))
+            for offset, length, digest in self.extents(name):
+                if digest in zero:
+                    continue
+                f.seek(offset)
+                f.write(self.read_chunk(digest))
+
+
+    def stats(self):
+        """Returns a dict with the size of all images and the stored bytes
+        """
+        images = self.db.execute("SELECT SUM(size) FROM images").fetchone()[0]
+        stored = self.db.execute("SELECT SUM(stored) FROM chunks").fetchone()[0]
+        chunks = self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return {'images': images or 0, 'stored': stored or 0,
+                'chunks': chunks}
+
+
+class ArchivedImage(io.RawIOBase):
+    """Read only, seekable view of an image in an Archive, only the chunks,
+    which are read, are decompressed
+    """
+
+    def __init__(self, archive, name):
+        io.RawIOBase.__init__(self)
+        self.archive = archive
+        self.size = archive.size(name)
+        extents = archive.extents(name)
+        self.offsets = [x[0] for x in extents]
+        self.digests = [x[2] for x in extents]
+        self.position = 0
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def tell(self):
+        return self.position
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("invalid whence %r" % whence)
+        if position < 0:
+            raise ValueError("negative seek position %d" % position)
+        self.position = position
+        return position
+
+
+    def readinto(self, buf):
+        view = memoryview(buf)
+        count = min(len(view), max(0, self.size - self.position))
+        done = 0
+        while done < count:
+            position = self.position + done
+            index = bisect.bisect_right(self.offsets, position) - 1
+            data = self.archive.read_chunk(self.digests[index])
+            offset = position - self.offsets[index]
+            length = min(len(data) - offset, count - done)
+            view[done:done + length] = data[offset:offset + length]
+            done += length
+        self.position += done
+        return done
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="deduplicating archive of disk images")
+    parser.add_argument("archive", help="directory of the archive")
+    commands = parser.add_subparsers(dest="command")
+    add = commands.add_parser("add", help="add a RAW image")
+    add.add_argument("name")
+    add.add_argument("image")
+    add.add_argument("--base", help="name of the archived base image")
+    add.add_argument("--changed", nargs=2, metavar="BLOCKHASHES",
+                     help="block digests of the base and of the image, only "
+                     "differing blocks are read")
+    restore = commands.add_parser("restore", help="restore an image")
+    restore.add_argument("name")
+    restore.add_argument("image")
+    commands.add_parser("list", help="list the archived images")
+    args = parser.parse_args(argv)
+
+    with Archive(args.archive) as archive:
+        if args.command == "add":
+            changed = None
+            if args.changed:
+                old, new = [BlockHashes.read(x) for x in args.changed]
+                changed = [(x * new.block_size, new.block_size)
+                           for x in old.changed_blocks(new)]
+            stored = archive.add(args.name, args.image, args.base, changed)
+            print("stored %d bytes" % stored)
+        elif args.command == "restore":
+            archive.restore(args.name, args.image)
+        elif args.command == "list":
+            for row in archive.images():
+                print("\t".join([str(x) for x in row]))
+            stats = archive.stats()
+            print("%d bytes of images in %d bytes" % (stats['images'],
+                                                       stats['stored']))
+        else:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import asyncio
+import functools
+import virtualbox
+from .param import BootTarget, ControllerType, SessionType, StopMode, \
+    StopConfirm  # local import
+from .sessionpool import SessionError, TRANSIENT  # local import
+from . import blockhash  # local import
+
+__doc__ = """\
+asyncio front-end for the Vbox class, see class documentation for details
+
+Requires Python 3.5 or newer, unlike the rest of ForGeOSI.
+"""
+
+
+def _to_text(data):
+    """decodes output read from a guest process, the API returns bytes
+    """
+    if isinstance(data, str):
+        return data
+    return bytes(data).decode("utf-8", "replace")
+
+
+def _running_loop():
+    """returns the loop running the current coroutine
+    """
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError:
+        # Python older than 3.7, inside a coroutine this is the running loop
+        return asyncio.get_event_loop()
+
+
+async def wait_progress(progress, interval=0.05, max_interval=1.0):
+    """Waits for an IProgress object, without blocking the event loop
+
+    Arguments:
+        progress - IProgress, as returned by most VirtualBox operations
+        interval - first polling interval in seconds, doubled on every poll
+        max_interval - upper bound for the polling interval
+    """
+    while not progress.completed:
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, max_interval)
+    if progress.result_code != 0:
+        raise RuntimeError("VirtualBox operation failed: "
+                           + str(progress.error_info.text))
+
+
+async def wait_condition(condition, timeout=None, name="condition",
+                         interval=0.05, max_interval=1.0, blocking=False):
+    """Waits until condition() returns True, without blocking the event loop
+
+    Arguments:
+        condition - callable without arguments
+        timeout - time in seconds, None waits forever
+        name - used in the error message only
+        blocking - condition may block for a while, like creating a guest
+            session, it is run in the default executor of the loop
+    """
+    loop = _running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+
+    async def check():
+        if blocking:
+            return await loop.run_in_executor(None, condition)
+        return condition()
+
+    while not await check():
+        if deadline is not None and loop.time() >= deadline:
+            raise asyncio.TimeoutError("%s not reached after %s seconds"
+                                       % (name, timeout))
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+class AsyncVbox():
+    """Coroutine based wrapper around a Vbox instance
+
+    The blocking operations of Vbox are offered as coroutines, which poll the
+    IProgress or guest process objects instead of waiting for them, so many
+    machines can be driven from one thread:
+
+        vboxes = [AsyncVbox(Vbox(basename=vm, clonename=name)) for ...]
+        await asyncio.gather(*[each.start() for each in vboxes])
+
+    All other functionality is available on the wrapped instance, self.vbox.
+    """
+
+    def __init__(self, vbox):
+        """Initializes the wrapper
+
+        Arguments:
+            vbox - ForGeOSI.Vbox instance
+        """
+        self.vbox = vbox
+
+
+    async def start(self, session_type=SessionType.headless,
+                    target=BootTarget.additions, timeout=600,
+                    username="default", password="12345"):
+        """see Vbox.start and Vbox.wait_for_boot
+        """
+        if not isinstance(target, BootTarget):
+            raise TypeError("target needs to be of type BootTarget")
+
+        progress = self.vbox.start(session_type=session_type, wait=False)
+        await wait_progress(progress)
+
+        loop = _running_loop()
+        deadline = loop.time() + timeout
+        checks = self.vbox._boot_checks(username, password)
+        for stage in sorted(checks, key=lambda x: x.value):
+            if stage.value > target.value:
+                break
+            # creating the guest session waits for the guest
+            await wait_condition(checks[stage], deadline - loop.time(),
+                                 stage.name,
+                                 blocking=stage is BootTarget.session)
+
+
+    async def stop(self, stop_mode=StopMode.shutdown,
+                   confirm=StopConfirm.none):
+        """see Vbox.stop
+        """
+        if not isinstance(stop_mode, StopMode):
+            raise TypeError("stop_mode needs to be of type StopMode")
+
+        if not isinstance(confirm, StopConfirm):
+            raise TypeError("stop_mode needs to be of type StopConfirm")
+
+        if stop_mode is StopMode.shutdown:
+            powered_off = lambda: self.vbox.vm.state <= 1
+            self.vbox.session.console.power_button()
+            if confirm is not StopConfirm.none:
+                # the dialog only shows up, if the guest does not power off
+                # on its own
+                try:
+                    await wait_condition(powered_off, 20,
+                                         "machine powered off")
+                except asyncio.TimeoutError:
+                    self.vbox._confirm_shutdown(confirm)
+            await wait_condition(powered_off, name="machine powered off")
+            self.vbox._mark_stopped()
+        else:
+            progress = self.vbox.stop(stop_mode=stop_mode, wait=False)
+            await wait_progress(progress)
+            if stop_mode is StopMode.poweroff:
+                self.vbox.unlock()
+
+
+    async def create_guest_session(self, username="default", password="12345",
+                                   home="", timeout=600):
+        """see Vbox.create_guest_session
+        """
+        def created():
+            try:
+                self.vbox.create_guest_session(username, password, home,
+                                               wait=False)
+            except SessionError as e:
+                if e.kind != TRANSIENT:
+                    raise
+                return False
+            return True
+
+        await wait_condition(created, timeout, "guest session",
+                             blocking=True)
+
+
+    async def run_process(self, command, arguments=[], key_input='',
+                          environment=[], native_input=False, timeout=0,
+                          wait_time=10):
+        """see Vbox.run_process, the process is always waited for
+
+        Returns:
+            pid, stdout, stderr
+        """
+        library = virtualbox.library
+        if not self.vbox.guestsession:
+            await self.create_guest_session()
+
+        flags = [library.ProcessCreateFlag.wait_for_std_out,
+                 library.ProcessCreateFlag.wait_for_std_err,
+                 library.ProcessCreateFlag.ignore_orphaned_processes]
+        process = self.vbox.guestsession.process_create(
+            command=command, arguments=arguments, environment=environment,
+            flags=flags, timeout_ms=timeout)
+
+        started = int(library.ProcessStatus.started)
+        await wait_condition(lambda: int(process.status) >= started,
+                             name="process start")
+
+        if key_input:
+            if self.vbox.os:
+                # polls the guest for a window of the process, in a thread
+                await _running_loop().run_in_executor(
+                    None, self.vbox._wait_for_input_window, process.pid,
+                    wait_time)
+            else:
+                await asyncio.sleep(wait_time)
+            if native_input:
+                self.vbox.os.keyboard_input(key_input=key_input,
+                                            pid=process.pid)
+            else:
+                self.vbox.keyboard_input(key_input=key_input)
+
+        stdout = []
+        stderr = []
+
+        def read_available():
+            stdout.append(_to_text(process.read(1, 65000, 0)))
+            stderr.append(_to_text(process.read(2, 65000, 0)))
+            return self.vbox._terminated(process)
+
+        # reading while the process runs prevents the guest buffers from
+        # filling up and stalling the process
+        await wait_condition(read_available, name="process termination")
+        read_available()
+
+        stdout = "".join(stdout)
+        stderr = "".join(stderr)
+        self.vbox.log.add_process(self.vbox._running_or_none(process),
+                                  command, arguments, '', key_input,
+                                  stdout, stderr, process.pid,
+                                  time_offset=self.vbox.offset,
+                                  time_rate=self.vbox.speedup)
+
+        return process.pid, stdout, stderr
+
+
+    async def copy_to_vm(self, source, dest, extra_hashes=[]):
+        """see Vbox.copy_to_vm
+        """
+        # logging copies and hashes the file, which blocks
+        progress = await _running_loop().run_in_executor(
+            None, functools.partial(self.vbox.copy_to_vm, source, dest,
+                                    wait=False, extra_hashes=extra_hashes))
+        if progress is None:
+            # the machine is not running, Vbox.copy_to_vm printed why
+            return
+        await wait_progress(progress)
+
+
+    async def copy_from_vm(self, source, dest):
+        """see Vbox.copy_from_vm
+        """
+        if self.vbox.running and not self.vbox.guestsession:
+            await self.create_guest_session()
+        progress = self.vbox.copy_from_vm(source, dest, wait=False)
+        if progress is None:
+            return
+        await wait_progress(progress)
+
+
+    async def export(self, path="/tmp/disk.vdi",
+                     controller=ControllerType.SATA, port=0, disk=0,
+                     raw=False, workers=4, hashes=(), block_hashes=False):
+        """see Vbox.export, raw exports of VDI images are polled, other raw
+        exports run in the default executor
+        """
+        if not isinstance(controller, ControllerType):
+            raise TypeError("controller must be of type ControllerType")
+
+        if self.vbox.running:
+            raise RuntimeError("Machine needs to be stopped")
+
+        if raw:
+            sidecar = path + blockhash.SIDECAR_SUFFIX if block_hashes else None
+            export = self.vbox._raw_export(path, controller, port, disk,
+                                           workers, hashes, sidecar)
+            if export is None:
+                return await _running_loop().run_in_executor(
+                    None, functools.partial(
+                        self.vbox.export, path, controller, port, disk,
+                        raw=True, workers=workers, hashes=hashes,
+                        block_hashes=block_hashes))
+            await wait_condition(lambda: export.completed, name="raw export")
+            # raises the first error of the workers
+            export.wait_for_completion()
+            return export.block_hashes
+
+        self.vbox.lock()
+        cur_hdd = self.vbox.session.machine.get_medium(controller.name, port,
+                                                       disk)
+        try:
+            clone_hdd = self.vbox.vb.create_hard_disk("", path)
+            variant = virtualbox.library.MediumVariant.standard
+            await wait_progress(cur_hdd.clone_to_base(clone_hdd, [variant]))
+            clone_hdd.close()
+        finally:
+            self.vbox.unlock()
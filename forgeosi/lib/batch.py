@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import uuid
+
+__doc__ = """\
+Collects guest operations, to run them in a single guest process, see class
+documentation for details
+"""
+
+
+class Batch():
+    """Context manager, collecting operations of an OS class
+
+    While the batch is active, operations of Vbox.os, which would run a guest
+    process each, are only recorded. When the block ends, the OS class runs
+    all of them in one script and splits the output again, every operation
+    gets its own LogProcess entry, without a pid, as they all share the one
+    of the script.
+
+    Example:
+        with vbox.os.batch() as b:
+            vbox.os.make_dir("/home/default/test")
+            vbox.os.copy_file("/etc/hosts", "/home/default/test/hosts")
+        print(b.results)
+    """
+
+    def __init__(self, os_class):
+        """
+        Arguments:
+            os_class - OSLinux or OSWindows instance
+        """
+        self.os = os_class
+        self.operations = []
+        self.results = []
+        self.marker = "FORGEOSI_BATCH_" + uuid.uuid4().hex
+
+
+    def add(self, command):
+        """Records a command, in the syntax of the script of the OS class
+        """
+        self.operations.append(command)
+
+
+    def __enter__(self):
+        if self.os._batch is not None:
+            raise RuntimeError("batches can not be nested")
+        self.os._batch = self
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.os._batch = None
+        # on errors in the block, nothing is run
+        if exc_type is None and self.operations:
+            self.results = self.os._run_batch(self)
+
+
+    def chunks(self, snippets, limit):
+        """Groups the script snippets of all operations into scripts, which
+        stay below a length limit of the guest command line
+
+        Arguments:
+            snippets - list of strings, one per operation
+            limit - maximum length of one script
+
+        Returns:
+            list of lists of operation indices
+        """
+        ret = []
+        current = []
+        length = 0
+        for i, snippet in enumerate(snippets):
+            if current and length + len(snippet) > limit:
+                ret.append(current)
+                current = []
+                length = 0
+            current.append(i)
+            length += len(snippet)
+        if current:
+            ret.append(current)
+        return ret
+
+
+    def split_output(self, stdout, stderr, indices=None):
+        """Splits the output of the script into one part per operation
+
+        The script needs to frame the output of operation i with lines
+        "<marker> begin i" and "<marker> end i [status]" on both streams,
+        preceded by an empty line, which is removed again.
+
+        Arguments:
+            stdout - stdout of the script
+            stderr - stderr of the script
+            indices - operations, the script contained, default all
+
+        Returns:
+            list of (command, stdout, stderr, status) tuples, status is None if
+            the operation did not finish
+        """
+        count = len(self.operations)
+        if indices is None:
+            indices = range(count)
+        out = self._split_stream(stdout, count)
+        err = self._split_stream(stderr, count)
+        results = []
+        for i in indices:
+            text_out, status = out[i]
+            text_err, _ = err[i]
+            results.append((self.operations[i], text_out, text_err, status))
+        return results
+
+
+    def _split_stream(self, text, count):
+        """returns a list of (text, status) for one stream
+        """
+        parts = [[] for _ in range(count)]
+        status = [None] * count
+        current = None
+        for line in text.splitlines(True):
+            if line.startswith(self.marker):
+                fields = line.split()
+                index = int(fields[2])
+                if fields[1] == "begin":
+                    current = index
+                else:
+                    current = None
+                    if len(fields) > 3:
+                        status[index] = int(fields[3])
+                continue
+            if current is not None:
+                parts[current].append(line)
+
+        ret = []
+        for i in range(count):
+            text = "".join(parts[i])
+            # remove the newline, which separates the output from the marker
+            if text.endswith("\r\n"):
+                text = text[:-2]
+            elif text.endswith("\n"):
+                text = text[:-1]
+            ret.append((text, status[i]))
+        return ret
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import hashlib
+import json
+
+__doc__ = """\
+Whole image digests together with a digest per block, kept in a sidecar file
+next to exported disk images, see class documentation for details
+"""
+
+
+BLOCK_SIZE = 1024 * 1024
+"""Bytes covered by one block digest"""
+
+SIDECAR_SUFFIX = ".blockhashes"
+
+
+class BlockHasher():
+    """Hashes an image in a single pass, as a whole and block by block
+
+    Data is passed in order with update, in pieces of any size.
+
+    Example:
+        hasher = BlockHasher()
+        for chunk in chunks:
+            hasher.update(chunk)
+        hashes = hasher.finish()
+        hashes.write("disk.img" + SIDECAR_SUFFIX)
+    """
+
+    def __init__(self, algorithms=('md5', 'sha256'), block_size=BLOCK_SIZE,
+                 block_algorithm='sha256'):
+        """
+        Arguments:
+            algorithms - hashlib algorithms for the whole image
+            block_size - bytes per block digest
+            block_algorithm - hashlib algorithm for the blocks
+        """
+        self.hashes = [(name, hashlib.new(name)) for name in algorithms]
+        self.block_size = block_size
+        self.block_algorithm = block_algorithm
+        self.block = hashlib.new(block_algorithm)
+        self.block_fill = 0
+        self.blocks = []
+        self.size = 0
+
+
+    def update(self, data):
+        for _, each in self.hashes:
+            each.update(data)
+        self.size += len(data)
+        view = memoryview(data)
+        while len(view):
+            part = view[:self.block_size - self.block_fill]
+            self.block.update(part)
+            self.block_fill += len(part)
+            view = view[len(part):]
+            if self.block_fill == self.block_size:
+                self.blocks.append(self.block.hexdigest())
+                self.block = hashlib.new(self.block_algorithm)
+                self.block_fill = 0
+
+
+    def finish(self):
+        """Returns the BlockHashes of all data passed to update
+        """
+        if self.block_fill:
+            self.blocks.append(self.block.hexdigest())
+            self.block_fill = 0
+        digests = dict((name, each.hexdigest()) for name, each in self.hashes)
+        return BlockHashes(self.size, self.block_size, self.block_algorithm,
+                           self.blocks, digests)
+
+
+class BlockHashes():
+    """Digests of an image and of each of its blocks
+
+    The sidecar file has a JSON header in the first line, followed by one
+    hex digest per block and line, so two images of the same size are
+    compared by their lists of digests, without reading the images.
+
+    Attributes:
+        size - size of the image in bytes
+        block_size - bytes per block digest, the last block may be shorter
+        algorithm - hashlib algorithm of the blocks
+        blocks - list of hex digests, one per block
+        digests - dict mapping algorithms to hex digests of the whole image
+    """
+
+    def __init__(self, size, block_size, algorithm, blocks, digests):
+        self.size = size
+        self.block_size = block_size
+        self.algorithm = algorithm
+        self.blocks = blocks
+        self.digests = digests
+
+
+    def write(self, path):
+        header = {'size': self.size, 'block_size': self.block_size,
+                  'algorithm': self.algorithm, 'digests': self.digests}
+        with open(path, "w") as f:
+            f.write(json.dumps(header, sort_keys=True) + "\n")
+            for each in self.blocks:
+                f.write(each + "\n")
+
+
+    @classmethod
+    def read(cls, path):
+        with open(path) as f:
+            header = json.loads(f.readline())
+            blocks = [line.strip() for line in f if line.strip()]
+        return cls(header['size'], header['block_size'], header['algorithm'],
+                   blocks, header['digests'])
+
+
+    def changed_blocks(self, other):
+        """Returns the numbers of the blocks, which differ from other, the
+        BlockHashes of another image of the same disk
+        """
+        if (self.block_size, self.algorithm) != \
+                (other.block_size, other.algorithm):
+            raise ValueError("block hashes use different blocks or algorithms")
+        ret = [i for i, (a, b) in enumerate(zip(self.blocks, other.blocks))
+               if a != b]
+        shorter = min(len(self.blocks), len(other.blocks))
+        longer = max(len(self.blocks), len(other.blocks))
+        return ret + list(range(shorter, longer))
+
+
+def hash_image(path, algorithms=('md5', 'sha256'), block_size=BLOCK_SIZE,
+               sidecar=None):
+    """Hashes an existing image in one pass
+
+    Arguments:
+        path - image to read
+        algorithms - hashlib algorithms for the whole image
+        block_size - bytes per block digest
+        sidecar - optional path to write the block digests to
+
+    Returns:
+        BlockHashes
+    """
+    hasher = BlockHasher(algorithms, block_size)
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        while True:
+            read = f.readinto(buf)
+            if not read:
+                break
+            hasher.update(view[:read])
+    ret = hasher.finish()
+    if sidecar:
+        ret.write(sidecar)
+    return ret
+
+
+def verify(path, sidecar=None, blocks=None):
+    """Checks an image against its block digests
+
+    Arguments:
+        path - image to check
+        sidecar - path of the block digests, default path + SIDECAR_SUFFIX
+        blocks - numbers of the blocks to check, like the result of
+            changed_blocks, default all
+
+    Returns:
+        list of the numbers of blocks, which do not match
+    """
+    expected = BlockHashes.read(sidecar or path + SIDECAR_SUFFIX)
+    if blocks is None:
+        blocks = range(len(expected.blocks))
+    ret = []
+    with open(path, "rb") as f:
+        for block in blocks:
+            f.seek(block * expected.block_size)
+            data = f.read(expected.block_size)
+            digest = hashlib.new(expected.algorithm, data).hexdigest()
+            if block >= len(expected.blocks) or \
+                    digest != expected.blocks[block]:
+                ret.append(block)
+    return ret
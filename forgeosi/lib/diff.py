@@ -0,0 +1,396 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+#python 2 compatibility
+from __future__ import print_function
+
+import argparse
+import bisect
+import os
+import subprocess
+import sys
+from lxml import etree
+try:
+    from .vdi import VdiImage, VdiChain  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    from vdi import VdiImage, VdiChain  # local import
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+__doc__ = """\
+Finds the files changed by a run, by reading only the blocks the linked clone
+wrote to its differencing image, see class documentation for details
+
+Usage as a script:
+    diff.py <clone.vdi> <base.dfxml> [-o report.xml] [--base base.vdi]
+    diff.py <clone.vdi> <base.img> --reader fiwalk [-o report.xml]
+"""
+
+
+DFXML_NS = "http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML"
+DELTA_NS = "http://www.forensicswiki.org/wiki/Forensic_Disk_Differencing"
+
+SECTOR_SIZE = 512
+
+
+class FileObject():
+    """A file of the base image and where its content is stored
+
+    Attributes:
+        filename - path inside the file system
+        inode - inode or MFT entry number, if known
+        filesize - size in bytes
+        meta_type - 1 for files, 2 for directories, as in DFXML
+        byte_runs - list of (image offset, length, file offset)
+    """
+
+    def __init__(self, filename, inode=None, filesize=0, meta_type=None,
+                 byte_runs=None):
+        self.filename = filename
+        self.inode = inode
+        self.filesize = filesize
+        self.meta_type = meta_type
+        self.byte_runs = byte_runs or []
+
+
+class DfxmlReader():
+    """Reads the files of a file system from a DFXML file, as written by
+    fiwalk -X
+
+    This is the default reader, the DFXML of the base image has to be created
+    only once for all runs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def fileobjects(self):
+        """Yields a FileObject for every fileobject with byte runs
+        """
+        for _, node in etree.iterparse(self.path, events=("end",),
+                                       huge_tree=True):
+            if etree.QName(node).localname != "fileobject":
+                continue
+            fields = {}
+            runs = []
+            for child in node.iter():
+                name = etree.QName(child).localname
+                if name == "byte_run" and child.get("img_offset") is not None:
+                    runs.append((int(child.get("img_offset")),
+                                 int(child.get("len", 0)),
+                                 int(child.get("file_offset", 0))))
+                elif name in ("filename", "inode", "filesize", "meta_type"):
+                    fields[name] = child.text
+            node.clear()
+            if runs:
+                yield FileObject(fields.get("filename", ""),
+                                 _to_int(fields.get("inode")),
+                                 _to_int(fields.get("filesize")) or 0,
+                                 _to_int(fields.get("meta_type")), runs)
+
+
+class FiwalkReader(DfxmlReader):
+    """Runs fiwalk on a raw image, the DFXML is kept next to it as
+    <image>.dfxml and reused, as long as it is newer than the image
+    """
+
+    def __init__(self, image):
+        dfxml = image + ".dfxml"
+        if not os.path.exists(dfxml) or \
+                os.path.getmtime(dfxml) < os.path.getmtime(image):
+            subprocess.check_output(["fiwalk", "-X", dfxml, "-f", image])
+        DfxmlReader.__init__(self, dfxml)
+
+
+READERS = {}
+"""File system reader classes by name, extended with register"""
+
+
+def register(name, reader):
+    """Makes a file system reader available to diff_image and the script
+
+    Arguments:
+        name - name of the reader
+        reader - class, constructed with one path, with a method
+            fileobjects(), yielding FileObject instances
+    """
+    READERS[name] = reader
+
+
+def get_reader(name, path):
+    """Returns an instance of a registered reader for path
+    """
+    if name not in READERS:
+        raise ValueError("unknown reader %s, known are: %s"
+                         % (name, ", ".join(sorted(READERS))))
+    return READERS[name](path)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _merge_runs(runs):
+    """merges sorted, adjacent (offset, length) runs
+    """
+    ret = []
+    for offset, length in runs:
+        if ret and ret[-1][0] + ret[-1][1] == offset:
+            ret[-1] = (ret[-1][0], ret[-1][1] + length)
+        else:
+            ret.append((offset, length))
+    return ret
+
+
+def changed_runs(image, base=None, sector_size=SECTOR_SIZE):
+    """Returns the parts of the disk written to a differencing image
+
+    Arguments:
+        image - VdiImage of the clone
+        base - optional VdiImage or VdiChain of the parent disk, if given,
+            the written blocks are compared to it and only sectors, which
+            really differ, are returned, reading only the written blocks
+        sector_size - granularity of the comparison with base
+
+    Returns:
+        sorted list of (disk offset, length)
+    """
+    runs = []
+    for block in image.allocated_blocks():
+        start = block * image.block_size
+        if base is None:
+            runs.append((start, image.block_size))
+            continue
+        data = image.read_block(block)
+        original = base.read_block(block)
+        if original is None:
+            original = b"\0" * base.block_size
+        for offset in range(0, image.block_size, sector_size):
+            end = offset + sector_size
+            if data[offset:end] != original[offset:end]:
+                runs.append((start + offset, sector_size))
+    return _merge_runs(runs)
+
+
+class RunIndex():
+    """Finds the files stored at a range of the disk by bisecting over the
+    sorted byte runs of all files
+    """
+
+    def __init__(self, fileobjects):
+        runs = []
+        for each in fileobjects:
+            for offset, length, file_offset in each.byte_runs:
+                if length:
+                    runs.append((offset, length, file_offset, each))
+        runs.sort(key=lambda x: x[0])
+        self.starts = [x[0] for x in runs]
+        self.runs = runs
+        # largest end of all runs up to each position, to stop searching
+        # backwards, even if runs overlap
+        self.max_end = []
+        end = 0
+        for offset, length, _, _ in runs:
+            end = max(end, offset + length)
+            self.max_end.append(end)
+
+
+    def overlapping(self, offset, length):
+        """Yields (FileObject, disk offset, length, file offset) of all parts
+        of files in the given range
+        """
+        end = offset + length
+        position = bisect.bisect_left(self.starts, end) - 1
+        while position >= 0 and self.max_end[position] > offset:
+            start, run_length, file_offset, each = self.runs[position]
+            lo = max(start, offset)
+            hi = min(start + run_length, end)
+            if lo < hi:
+                yield each, lo, hi - lo, file_offset + lo - start
+            position -= 1
+
+
+class DiffReport():
+    """Changed files of a run, found from the differencing image of a linked
+    clone and the files of the base image
+
+    Files, whose content lies in changed parts of the disk, are reported as
+    modified, with the changed ranges. Changed parts without any file of the
+    base image, like new files or file system metadata, are reported as
+    unattributed byte runs.
+
+    Example:
+        with VdiImage("clone.vdi") as image:
+            report = DiffReport(image, DfxmlReader("base.dfxml"))
+        report.write("diff.xml")
+    """
+
+    def __init__(self, image, reader, base=None):
+        """
+        Arguments:
+            image - VdiImage of the differencing image of the clone
+            reader - file system reader of the base image, see register
+            base - optional VdiImage or VdiChain of the parent, see
+                changed_runs
+        """
+        self.image_path = image.path
+        self.changed = changed_runs(image, base)
+        self.modified = {}
+        self.unattributed = []
+
+        if self.changed:
+            index = RunIndex(reader.fileobjects())
+        for offset, length in self.changed:
+            covered = []
+            for each, start, part, file_offset in \
+                    index.overlapping(offset, length):
+                self.modified.setdefault(id(each), (each, []))[1].append(
+                    (start, part, file_offset))
+                covered.append((start, part))
+            position = offset
+            for start, part in sorted(covered):
+                if start > position:
+                    self.unattributed.append((position, start - position))
+                position = max(position, start + part)
+            if position < offset + length:
+                self.unattributed.append((position,
+                                          offset + length - position))
+
+
+    def changed_bytes(self):
+        return sum(x[1] for x in self.changed)
+
+
+    def modified_files(self):
+        """Returns (FileObject, changed runs) sorted by filename
+        """
+        ret = [(each, sorted(runs)) for each, runs in self.modified.values()]
+        return sorted(ret, key=lambda x: x[0].filename)
+
+
+    def write(self, path):
+        """Writes the report as DFXML, the changes are marked with the delta
+        namespace used by idifference
+        """
+        nsmap = {None: DFXML_NS, "delta": DELTA_NS}
+        dfxml = "{%s}" % DFXML_NS
+        delta = "{%s}" % DELTA_NS
+
+        def element(name, text=None, parent=None, **attributes):
+            if parent is None:
+                node = etree.Element(name, nsmap=nsmap, **attributes)
+            else:
+                node = etree.SubElement(parent, name, **attributes)
+            if isinstance(text, string_types):
+                # filenames may be unicode, str() fails for them on Python 2
+                node.text = text
+            elif text is not None:
+                node.text = str(text)
+            return node
+
+        with etree.xmlfile(path, encoding="utf-8") as xf:
+            xf.write_declaration()
+            with xf.element(dfxml + "dfxml", nsmap=nsmap, version="1.0"):
+                creator = element(dfxml + "creator")
+                element(dfxml + "program", "forgeosi diff", creator)
+                xf.write(creator)
+                source = element(dfxml + "source")
+                element(dfxml + "image_filename", self.image_path, source)
+                xf.write(source)
+
+                for each, runs in self.modified_files():
+                    node = element(dfxml + "fileobject")
+                    node.set(delta + "modified_file", "1")
+                    element(dfxml + "filename", each.filename, node)
+                    if each.inode is not None:
+                        element(dfxml + "inode", each.inode, node)
+                    element(dfxml + "filesize", each.filesize, node)
+                    if each.meta_type is not None:
+                        element(dfxml + "meta_type", each.meta_type, node)
+                    byte_runs = element(dfxml + "byte_runs", parent=node)
+                    for offset, length, file_offset in runs:
+                        element(dfxml + "byte_run", parent=byte_runs,
+                                img_offset=str(offset), len=str(length),
+                                file_offset=str(file_offset))
+                    xf.write(node)
+
+                node = element(delta + "unattributed")
+                byte_runs = element(dfxml + "byte_runs", parent=node)
+                for offset, length in self.unattributed:
+                    element(dfxml + "byte_run", parent=byte_runs,
+                            img_offset=str(offset), len=str(length))
+                xf.write(node)
+
+
+def diff_image(clone, reader, report=None, base=None):
+    """Compares the differencing image of a clone with its base
+
+    Arguments:
+        clone - path of the differencing .vdi of the clone
+        reader - file system reader of the base image, see register
+        report - optional path, the DFXML report is written to
+        base - optional path of the parent .vdi, or list of paths of the
+            parent and its own parents, see changed_runs
+
+    Returns:
+        DiffReport
+    """
+    if isinstance(base, (list, tuple)):
+        base_image = VdiChain(base)
+    else:
+        base_image = VdiImage(base) if base else None
+    try:
+        with VdiImage(clone) as image:
+            ret = DiffReport(image, reader, base_image)
+    finally:
+        if base_image:
+            base_image.close()
+    if report:
+        ret.write(report)
+    return ret
+
+
+register("dfxml", DfxmlReader)
+register("fiwalk", FiwalkReader)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="files changed in the differencing image of a clone")
+    parser.add_argument("clone", help="differencing .vdi of the clone")
+    parser.add_argument("filesystem",
+                        help="input of the reader, DFXML of the base image "
+                        "by default")
+    parser.add_argument("--reader", default="dfxml",
+                        choices=sorted(READERS))
+    parser.add_argument("--base", nargs="+", help=".vdi of the parent, "
+                        "followed by its own parents, to compare the written "
+                        "blocks sector by sector")
+    parser.add_argument("-o", "--output", help="DFXML report, default stdout")
+    args = parser.parse_args(argv)
+
+    report = diff_image(args.clone, get_reader(args.reader, args.filesystem),
+                        args.output, args.base)
+    if args.output:
+        return
+    print("changed bytes: %d" % report.changed_bytes())
+    for each, runs in report.modified_files():
+        print("modified\t%s\t%d" % (each.filename, sum(x[1] for x in runs)))
+    for offset, length in report.unattributed:
+        print("unattributed\t%d\t%d" % (offset, length))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import gzip
+import json
+import os
+
+try:
+    import numpy
+    from numpy.lib import recfunctions
+except ImportError:
+    numpy = None
+
+try:
+    string_types = basestring
+    integer_types = (int, long)
+except NameError:
+    string_types = str
+    integer_types = (int,)
+
+__doc__ = """\
+Exporters, writing a log in formats, which load faster than XML, see
+Logger.export
+"""
+
+
+EXPORTERS = {}
+"""Exporter classes by format name, extended with register"""
+
+
+def register(name, exporter):
+    """Makes an exporter available to Logger.export
+
+    Arguments:
+        name - name of the format
+        exporter - class with the methods export(entries, path) and
+            load(path)
+    """
+    EXPORTERS[name] = exporter
+
+
+def get_exporter(name):
+    """Returns an instance of the exporter of a format
+    """
+    if name not in EXPORTERS:
+        raise ValueError("unknown export format %s, known are: %s"
+                         % (name, ", ".join(sorted(EXPORTERS))))
+    return EXPORTERS[name]()
+
+
+def _open(path, mode):
+    """opens path, gzip compressed if it ends with .gz
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class JsonLinesExporter():
+    """One JSON object per log entry and line, the entry type is stored as
+    "type"
+
+    Paths ending with .gz are gzip compressed.
+    """
+
+    def export(self, entries, path):
+        with _open(path, "wb") as f:
+            for each in entries:
+                record = each.get_record()
+                record["type"] = each.__class__.__name__
+                line = json.dumps(record, default=str) + "\n"
+                f.write(line.encode("utf-8"))
+
+
+    def load(self, path):
+        """Returns a list of dicts, one per entry
+        """
+        with _open(path, "rb") as f:
+            return [json.loads(line.decode("utf-8")) for line in f]
+
+
+NULL_VALUES = {'i8': -1, 'f8': float('nan'), '?': False}
+"""Values stored by NumpyExporter for None in columns of these types, like the
+pid of operations in a batch"""
+
+
+class NumpyExporter():
+    """One NumPy structured array per entry type, saved as .npz
+
+    The fields follow the column_types of the entry class, so every log gets
+    the same fields, no matter which values it holds. None is stored as
+    NULL_VALUES of the type. Columns without a type become unicode fields as
+    long as the longest value, lists like process arguments are stored as
+    JSON. The files of copied trees are stored in the array
+    LogCopiedTree.files, with the position of their tree in the field tree.
+
+    Needs NumPy.
+    """
+
+    def _field(self, name, values, dtype=None):
+        """returns the numpy field description and the converted values
+        """
+        if dtype is not None:
+            null = NULL_VALUES[dtype]
+            return (name, dtype), [null if x is None else x for x in values]
+        text = []
+        for x in values:
+            if x is None:
+                text.append(u"")
+            elif isinstance(x, (list, tuple, dict)):
+                text.append(json.dumps(x, default=str))
+            elif isinstance(x, bytes) and not isinstance(x, str):
+                text.append(x.decode("utf-8", "replace"))
+            else:
+                text.append(x if isinstance(x, string_types) else str(x))
+        length = max([len(x) for x in text] + [1])
+        return (name, "U%d" % length), text
+
+
+    def _array(self, records, types):
+        names = []
+        for record in records:
+            for name in record:
+                if name not in names:
+                    names.append(name)
+        fields = []
+        columns = []
+        for name in names:
+            field, values = self._field(name, [x.get(name) for x in records],
+                                        types.get(name))
+            fields.append(field)
+            columns.append(values)
+        return numpy.array(list(zip(*columns)), dtype=fields)
+
+
+    def export(self, entries, path):
+        if numpy is None:
+            raise ImportError("the npz export needs numpy, install it with "
+                              "pip install forgeosi[numpy]")
+        tables = {}
+        types = {}
+        for each in entries:
+            name = each.__class__.__name__
+            record = each.get_record()
+            record.pop("files", None)
+            position = len(tables.setdefault(name, []))
+            tables[name].append(record)
+            types[name] = each.column_types
+            for child in getattr(each, "files", None) or []:
+                tables.setdefault(name + ".files", []).append(
+                    dict(child.get_record(), tree=position))
+                types[name + ".files"] = dict(child.column_types, tree='i8')
+        arrays = dict((name, self._array(records, types[name]))
+                      for name, records in tables.items())
+        with open(path, "wb") as f:
+            numpy.savez_compressed(f, **arrays)
+
+
+    def load(self, path):
+        """Returns a dict mapping entry types to structured arrays
+        """
+        if numpy is None:
+            raise ImportError("the npz export needs numpy, install it with "
+                              "pip install forgeosi[numpy]")
+        with numpy.load(path) as data:
+            return dict((name, data[name]) for name in data.files)
+
+
+def load_runs(paths, fmt="npz"):
+    """Loads the logs of many runs and joins them per entry type
+
+    Arguments:
+        paths - list of exported logs, or of directories containing
+            log.<fmt>
+        fmt - format the logs were exported in
+
+    Returns:
+        for npz, a dict mapping entry types to structured arrays with an
+        additional field run, the position of the log in paths. For other
+        formats, a list of all entries, with an additional key run.
+    """
+    exporter = get_exporter(fmt)
+    tables = {}
+    ret = []
+    for run, path in enumerate(paths):
+        if os.path.isdir(path):
+            path = os.path.join(path, "log." + fmt)
+        data = exporter.load(path)
+        if isinstance(data, dict):
+            for name, array in data.items():
+                runs = numpy.full(len(array), run, dtype="i8")
+                array = recfunctions.append_fields(array, "run", runs,
+                                                   usemask=False)
+                tables.setdefault(name, []).append(array)
+        else:
+            for each in data:
+                each["run"] = run
+            ret.extend(data)
+    if tables:
+        return dict((name, recfunctions.stack_arrays(arrays, usemask=False,
+                                                     autoconvert=True))
+                    for name, arrays in tables.items())
+    return ret
+
+
+register("jsonl", JsonLinesExporter)
+register("npz", NumpyExporter)
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+__doc__ = """\
+Content addressed store for files copied into virtual machines, see class
+documentation for details
+"""
+
+CHUNK_SIZE = 1024 * 1024
+"""Bytes read at once, when copying or hashing files
+"""
+
+
+def hash_file(path, algorithms=('md5', 'sha256'), chunk_size=CHUNK_SIZE,
+              destination=None):
+    """Hashes a file in a single pass with constant memory usage
+
+    Arguments:
+        path - file to read
+        algorithms - names of hashlib algorithms, like 'sha1' or 'blake2b'
+        chunk_size - bytes read at once
+        destination - optional path, the file is copied to in the same pass
+
+    Returns:
+        size of the file, dict mapping algorithm names to hex digests
+    """
+    hashes = [(name, hashlib.new(name)) for name in algorithms]
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    size = 0
+
+    dst = open(destination, 'wb') if destination else None
+    try:
+        with open(path, 'rb') as src:
+            while True:
+                read = src.readinto(buf)
+                if not read:
+                    break
+                chunk = view[:read]
+                for _, each in hashes:
+                    each.update(chunk)
+                if dst:
+                    dst.write(chunk)
+                size += read
+    finally:
+        if dst:
+            dst.close()
+
+    if destination:
+        shutil.copymode(path, destination)
+    return size, dict((name, each.hexdigest()) for name, each in hashes)
+
+
+class FileStore():
+    """Keeps one copy per distinct content of the files copied into VMs
+
+    Files are stored under the sha256sum of their content and counted by
+    references. Copying the same file into many clones stores it only once,
+    and as long as the source does not change (same size, mtime and inode),
+    it is not even read again. A file is removed from the store, once its last
+    reference is released.
+
+    References are only counted within one process, so every store needs a
+    root of its own, by default a new temporary directory is created for it.
+    All Loggers share default_store, unless they are given their own.
+    """
+
+    def __init__(self, root=None):
+        """
+        Arguments:
+            root - directory for the stored files, created if missing, it
+                must not be used by any other store. Default is a new
+                directory in the temporary directory, created on first use.
+        """
+        self.root = root
+        self.refs = {}
+        self.digests = {}
+        self.known_sources = {}
+        self.lock = threading.Lock()
+
+
+    def _root(self):
+        """returns the root, creates it if needed, called with the lock held
+        """
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix="forgeosi-store-")
+        elif not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError:
+                if not os.path.isdir(self.root):
+                    raise
+        return self.root
+
+
+    def path(self, key):
+        """Returns the path of the stored file with sha256sum key
+        """
+        return os.path.join(self.root, key + ".forensig20")
+
+
+    def _source_id(self, source):
+        stat = os.stat(source)
+        return (os.path.realpath(source), stat.st_size, stat.st_mtime,
+                stat.st_ino)
+
+
+    def add(self, source, algorithms=('md5', 'sha256')):
+        """Stores a file and takes a reference on it
+
+        Arguments:
+            source - path of the file on the host
+            algorithms - hashlib names of the digests needed, sha256 is
+                always calculated
+
+        Returns:
+            sha256sum of the file, used as key, size in bytes, dict mapping
+            algorithm names to hex digests
+        """
+        algorithms = list(algorithms)
+        if 'sha256' not in algorithms:
+            algorithms.append('sha256')
+        source_id = self._source_id(source)
+
+        with self.lock:
+            key = self.known_sources.get(source_id)
+            if key is not None and os.path.exists(self.path(key)):
+                self.refs[key] = self.refs.get(key, 0) + 1
+                digests = self.digests[key]
+                missing = [x for x in algorithms if x not in digests]
+                if missing:
+                    # the stored copy has the same content, no need for the
+                    # source
+                    digests.update(hash_file(self.path(key), missing)[1])
+                return key, source_id[1], dict((x, digests[x])
+                                               for x in algorithms)
+            root = self._root()
+
+        tmp = os.path.join(root, "incoming-" + str(uuid.uuid4()))
+        size, digests = hash_file(source, algorithms, destination=tmp)
+        key = digests['sha256']
+
+        with self.lock:
+            if os.path.exists(self.path(key)):
+                os.remove(tmp)
+            else:
+                os.rename(tmp, self.path(key))
+            self.refs[key] = self.refs.get(key, 0) + 1
+            self.digests.setdefault(key, {}).update(digests)
+            self.known_sources[source_id] = key
+        return key, size, digests
+
+
+    def release(self, key):
+        """Drops one reference, the file is removed with the last one
+
+        Returns:
+            True if the file was removed
+        """
+        with self.lock:
+            count = self.refs.get(key, 0) - 1
+            if count > 0:
+                self.refs[key] = count
+                return False
+            self.refs.pop(key, None)
+            self.digests.pop(key, None)
+            for source_id in [x for x in self.known_sources
+                              if self.known_sources[x] == key]:
+                del self.known_sources[source_id]
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            return True
+
+
+    def references(self, key):
+        """Returns the number of references on a stored file
+        """
+        with self.lock:
+            return self.refs.get(key, 0)
+
+
+default_store = FileStore()
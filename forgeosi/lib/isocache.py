@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import hashlib
+import os
+import subprocess
+import threading
+import uuid
+try:
+    from .filestore import hash_file  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    from filestore import hash_file  # local import
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+try:
+    import pycdlib
+except ImportError:
+    pycdlib = None
+
+__doc__ = """\
+Cache of CD images, built from folders on the host, see class documentation
+for details
+"""
+
+
+def folder_manifest(folder, content=False):
+    """Describes the content of a folder, to decide if an image is up to date
+
+    Arguments:
+        folder - path of the folder
+        content - use the sha256sum of every file instead of its mtime, slower
+            but independent of timestamps
+
+    Returns:
+        sorted list of (relative path, size, mtime or sha256sum), directories
+        have a size of None
+    """
+    ret = []
+    for root, dirnames, filenames in os.walk(folder):
+        rel = os.path.relpath(root, folder)
+        for name in dirnames:
+            ret.append((os.path.normpath(os.path.join(rel, name)), None, None))
+        for name in filenames:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            if content:
+                stamp = hash_file(path, ['sha256'])[1]['sha256']
+            else:
+                stamp = stat.st_mtime
+            ret.append((os.path.normpath(os.path.join(rel, name)),
+                        stat.st_size, stamp))
+    return sorted(ret)
+
+
+def manifest_hash(folder, cdlabel, content=False):
+    """Returns a sha256sum over the manifest of folder and the label
+
+    Without content, the path of the folder is included as well, so folders
+    are only considered equal by their content, if it was hashed.
+    """
+    location = None if content else os.path.abspath(folder)
+    manifest = folder_manifest(folder, content)
+    digest = hashlib.sha256()
+    digest.update(repr((cdlabel, location, manifest)).encode())
+    return digest.hexdigest()
+
+
+def build_iso_mkisofs(folder, iso_path, cdlabel):
+    """Builds an image with Joliet and Rock Ridge extensions using mkisofs or
+    genisoimage
+    """
+    program = which("mkisofs") or which("genisoimage")
+    if not program:
+        raise OSError("neither mkisofs nor genisoimage found")
+    args = ["-J", "-l", "-R", "-V", cdlabel, "-iso-level", "4",
+            "-o", iso_path, folder]
+    subprocess.check_output([program] + args)
+
+
+def build_iso_pycdlib(folder, iso_path, cdlabel):
+    """Builds an image with Joliet and Rock Ridge extensions using pycdlib
+
+    The plain ISO9660 names are numbered, the real names are stored in the
+    Joliet and Rock Ridge records, which are used by Windows and Linux.
+    """
+    if pycdlib is None:
+        raise OSError("pycdlib is not installed")
+
+    iso = pycdlib.PyCdlib()
+    iso.new(interchange_level=3, joliet=3, rock_ridge="1.09",
+            vol_ident=cdlabel[:32])
+    count = 0
+    iso_dirs = {".": ("", "")}
+    for root, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        parent_iso, parent_joliet = iso_dirs[os.path.relpath(root, folder)]
+        for name in dirnames:
+            count += 1
+            iso_name = parent_iso + "/D%07d" % count
+            joliet_name = parent_joliet + "/" + name
+            iso.add_directory(iso_name, rr_name=name,
+                              joliet_path=joliet_name)
+            iso_dirs[os.path.relpath(os.path.join(root, name), folder)] = \
+                (iso_name, joliet_name)
+        for name in sorted(filenames):
+            count += 1
+            iso.add_file(os.path.join(root, name),
+                         parent_iso + "/F%07d.;1" % count, rr_name=name,
+                         joliet_path=parent_joliet + "/" + name)
+    iso.write(iso_path)
+    iso.close()
+
+
+def build_iso(folder, iso_path, cdlabel="MyCD"):
+    """Builds an image of folder, with mkisofs if installed, else pycdlib
+    """
+    if which("mkisofs") or which("genisoimage") or pycdlib is None:
+        build_iso_mkisofs(folder, iso_path, cdlabel)
+    else:
+        build_iso_pycdlib(folder, iso_path, cdlabel)
+
+
+class IsoCache():
+    """Builds CD images from folders once and shares them
+
+    Images are named by the manifest_hash of the folder, so an unchanged
+    folder reuses the existing image, while a changed one gets a new image.
+    Every image is built by one thread only and written under a temporary
+    name first, so concurrent VMs never see partial images. The images are
+    only read by VirtualBox and can be mounted by any number of VMs.
+
+    mkisofs or genisoimage is used if installed, pycdlib otherwise.
+    """
+
+    def __init__(self, root="/tmp/forgeosi-iso", content=False):
+        """
+        Arguments:
+            root - directory for the images, created if missing
+            content - compare the content of files instead of their mtime, see
+                folder_manifest
+        """
+        self.root = root
+        self.content = content
+        self.locks = {}
+        self.guard = threading.Lock()
+
+
+    def path(self, key):
+        """Returns the path of the image with the given manifest hash
+        """
+        return os.path.join(self.root, key + ".iso")
+
+
+    def get(self, folder, cdlabel="MyCD"):
+        """Returns the path of an up to date image of folder, building it if
+        needed
+        """
+        key = manifest_hash(folder, cdlabel, self.content)
+        with self.guard:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            iso_path = self.path(key)
+            if os.path.exists(iso_path):
+                return iso_path
+            if not os.path.isdir(self.root):
+                try:
+                    os.makedirs(self.root)
+                except OSError:
+                    if not os.path.isdir(self.root):
+                        raise
+            tmp = os.path.join(self.root, "building-%s.iso" % uuid.uuid4())
+            try:
+                build_iso(folder, tmp, cdlabel)
+                os.chmod(tmp, 0o444)
+                os.rename(tmp, iso_path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            return iso_path
+
+
+    def clear(self):
+        """Removes all cached images, they must not be mounted anymore
+        """
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name.endswith(".iso") and not name.startswith("building-"):
+                os.remove(os.path.join(self.root, name))
+
+
+default_cache = IsoCache()
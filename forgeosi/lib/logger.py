@@ -9,20 +9,65 @@
 from __future__ import print_function
 
 import time
-import shutil
-import uuid
-import hashlib
 import os
+import re
+import sys
+import bisect
+import heapq
+import threading
+import gzip
+import zlib
 from lxml import etree
+try:
+    from . import exporters  # local import
+    from .filestore import CHUNK_SIZE, default_store, hash_file  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    import exporters  # local import
+    from filestore import CHUNK_SIZE, default_store, hash_file  # local import
+
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+_XML_INVALID = u"[^\u0009\u000a\u000d\u0020-\ud7ff\ue000-\ufffd"
+if sys.maxunicode > 0xffff:
+    _XML_INVALID += u"\U00010000-\U0010ffff"
+_XML_INVALID = re.compile(_XML_INVALID + u"]")
+
+
+def _xml_escape(match):
+    code = ord(match.group())
+    if code < 0x100:
+        return u"\\x%02x" % code
+    return u"\\u%04x" % code
+
+
+def _xml_text(value):
+    """Returns value as text, which can be stored in XML
+
+    Output of guest processes often contains control characters, like the
+    escape sequences of terminals, which XML can not store at all. They are
+    replaced by escapes like \\x1b, bytes are decoded as UTF-8.
+    """
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    elif not isinstance(value, text_type):
+        value = text_type(value)
+    return _XML_INVALID.sub(_xml_escape, value)
 
 
 IGNORE = ['time', 'up_time', 'time_rate', 'real_time', 'process', 'pid']
 """Ignore time output to enable easier comparison of multiple runs
 """
 
-
 def object_to_xml(class_element, **kwargs):
     """creates a xml representation of a given object
+
+    Log entries are rendered from their columns, other objects from their
+    __dict__
     """
     if 'nodeName' in kwargs:
         node_name = kwargs['nodeName']
@@ -34,30 +79,121 @@ def object_to_xml(class_element, **kwargs):
     else:
         ignore = []
 
+    if isinstance(class_element, _LogEntry):
+        names = class_element.columns
+    else:
+        names = class_element.__dict__
+
     node = etree.Element(node_name)
-    for i in class_element.__dict__:
+    for i in names:
         if i not in ignore:
             xml = etree.Element(i)
-            xml.text = str(class_element.__dict__[i])
+            xml.text = _xml_text(getattr(class_element, i))
             node.append(xml)
     return node
 
 
-class LogCopiedFile():
+TIME_COLUMNS = ('real_time', 'time', 'time_rate', 'up_time')
+"""Columns of all entries of actions, which happen at a certain time
+"""
+
+TIME_COLUMN_TYPES = {'real_time': 'f8', 'time': 'f8', 'time_rate': 'f8',
+                     'up_time': 'f8'}
+"""Types of TIME_COLUMNS, see _LogEntry.column_types"""
+
+
+def _escape(text):
+    """escapes control characters for the pretty log, like the string-escape
+    codec, which only exists in Python 2
+    """
+    try:
+        return text.encode('string-escape')
+    except LookupError:
+        return text.encode('unicode_escape').decode('ascii')
+
+
+class _LogEntry(object):
+    """Base class of all log entries
+
+    Entries keep their data in __slots__ instead of a __dict__, which needs a
+    lot less memory in long logs. The columns of a class are the same for all
+    its entries, XML and dicts are only generated from them, when asked for.
+
+    Class attributes:
+        columns - names of the stored values, in output order
+        node_name - name of the XML node
+        entry_names - keys of get_entry, which differ from the column name
+        column_types - NumPy types of the columns, which are no text, 'i8',
+            'f8' or '?', used by exporters.NumpyExporter
+    """
+    __slots__ = ()
+    columns = ()
+    node_name = "entry"
+    entry_names = {}
+    column_types = {}
+
+    def _set_time(self, time_offset, time_rate, up_time):
+        """fills TIME_COLUMNS
+        """
+        now = time.time()
+        self.real_time = now
+        self.time = now + time_offset
+        self.time_rate = time_rate
+        self.up_time = up_time
+
+    def get_entry(self):
+        return dict((self.entry_names.get(x, x), getattr(self, x))
+                    for x in self.columns)
+
+    def get_record(self):
+        """returns the values of the columns by column name, used by the
+        exporters
+        """
+        return dict((x, getattr(self, x)) for x in self.columns)
+
+    def cleanup(self):
+        """return a path on the host, where data needs to be deleted or False
+        """
+        return False
+
+    def to_xml(self):
+        return object_to_xml(self, nodeName=self.node_name, ignore=IGNORE)
+
+
+class LogCopiedFile(_LogEntry):
     """Stores data of a single file, copied to the VM
+
+    The file is kept in a filestore.FileStore, which is shared by all copies
+    of the same content, tmp is the path of the stored copy. Further digests
+    can be requested with extra_hashes, like ['sha1'] or ['blake2b'], they are
+    stored as <name>sum.
     """
+    columns = ('source', 'destination', 'tmp', 'md5sum', 'sha256sum',
+               'filesize') + TIME_COLUMNS
+    __slots__ = columns + ('store', 'extra_sums')
+    node_name = "copiedFile"
+    column_types = dict(TIME_COLUMN_TYPES, filesize='i8')
+
     def __init__(self, source, destination, time_offset=0, time_rate=100,
-                 up_time=0):
+                 up_time=0, extra_hashes=[], store=None):
         self.source = source
         self.destination = destination
-        self.tmp = self.copy_to_temp()
-        self.md5sum = self.calc_md5sum()
-        self.sha256sum = self.calc_sha256sum()
-        self.filesize = self.get_file_size()
-        self.real_time = time.time()
-        self.time = time.time() + time_offset
-        self.time_rate = time_rate
-        self.up_time = up_time
+        self.store = store or default_store
+        key, self.filesize, digests = self.store.add(
+            source, ['md5', 'sha256'] + extra_hashes)
+        self.tmp = self.store.path(key)
+        self.md5sum = digests['md5']
+        self.sha256sum = digests['sha256']
+        self.extra_sums = dict((name + 'sum', digests[name])
+                               for name in extra_hashes)
+        self._set_time(time_offset, time_rate, up_time)
+
+    def __getattr__(self, name):
+        # extra digests, like sha1sum, are read like the columns
+        try:
+            return object.__getattribute__(self, 'extra_sums')[name]
+        except KeyError:
+            raise AttributeError(name)
 
     def get_file_size(self):
         """local file size to compare to file size in vm
@@ -65,56 +201,99 @@ class LogCopiedFile():
         filesize = os.path.getsize(self.tmp)
         return filesize
 
-    def copy_to_temp(self):
-        """copy file to temp for later usage
-        """
-        tmp = '/tmp/%s.forensig20' % str(uuid.uuid4())
-        shutil.copy(self.source, tmp)
-        return tmp
-
     def calc_md5sum(self):
         """calculates md5sum of file
         """
-        return hashlib.md5(open(self.tmp, 'rb').read()).hexdigest()
+        return hash_file(self.tmp, ['md5'])[1]['md5']
 
     def calc_sha256sum(self):
         """calculates sha256sum of file
         """
-        return hashlib.sha256(open(self.tmp, 'rb').read()).hexdigest()
+        return hash_file(self.tmp, ['sha256'])[1]['sha256']
+
+    def get_entry(self):
+        ret = _LogEntry.get_entry(self)
+        ret.update(self.extra_sums)
+        return ret
 
+    def get_record(self):
+        ret = _LogEntry.get_record(self)
+        ret.update(self.extra_sums)
+        return ret
+
+    def cleanup(self):
+        """releases the stored copy of the file, the store deletes it, once no
+        other entry refers to it, so there is nothing left to delete
+        """
+        self.store.release(self.sha256sum)
+        return False
+
+    def to_xml(self):
+        node = _LogEntry.to_xml(self)
+        for name in sorted(self.extra_sums):
+            xml = etree.SubElement(node, name)
+            xml.text = _xml_text(self.extra_sums[name])
+        return node
+
+
+class LogCopiedTree(_LogEntry):
+    """Stores data of a directory tree, copied to the VM
+
+    Every file of the tree is a LogCopiedFile, in XML they are children of the
+    copiedTree node.
+    """
+    columns = ('source', 'destination', 'filecount', 'filesize') + \
+        TIME_COLUMNS
+    __slots__ = columns + ('files',)
+    node_name = "copiedTree"
+    column_types = dict(TIME_COLUMN_TYPES, filecount='i8', filesize='i8')
+
+    def __init__(self, source, destination, files, time_offset=0,
+                 time_rate=100, up_time=0):
+        self.source = source
+        self.destination = destination
+        self.files = files
+        self.filecount = len(files)
+        self.filesize = sum([each.filesize for each in files])
+        self._set_time(time_offset, time_rate, up_time)
 
     def get_entry(self):
-        return {'source': self.source, 'destination': self.destination,
-                'tmp': self.tmp, 'md5sum': self.md5sum,
-                'sha256sum': self.sha256sum, 'filesize': self.filesize,
-                'real_time': self.real_time, 'time': self.time,
-                'time_rate': self.time_rate, 'up_time': self.up_time}
+        ret = _LogEntry.get_entry(self)
+        ret['files'] = [each.get_entry() for each in self.files]
+        return ret
+
+    def get_record(self):
+        ret = _LogEntry.get_record(self)
+        ret['files'] = [each.get_record() for each in self.files]
+        return ret
 
     def cleanup(self):
-        """cleanup copy of file
+        """releases the stored copies of all files
         """
-        return self.tmp
+        for each in self.files:
+            each.cleanup()
+        return False
 
     def to_xml(self):
-        return object_to_xml(self, nodeName="copiedFile", ignore=IGNORE)
+        node = _LogEntry.to_xml(self)
+        for each in self.files:
+            node.append(each.to_xml())
+        return node
 
 
-class LogCdMount():
+class LogCdMount(_LogEntry):
     """Stores data about a cd mounted to the VM
     """
+    columns = ('path', 'delete') + TIME_COLUMNS
+    __slots__ = columns
+    node_name = "cd"
+    column_types = dict(TIME_COLUMN_TYPES, delete='?')
+
     def __init__(self, path, delete=False, time_offset=0, time_rate=0,
                  up_time=0):
         self.path = path
         self.delete = delete
-        self.real_time = time.time()
-        self.time = time.time() + time_offset
-        self.time_rate = time_rate
-        self.up_time = up_time
-
-    def get_entry(self):
-        return {'path': self.path, 'real_time': self.real_time,
-                'time': self.time, 'time_rate': self.time_rate,
-                'up_time': self.up_time}
+        self._set_time(time_offset, time_rate, up_time)
 
     def cleanup(self):
         """clean up only generated cd images
@@ -124,34 +303,34 @@ class LogCdMount():
         else:
             return False
 
-    def to_xml(self):
-        return object_to_xml(self, nodeName="cd", ignore=IGNORE)
-
 
-class LogEncodedCommand():
+class LogEncodedCommand(_LogEntry):
     """Stores readable version off the encodedCommand
     """
+    columns = ('args',)
+    __slots__ = columns
+    node_name = "ReadableArg"
+    entry_names = {'args': 'arg'}
+
     def __init__(self, args):
         self.args = args
 
-    def get_entry(self):
-        return {'arg': self.args}
-
-    def cleanup(self):
-        """return a path on the host, where data needs to be deleted or False
-        """
-        return False
-
-    def to_xml(self):
-        return object_to_xml(self, nodeName="ReadableArg")
-
 
-class LogProcess():
+class LogProcess(_LogEntry):
     """Stores data of a single process, running in the VM
+
+    process is the pyvbox process object, it is only kept for processes,
+    which are still running, see release_process
     """
+    columns = ('path', 'arguments', 'stdin', 'key_input', 'stdout', 'stderr',
+               'pid', 'spool') + TIME_COLUMNS
+    __slots__ = columns + ('process',)
+    node_name = "process"
+    column_types = dict(TIME_COLUMN_TYPES, pid='i8')
+
     def __init__(self, process, path, arguments, stdin='', key_input='',
                  stdout='', stderr='', pid=0, time_offset=0, time_rate=0,
-                 up_time=0):
+                 up_time=0, spool=''):
         self.process = process
         self.path = path
         self.arguments = arguments
@@ -160,51 +339,45 @@ class LogProcess():
         self.stdout = stdout
         self.stderr = stderr
         self.pid = pid
-        self.real_time = time.time()
-        self.time = time.time() + time_offset
-        self.time_rate = time_rate
-        self.up_time = up_time
+        self.spool = spool
+        self._set_time(time_offset, time_rate, up_time)
 
     def get_entry(self):
-        return {'process': self.process, 'path': self.path,
-                'arguments': self.arguments, 'stdin': self.stdin,
-                'key_input': self.key_input, 'stdout': self.stdout,
-                'stderr': self.stderr, 'pid': self.pid,
-                'real_time': self.real_time, 'time': self.time,
-                'time_rate': self.time_rate, 'up_time': self.up_time}
-
-    def cleanup(self):
-        return False
+        ret = _LogEntry.get_entry(self)
+        ret['process'] = self.process
+        return ret
 
-    def to_xml(self):
-        return object_to_xml(self, nodeName="process", ignore=IGNORE)
+    def release_process(self):
+        """Drops the process object, once the process finished
+        """
+        self.process = None
 
 
-class LogRawKeyboard():
+class LogRawKeyboard(_LogEntry):
     """Stores raw keyboard input
     """
+    columns = ('key_input',) + TIME_COLUMNS
+    __slots__ = columns
+    node_name = "keyboard_input"
+    entry_names = {'key_input': 'keyboard input'}
+    column_types = TIME_COLUMN_TYPES
+
     def __init__(self, key_input, time_offset=0, time_rate=0, up_time=0):
         self.key_input = key_input
-        self.real_time = time.time()
-        self.time = time.time() + time_offset
-        self.time_rate = time_rate
-        self.up_time = up_time
-
-    def get_entry(self):
-        return {'keyboard input': self.key_input, 'real_time': self.real_time,
-                'time': self.time, 'time_rate': self.time_rate,
-                'up_time': self.up_time}
-
-    def cleanup(self):
-        return False
-
-    def to_xml(self):
-        return object_to_xml(self, nodeName="keyboard_input", ignore=IGNORE)
+        self._set_time(time_offset, time_rate, up_time)
 
 
-class LogMouse():
+class LogMouse(_LogEntry):
     """Stores raw mouse input
     """
+    columns = ('x', 'y', 'lmb', 'mmb', 'rmb') + TIME_COLUMNS
+    __slots__ = columns
+    node_name = "mouse_input"
+    entry_names = {'lmb': 'left mouse button', 'mmb': 'middle mouse button',
+                   'rmb': 'right mouse button'}
+    column_types = dict(TIME_COLUMN_TYPES, x='i8', y='i8', lmb='?', mmb='?',
+                        rmb='?')
+
     def __init__(self, x, y, lmb, mmb, rmb, time_offset=0, time_rate=0,
                  up_time=0):
         self.x = x
@@ -212,63 +385,68 @@ class LogMouse():
         self.lmb = lmb
         self.mmb = mmb
         self.rmb = rmb
-        self.real_time = time.time()
-        self.time = time.time() + time_offset
-        self.time_rate = time_rate
-        self.up_time = up_time
+        self._set_time(time_offset, time_rate, up_time)
 
-    def get_entry(self):
-        return {'x': self.x, 'y': self.y, 'left mouse button': self.lmb,
-                'middle mouse button': self.mmb, 'right mouse button': self.rmb,
-                'real_time': self.real_time, 'time': self.time,
-                'time_rate': self.time_rate, 'up_time': self.up_time}
 
-    def cleanup(self):
-        return False
+class LogTimeRate(_LogEntry):
+    """Stores a change of the rate the guest clock runs at
 
-    def to_xml(self):
-        return object_to_xml(self, nodeName="mouse_input", ignore=IGNORE)
+    Anchors are logged when the VM starts, the guest clock is set to the host
+    time plus offset then. Together they allow to reconstruct the guest time
+    of every entry, see timeline.Timeline.
+    """
+    columns = ('rate', 'offset', 'anchor') + TIME_COLUMNS
+    __slots__ = columns
+    node_name = "time_rate"
+    column_types = dict(TIME_COLUMN_TYPES, rate='f8', offset='f8', anchor='?')
+
+    def __init__(self, rate, offset=0, anchor=False, time_offset=0,
+                 time_rate=100, up_time=0):
+        """
+        Arguments:
+            rate - new rate in percent
+            offset - offset of the guest clock in seconds
+            anchor - True, if the guest clock was set at this point
+        """
+        self.rate = rate
+        self.offset = offset
+        self.anchor = anchor
+        self._set_time(time_offset, time_rate, up_time)
 
 
-class LogVM():
+class LogVM(_LogEntry):
     """saves general properties of one VM"""
+    columns = ('vmname', 'basename', 'os_type')
+    __slots__ = columns
+    node_name = "vm"
+
     def __init__(self, vmname, basename, os_type):
         self.vmname = vmname
         self.basename = basename
         self.os_type = os_type
 
-    def get_entry(self):
-        return {'vmname': self.vmname, 'basename': self.basename,
-                'os_type': self.os_type}
-
-    def cleanup(self):
-        return False
 
-    def to_xml(self):
-        return object_to_xml(self, nodeName="vm")
-
-
-class LogWarning():
+class LogWarning(_LogEntry):
     """Generic warnings, be careful, if any of those appear"""
+    columns = ('warning',)
+    __slots__ = columns
+    node_name = "warning"
+
     def __init__(self, warning, verbose=True):
         self.warning = warning
         if verbose:
             print(warning)
 
-    def get_entry(self):
-        return {'warning': self.warning}
 
-    def cleanup(self):
-        return False
-
-    def to_xml(self):
-        return object_to_xml(self, nodeName="warning")
-
-
-class _LogInterface():
+class _LogInterface(_LogEntry):
     """This is just an example, of the logging class interface
 
-    every logger needs to implement this interface"""
+    every logger needs to implement this interface, _LogEntry implements it
+    based on columns"""
+    columns = ('arg',)
+    __slots__ = columns
+    node_name = "log_interface"
+
     def __init__(self, arg):
         self.arg = arg
 
@@ -284,56 +462,219 @@ class _LogInterface():
         return object_to_xml(self, nodeName="log_interface")
 
 
+class XmlLogStream():
+    """Writes log entries to a file, as soon as they are added
+
+    After every entry, the file is flushed and ends with the closing tag, so
+    it is a valid log, even if the program crashes. The closing tag is
+    overwritten by the next entry. Compressed streams are gzip files, flushed
+    after every entry, the closing tag is only written by close(), use
+    read_xml_log to read partial ones.
+
+    The stream itself is not thread safe, Logger writes to it with its lock
+    held.
+
+    Entries are written, when they are added, changes to them afterwards,
+    like output read by Vbox.wait_for_output, are only part of logs written
+    with Logger.write_xml_log.
+    """
+
+    TRAILER = b"</log>\n"
+
+    def __init__(self, path, compress=False):
+        """
+        Arguments:
+            path - file to write to, replaced if it exists
+            compress - write a gzip compressed file
+        """
+        self.compress = compress
+        if compress:
+            self.file = gzip.open(path, 'wb')
+        else:
+            self.file = open(path, 'wb')
+        self.file.write(b"<log>\n")
+        self._sync()
+
+    def _sync(self):
+        if self.compress:
+            self.file.flush()
+        else:
+            self.file.write(self.TRAILER)
+            self.file.flush()
+            self.file.seek(-len(self.TRAILER), os.SEEK_CUR)
+
+    def write(self, entry):
+        """Appends a single log entry
+        """
+        self.file.write(etree.tostring(entry.to_xml(), pretty_print=True))
+        self._sync()
+
+    def close(self):
+        """Finishes the file, the closing tag is written already, if not
+        compressed
+        """
+        if self.compress:
+            self.file.write(self.TRAILER)
+        self.file.close()
+
+
+def read_xml_log(path):
+    """Reads a log written by Logger.write_xml_log or XmlLogStream
+
+    Compressed logs are detected automatically, logs of crashed programs are
+    read as far as they are complete.
+
+    Returns:
+        root element of the log
+    """
+    parser = etree.XMLParser(recover=True)
+    decompressor = None
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if decompressor is None and data[:2] == b"\x1f\x8b":
+                # unlike gzip.open, this accepts files missing their end
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if not data:
+                break
+            if decompressor:
+                data = decompressor.decompress(data)
+            parser.feed(data)
+    return parser.close()
+
+
 class Logger():
     """A simple logger for ForGeOSI
 
     This logger creates a protocol of actions performed with pyvbox, that
     altered the virtual machine image. XML-export is available with
-    get_xml_log, get_structured_xml_log and write_xml_log.
+    get_xml_log, get_structured_xml_log and write_xml_log, stream_xml_log
+    writes entries as they are added.
     """
 
-    def __init__(self):
+    def __init__(self, store=None):
+        """
+        Arguments:
+            store - filestore.FileStore for copied files, default
+                filestore.default_store
+        """
         self.log = []
+        self.store = store or default_store
+        self.stream = None
+        # indexes hold positions in self.log, entries are only ever appended
+        # or popped from the end, so every list stays sorted
+        self.by_type = {}
+        self.by_pid = {}
+        self.by_path = {}
+        self.paths = []
+        self.by_time = []
+        # guards the log and the indexes, entries are added from the threads
+        # of Vbox.stream_process and the pools as well
+        self.lock = threading.Lock()
+
+    def _append(self, entry):
+        """adds an entry, updates the indexes and writes it to the stream, if
+        there is one
+        """
+        with self.lock:
+            index = len(self.log)
+            self.log.append(entry)
+            self.by_type.setdefault(type(entry), []).append(index)
+            if isinstance(entry, LogProcess):
+                self.by_pid.setdefault(entry.pid, []).append(index)
+                if entry.path not in self.by_path:
+                    bisect.insort(self.paths, entry.path)
+                self.by_path.setdefault(entry.path, []).append(index)
+            if hasattr(entry, 'time'):
+                bisect.insort(self.by_time, (entry.time, index))
+            # written under the lock, so entries of several threads neither
+            # mix in the file nor end up in a different order than the log
+            if self.stream:
+                self.stream.write(entry)
+
+    def _pop(self):
+        """removes the last entry and its index entries
+        """
+        with self.lock:
+            index = len(self.log) - 1
+            entry = self.log.pop()
+            self._unindex(self.by_type, type(entry), index)
+            if isinstance(entry, LogProcess):
+                self._unindex(self.by_pid, entry.pid, index)
+                self._unindex(self.by_path, entry.path, index)
+                if entry.path not in self.by_path:
+                    self.paths.remove(entry.path)
+            if hasattr(entry, 'time'):
+                del self.by_time[bisect.bisect_left(self.by_time,
+                                                    (entry.time, index))]
+        return entry
+
+    def _unindex(self, index, key, position):
+        positions = index[key]
+        positions.remove(position)
+        if not positions:
+            del index[key]
+
+    def _positions(self, logtype):
+        """returns the sorted positions of all entries of logtype, including
+        subclasses, needs to be called with the lock held
+        """
+        lists = [self.by_type[x] for x in self.by_type
+                 if issubclass(x, logtype)]
+        if len(lists) == 1:
+            return lists[0]
+        return list(heapq.merge(*lists))
 
     def add_vm(self, *args, **kwargs):
         """Add vm entry to log, required
         """
-        self.log.append(LogVM(*args, **kwargs))
+        self._append(LogVM(*args, **kwargs))
 
     def add_process(self, *args, **kwargs):
         """add process entry to log
         """
-        self.log.append(LogProcess(*args, **kwargs))
+        self._append(LogProcess(*args, **kwargs))
 
     def add_file(self, *args, **kwargs):
         """add file entry to log
         """
-        self.log.append(LogCopiedFile(*args, **kwargs))
+        kwargs.setdefault('store', self.store)
+        self._append(LogCopiedFile(*args, **kwargs))
+
+    def add_tree(self, *args, **kwargs):
+        """add copied directory tree entry to log
+        """
+        self._append(LogCopiedTree(*args, **kwargs))
 
     def add_cd(self, *args, **kwargs):
         """add cd entry to log
         """
-        self.log.append(LogCdMount(*args, **kwargs))
+        self._append(LogCdMount(*args, **kwargs))
 
     def add_keyboard(self, *args, **kwargs):
         """add keyboard input entry to log
         """
-        self.log.append(LogRawKeyboard(*args, **kwargs))
+        self._append(LogRawKeyboard(*args, **kwargs))
 
     def add_mouse(self, *args, **kwargs):
         """add mouse input entry to log
         """
-        self.log.append(LogMouse(*args, **kwargs))
+        self._append(LogMouse(*args, **kwargs))
+
+    def add_time_rate(self, *args, **kwargs):
+        """add change of the guest clock rate entry to log
+        """
+        self._append(LogTimeRate(*args, **kwargs))
 
     def add_encoded_command(self, *args, **kwargs):
         """add readable version of encoded commands entry to log
         """
-        self.log.append(LogEncodedCommand(*args, **kwargs))
+        self._append(LogEncodedCommand(*args, **kwargs))
 
     def add_warning(self, *args, **kwargs):
         """adds warning entry to the log
         """
-        self.log.append(LogWarning(*args, **kwargs))
+        self._append(LogWarning(*args, **kwargs))
 
     def get_pid(self, path=''):
         """Find the PID of a previously started process based on the path
@@ -341,22 +682,61 @@ class Logger():
         Returns a list of all found pids matching the path, or all pids, if no
         path was given
         """
-        pids = []
-        for each in self.log:
-            if isinstance(each, LogProcess):
-                if path in each.path:
-                    pids.append(each.pid)
-        return pids
+        positions = []
+        with self.lock:
+            for each in self.paths:
+                if path in each:
+                    positions.extend(self.by_path[each])
+            return [self.log[x].pid for x in sorted(positions)]
+
+
+    def get_pid_by_prefix(self, prefix):
+        """Like get_pid, but only matches paths starting with prefix, which
+        are found without looking at other paths
+        """
+        positions = []
+        with self.lock:
+            start = bisect.bisect_left(self.paths, prefix)
+            for each in self.paths[start:]:
+                if not each.startswith(prefix):
+                    break
+                positions.extend(self.by_path[each])
+            return [self.log[x].pid for x in sorted(positions)]
+
+
+    def get_process(self, pid):
+        """Gets the log objects of processes with the given pid, usually one
+
+        Arguments:
+            pid - process id in the guest
+        """
+        with self.lock:
+            return [self.log[x] for x in self.by_pid.get(pid, [])]
+
+
+    def get_by_time(self, start=None, end=None):
+        """Gets all log objects with a time between start and end, ordered by
+        time
+
+        Arguments:
+            start - earliest time, None for no limit
+            end - latest time, None for no limit
+        """
+        with self.lock:
+            lo = 0
+            hi = len(self.by_time)
+            if start is not None:
+                lo = bisect.bisect_left(self.by_time, (start, -1))
+            if end is not None:
+                hi = bisect.bisect_right(self.by_time, (end, len(self.log)))
+            return [self.log[x] for _, x in self.by_time[lo:hi]]
 
 
     def get_warnings(self):
         """Fast way to check for warnings
         """
-        warn = ''
-        for each in self.log:
-            if isinstance(each, LogWarning):
-                warn += (each.warning)+'\n'
-        return warn
+        return "".join([each.warning + '\n' for each in
+                        self.get_log_object_by_type(LogWarning)])
 
 
     def get_xml_log_by_type(self, logtype):
@@ -365,12 +745,7 @@ class Logger():
         Arguments:
             logtype - type of log entry
         """
-
-        partial_log = []
-        for each in self.log:
-            if isinstance(each, logtype):
-                partial_log.append(each.to_xml())
-        return partial_log
+        return [each.to_xml() for each in self.get_log_object_by_type(logtype)]
 
 
     def get_log_object_by_type(self, logtype):
@@ -379,11 +754,8 @@ class Logger():
         Arguments:
             logtype - type of log entry
         """
-        ret = []
-        for each in self.log:
-            if isinstance(each, logtype):
-                ret.append(each)
-        return ret
+        with self.lock:
+            return [self.log[x] for x in self._positions(logtype)]
 
 
     def get_xml_log(self):
@@ -391,10 +763,11 @@ class Logger():
 
         in the original order of actions
         """
-        ret = "<log>\n"
+        ret = [b"<log>\n"]
         for each in self.log:
-            ret += etree.tostring(each.to_xml(), pretty_print=True)
-        return ret + "</log>\n"
+            ret.append(etree.tostring(each.to_xml(), pretty_print=True))
+        ret.append(b"</log>\n")
+        return b"".join(ret)
 
 
     def get_pretty_log(self):
@@ -405,7 +778,7 @@ class Logger():
             ret += each.__class__.__name__+":\n"
             entry = each.get_entry()
             for key in entry:
-                ret += "\t"+key+": "+str(entry[key]).encode('string-escape')+"\n"
+                ret += "\t"+key+": "+_escape(str(entry[key]))+"\n"
         return ret
 
 
@@ -418,8 +791,10 @@ class Logger():
 
         elements = {'processes': LogProcess, 'cdmounts': LogCdMount,
                     'copiedfile': LogCopiedFile,
+                    'copiedtrees': LogCopiedTree,
                     'encodedcommands': LogEncodedCommand, 'mice': LogMouse,
-                    'keyboards': LogRawKeyboard, 'warnings': LogWarning}
+                    'keyboards': LogRawKeyboard, 'warnings': LogWarning,
+                    'timerates': LogTimeRate}
 
         for log_type in elements:
             node = etree.Element(log_type)
@@ -434,11 +809,63 @@ class Logger():
         return etree.tostring(root, pretty_print=True)
 
 
-    def write_xml_log(self, path):
+    def write_xml_log(self, path, compress=False):
         """Writes the xml formated log to a file
+
+        Entries are serialized one by one, so the log is never held in memory
+        as a whole.
+
+        Arguments:
+            path - file to write to
+            compress - write a gzip compressed file
+        """
+        with etree.xmlfile(path, compression=9 if compress else None) as xf:
+            with xf.element("log"):
+                xf.write("\n")
+                for each in self.log:
+                    xf.write(each.to_xml(), pretty_print=True)
+
+
+    def export(self, path, fmt=None):
+        """Writes the log in a format, which loads faster than XML
+
+        Formats are provided by exporters, built in are "jsonl", JSON Lines,
+        gzip compressed if path ends with .gz, and "npz", NumPy structured
+        arrays per entry type. exporters.load_runs loads many of them at once.
+
+        Arguments:
+            path - file to write to
+            fmt - name of the format, guessed from the extension of path if
+                not given
+        """
+        if fmt is None:
+            name = path[:-3] if path.endswith(".gz") else path
+            fmt = os.path.splitext(name)[1].lstrip(".")
+        exporters.get_exporter(fmt).export(self.log, path)
+
+
+    def stream_xml_log(self, path, compress=False):
+        """Writes the log to a file and appends all further entries, as they
+        are added, see XmlLogStream
+
+        Arguments:
+            path - file to write to
+            compress - write a gzip compressed file
+        """
+        self.close_stream()
+        with self.lock:
+            self.stream = XmlLogStream(path, compress)
+            for each in self.log:
+                self.stream.write(each)
+
+
+    def close_stream(self):
+        """Finishes the file of stream_xml_log, if there is one
         """
-        f = open(path, 'wb')
-        f.write(self.get_xml_log())
+        with self.lock:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
 
 
     def cleanup(self):
@@ -450,9 +877,7 @@ class Logger():
         if not self.log:
             return False
         else:
-            if len(self.log) is 0:
-                return False
-            path = self.log.pop().cleanup()
+            path = self._pop().cleanup()
             while path is False and len(self.log) > 0:
-                path = self.log.pop().cleanup()
+                path = self._pop().cleanup()
             return path
@@ -5,9 +5,22 @@
 # [maximilian.krueger@fau.de]
 #
 
-from param import RunMethod  # local import
+try:
+    from .param import RunMethod  # local import
+    from .readiness import poll_until, ReadinessTimeout  # local import
+    from .batch import Batch  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    from param import RunMethod  # local import
+    from readiness import poll_until, ReadinessTimeout  # local import
+    from batch import Batch  # local import
 import time
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
 __doc__ = """\
 Linux specifc code, see class documentation for details
 """
@@ -45,9 +58,56 @@ class OSLinux():
                     "HOME=/home/"+vbox.username] + env
         self.xdt = "/usr/bin/xdotool"
         self.xdte = xdotool_extended
+        self._batch = None
+
+
+    def batch(self):
+        """Collects operations and runs them in a single bash process
+
+        Returns a context manager, see batch.Batch. Inside the with-block,
+        run_shell_cmd without gui and everything based on it, as well as
+        keyboard_input and keyboard_specialkey, only record their command and
+        return None. Commands with gui=True still run right away.
+        """
+        return Batch(self)
 
 
-    def run_shell_cmd(self, command, gui=False, close_shell=False):
+    def _run_batch(self, batch):
+        """runs the operations of a batch, called by Batch.__exit__
+        """
+        marker = batch.marker
+        snippets = []
+        for i, command in enumerate(batch.operations):
+            snippets.append(
+                'echo "{0} begin {1}"; echo "{0} begin {1}" >&2\n'
+                '(\n{2}\n)\n'
+                'rc=$?; echo; echo "{0} end {1} $rc"; '
+                'echo >&2; echo "{0} end {1}" >&2\n'.format(marker, i,
+                                                           command))
+
+        results = []
+        # a single argument of a linux process is limited to 128KiB
+        for indices in batch.chunks(snippets, 100000):
+            script = "".join([snippets[i] for i in indices])
+            _, stdout, stderr = self.vbox.run_process(command=self.shell,
+                                                      arguments=['-c',
+                                                                 script],
+                                                      environment=self.env,
+                                                      log=False)
+            # the operations share one process, its pid would make them
+            # look like the same process in the log
+            for each in batch.split_output(stdout, stderr, indices):
+                command, out, err, _ = each
+                self.vbox.log.add_process(None, self.shell, ['-c', command],
+                                          stdout=out, stderr=err, pid=None,
+                                          time_offset=self.vbox.offset,
+                                          time_rate=self.vbox.speedup)
+                results.append(each)
+        return results
+
+
+    def run_shell_cmd(self, command, gui=False, close_shell=False,
+                      until=None):
         """runs a command inside the default shell of the user
 
         Arguments:
@@ -55,6 +115,8 @@ class OSLinux():
                 should run in a naked bash without terminal emulator
             close_shell - if a x-terminal is created, this is needed to make the
                 window close again
+            until - conditions for the 'sleep_hack' lines of command, typed
+                into the x-terminal, see keyboard_input, gui only
         """
         if gui:
             if close_shell:
@@ -62,9 +124,18 @@ class OSLinux():
             else:
                 cmd = command + "&\n"
 
-            self.vbox.run_process(command=self.term, key_input=cmd,
-                                  environment=self.env, native_input=True,
-                                  wait=True)
+            if until is None:
+                self.vbox.run_process(command=self.term, key_input=cmd,
+                                      environment=self.env, native_input=True,
+                                      wait=True)
+            else:
+                pid, _, _ = self.vbox.run_process(command=self.term,
+                                                  environment=self.env,
+                                                  wait=False)
+                self.vbox._wait_for_input_window(pid, 10)
+                self.keyboard_input(cmd, pid=pid, until=until)
+        elif self._batch is not None:
+            self._batch.add(command)
         else:
             self.vbox.run_process(command=self.shell, arguments=['-c', command],
                                   environment=self.env, wait=True)
@@ -95,7 +166,72 @@ class OSLinux():
         return args
 
 
-    def keyboard_input(self, key_input, window_class='', name='', pid=0):
+    def _sleep_hack(self, sleep_time, until):
+        """waits sleep_time seconds or until the condition holds
+        """
+        if until is None:
+            time.sleep(sleep_time)
+            return
+        try:
+            poll_until(until, sleep_time, "sleep_hack condition")
+        except ReadinessTimeout:
+            # continue typing, as a plain sleep would have done
+            pass
+
+
+    def _process_running(self, name):
+        """returns a condition, which holds once a process of the given name
+        runs in the guest, like sudo asking for a password
+        """
+        # the probes are not logged, they did not change the machine
+        def running():
+            _, stdout, _ = self.vbox.run_process(command="/usr/bin/pgrep",
+                                                 arguments=["-x", name],
+                                                 environment=self.env,
+                                                 log=False)
+            return bool(stdout.strip())
+        return running
+
+
+    def wait_for_window(self, window_class='', name='', pid=0, timeout=30):
+        """Waits until a window matching the given properties exists
+
+        Uses xdotool search, independent of xdotool_extended, at least one
+        property needs to be given
+
+        Arguments:
+            window_class - X-property, usually matching the program name
+            name - X-property, the window title
+            pid - process id, owning the window
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
+
+        Returns:
+            time in seconds it took for the window to show up
+        """
+        assert(window_class or name or pid)
+
+        args = ["search"]
+        if window_class:
+            args = args + ["--class", window_class]
+        if name:
+            args = args + ["--name", name]
+        if pid:
+            args = args + ["--pid", str(pid)]
+
+        # the probes are not logged, they did not change the machine
+        def window_found():
+            _, stdout, _ = self.vbox.run_process(command=self.xdt,
+                                                 arguments=args,
+                                                 environment=self.env,
+                                                 log=False)
+            return bool(stdout.strip())
+
+        return poll_until(window_found, timeout, "window")
+
+
+    def keyboard_input(self, key_input, window_class='', name='', pid=0,
+                       sleep_time=10, until=None):
         """Sends keyboard input to a running gui process.
 
         Arguments:
@@ -109,6 +245,10 @@ class OSLinux():
                 usecases
             pid - process id, unique identifier per process, but not per window,
                 is not always part of the X-properties. Will be ignored if Zero
+            sleep_time - maximum time in seconds, a 'sleep_hack' waits
+            until - optional callable, returning True once input may continue,
+                a 'sleep_hack' returns as soon as it does. A list holds one
+                callable or None per 'sleep_hack', in order
         """
 
         # type will simulate typing and interpret space '\n'
@@ -119,9 +259,24 @@ class OSLinux():
         # send input line by line, to prevent to long argument
         key_input_split = str.splitlines(str(key_input))
 
+        if isinstance(until, list):
+            conditions = list(until)
+        else:
+            conditions = None
+
         for part in key_input_split:
-            if part.strip() == "sleep_hack":  # discard leading whitespace
-                time.sleep(10)
+            if self._batch is not None:
+                if part.strip() == "sleep_hack":
+                    self._batch.add("sleep " + str(sleep_time))
+                else:
+                    self._batch.add(" ".join([quote(x) for x in
+                                              [self.xdt] + args + [part+'\n']]))
+            elif part.strip() == "sleep_hack":  # discard leading whitespace
+                if conditions is None:
+                    self._sleep_hack(sleep_time, until)
+                else:
+                    self._sleep_hack(sleep_time, conditions.pop(0)
+                                     if conditions else None)
             else:
                 # reinsert '\n' since we lost that with the splitted lines
                 self.vbox.run_process(command=self.xdt,
@@ -147,6 +302,11 @@ class OSLinux():
         #key uses keynames in oposite to type
         args = self._build_xdotool_args(window_class, name, pid) + ["key"]
 
+        if self._batch is not None:
+            self._batch.add(" ".join([quote(x) for x in
+                                      [self.xdt] + args + [key]]))
+            return
+
         self.vbox.run_process(command=self.xdt, arguments=args+[key],
                               environment=self.env)
 
@@ -187,9 +347,13 @@ class OSLinux():
             password - password of the new user
             sudopassword - password of the existing sudo user
         """
+        # sudo and passwd read passwords from a terminal only
         self.run_shell_cmd("sudo useradd "+username + "\nsleep_hack\n"
                            + sudopassword + "\nsudo passwd " + username
-                           + "\nsleep_hack\n" + password + "\n")
+                           + "\nsleep_hack\n" + password + "\n", gui=True,
+                           close_shell=True,
+                           until=[self._process_running("sudo"),
+                                  self._process_running("passwd")])
 
 
     def download_file(self, url, destination="/home/default/test/image.jpg"):
@@ -246,7 +410,8 @@ class OSLinux():
         """
         cmd = "sudo apt-get remove {0}\nsleep_hack\n{1}\n".format(program,
                 self.vbox.password)
-        self.run_shell_cmd(command=cmd)
+        self.run_shell_cmd(command=cmd, gui=True, close_shell=True,
+                           until=[self._process_running("sudo")])
 
 
     def uninstall_guest_additions(self):
@@ -10,7 +10,15 @@
 
 import base64
 import time
-from param import RunMethod  # local import
+try:
+    from .param import RunMethod  # local import
+    from .readiness import poll_until  # local import
+    from .batch import Batch  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    from param import RunMethod  # local import
+    from readiness import poll_until  # local import
+    from batch import Batch  # local import
 
 __doc__ = """\
 Windows specifc code, see class documentation for details
@@ -49,6 +57,65 @@ class OSWindows():
         self.home = home
         self.cmd = "C:\\Windows\\System32\\cmd.exe"
         self.browser = "C:\\Program Files (x86)\\Internet Explorer\\iexplore.exe"
+        self._batch = None
+
+
+    def batch(self):
+        """Collects operations and runs them in a single powershell process
+
+        Returns a context manager, see batch.Batch. Inside the with-block,
+        run_shell_cmd and everything based on it only record their command and
+        return None, commands for cmd.exe are called from powershell.
+        """
+        return Batch(self)
+
+
+    def _ps_quote(self, arg):
+        """quotes a single argument for powershell
+        """
+        return "'" + arg.replace("'", "''") + "'"
+
+
+    def _run_batch(self, batch):
+        """runs the operations of a batch, called by Batch.__exit__
+        """
+        marker = batch.marker
+        snippets = []
+        for i, command in enumerate(batch.operations):
+            snippets.append(
+                'Write-Output "{0} begin {1}"\n'
+                '[Console]::Error.WriteLine("{0} begin {1}")\n'
+                '{2}\n'
+                '$forgeosi_rc = if ($?) {{0}} else {{1}}\n'
+                'Write-Output ""\n'
+                'Write-Output "{0} end {1} $forgeosi_rc"\n'
+                '[Console]::Error.WriteLine("")\n'
+                '[Console]::Error.WriteLine("{0} end {1}")\n'.format(marker,
+                                                                      i,
+                                                                      command))
+
+        results = []
+        # the encoded command grows to more than 2.5 times the script, while
+        # the windows command line is limited to 32767 characters
+        for indices in batch.chunks(snippets, 12000):
+            script = "".join([snippets[i] for i in indices])
+            self.vbox.log.add_encoded_command(script)
+            encoded = self._base64_encode_command(script)
+            _, stdout, stderr = self.vbox.run_process(
+                command=self.term,
+                arguments=["-OutputFormat", "Text", "-inputformat", "none",
+                           "-EncodedCommand", encoded],
+                log=False)
+            # the operations share one process, its pid would make them
+            # look like the same process in the log
+            for each in batch.split_output(stdout, stderr, indices):
+                command, out, err, _ = each
+                self.vbox.log.add_process(None, self.term, [command],
+                                          stdout=out, stderr=err, pid=None,
+                                          time_offset=self.vbox.offset,
+                                          time_rate=self.vbox.speedup)
+                results.append(each)
+        return results
 
 
     def _base64_encode_command(self, command):
@@ -95,20 +162,76 @@ class OSWindows():
         Arguments:
             command - command which will be executed
             cmd - run inside a cmd or powershell
-            stop_ps - kill the powershell window after running the command
+            stop_ps - kill the powershell window after running the command,
+                not allowed inside a batch
         """
-        if cmd:
+        if self._batch is not None:
+            if cmd:
+                command = "& " + " ".join([self._ps_quote(x) for x in
+                                           [self.cmd, "/C"] + command])
+            elif stop_ps:
+                # would kill the powershell running the batch as well
+                raise ValueError("stop_ps can not be used inside a batch")
+            self._batch.add(command)
+        elif cmd:
             return self.vbox.run_process(command=self.cmd,
                                          arguments=["/C"]+command)
         else:
             if stop_ps:
                 command += "; stop-process powershell"
+            return self._run_powershell(command)
+
+
+    def _run_powershell(self, command, log=True):
+        """runs a powershell command right away, even inside a batch
+
+        Arguments:
+            command - powershell script
+            log - log the command and the process, off for polling
+        """
+        if log:
             self.vbox.log.add_encoded_command(command)
-            command = self._base64_encode_command(command)
-            return self.vbox.run_process(command=self.term,
-                                         arguments=["-OutputFormat", "Text",
-                                                    "-inputformat", "none",
-                                                    "-EncodedCommand", command])
+        command = self._base64_encode_command(command)
+        return self.vbox.run_process(command=self.term,
+                                     arguments=["-OutputFormat", "Text",
+                                                "-inputformat", "none",
+                                                "-EncodedCommand", command],
+                                     log=log)
+
+
+    def wait_for_window(self, window_class='', name='', pid=0, timeout=30):
+        """Waits until a process with a matching main window exists
+
+        Arguments:
+            window_class - unused, for interface compatibility with osLinux
+            name - part of the window title
+            pid - process id, owning the window
+            timeout - time in seconds, until readiness.ReadinessTimeout is
+                raised
+
+        Returns:
+            time in seconds it took for the window to show up
+        """
+        assert(name or pid)
+
+        if pid:
+            command = "Get-Process -Id " + str(pid)
+        else:
+            command = "Get-Process"
+        command += " | Where-Object {$_.MainWindowHandle -ne 0"
+        if name:
+            # wildcards in the name only match themselves
+            pattern = "".join(["`" + x if x in "`[]*?" else x for x in name])
+            command += (" -and $_.MainWindowTitle -like " +
+                        self._ps_quote("*" + pattern + "*"))
+        command += '} | ForEach-Object {"found"}'
+
+        # the probes are not logged, they did not change the machine
+        def window_found():
+            _, stdout, _ = self._run_powershell(command, log=False)
+            return "found" in stdout
+
+        return poll_until(window_found, timeout, "window")
 
 
     def keyboard_input(self, key_input, window_class='', name='', pid=0):
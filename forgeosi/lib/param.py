@@ -8,7 +8,7 @@
 from enum import Enum
 
 __all__ = ["VboxMode", "SessionType", "RunMethod", "ControllerType", "StopMode",
-           "StopConfirm"]
+           "StopConfirm", "BootTarget"]
 
 __doc__ = """\
 Collection of enums used for parameters, meant for type safety in parameters,
@@ -94,3 +94,20 @@ class StopConfirm(Enum):
     unity = 2
     simple = 3
     xfce = 4
+
+
+class BootTarget(Enum):
+    """Stages of the boot process, which can be waited for
+
+    The members are ordered, reaching a later stage implies all earlier ones
+
+    Members:
+        launched
+        additions
+        desktop
+        session
+    """
+    launched = 1
+    additions = 2
+    desktop = 3
+    session = 4
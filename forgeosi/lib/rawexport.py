@@ -0,0 +1,269 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import os
+import threading
+import time
+try:
+    from .vdi import is_zero  # local import
+    from .blockhash import BlockHasher, BLOCK_SIZE  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    from vdi import is_zero  # local import
+    from blockhash import BlockHasher, BLOCK_SIZE  # local import
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+__doc__ = """\
+Sparse, parallel export of VDI images to RAW images, see class documentation
+for details
+"""
+
+
+BATCH_BLOCKS = 16
+"""Blocks handed to a worker at once, neighbouring blocks are written by the
+same worker"""
+
+
+class RawExport():
+    """Exports the virtual disk of a vdi.VdiImage or vdi.VdiChain to a RAW
+    image in the background
+
+    The RAW image is created with its full size as a sparse file, then only
+    the blocks stored in any image of the chain are written, blocks reading
+    as zeros stay holes. A pool of worker threads writes the blocks straight
+    out of the memory mapped images, so reading and writing overlap.
+
+    Optionally, the whole image is hashed and a digest per block is written
+    to a sidecar file, see lib/blockhash.py. One more thread reads the disk
+    in order for this, while the workers write it.
+
+    It can be used like the progress objects of VirtualBox, which other
+    methods of Vbox return with wait=False.
+
+    Example:
+        export = RawExport(chain, "/tmp/disk.img")
+        export.start()
+        while not export.completed:
+            print(export.percent, export.throughput, export.write_rate)
+            time.sleep(1)
+    """
+
+    def __init__(self, image, path, workers=4, close_image=False,
+                 hashes=(), sidecar=None, block_size=BLOCK_SIZE):
+        """
+        Arguments:
+            image - vdi.VdiImage or vdi.VdiChain to export
+            path - path of the RAW image, replaced if it exists
+            workers - number of writing threads
+            close_image - close image, once the export finished
+            hashes - hashlib algorithms for the whole image, like
+                ('md5', 'sha256'), the results are stored in digests
+            sidecar - optional path for the block digests
+            block_size - bytes per block digest
+        """
+        self.image = image
+        self.path = path
+        self.workers = workers
+        self.close_image = close_image
+        self.size = image.disk_size
+        self.blocks = 0
+        self.blocks_done = 0
+        self.bytes_written = 0
+        self.start_time = None
+        self.end_time = None
+        self.error = None
+        self.cancelled = False
+        self.running = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.hashes = hashes
+        self.sidecar = sidecar
+        self.block_size = block_size
+        self.digests = {}
+        self.block_hashes = None
+
+
+    def start(self):
+        """Creates the sparse file and starts the workers
+
+        Returns:
+            self
+        """
+        self.start_time = time.time()
+        with open(self.path, "wb") as f:
+            f.truncate(self.size)
+
+        blocks = list(self.image.allocated_blocks())
+        self.blocks = len(blocks)
+        jobs = queue.Queue()
+        for start in range(0, len(blocks), BATCH_BLOCKS):
+            jobs.put(blocks[start:start + BATCH_BLOCKS])
+
+        threads = [(self._work, (jobs,))] * max(1, min(self.workers,
+                                                       jobs.qsize()))
+        if self.hashes or self.sidecar:
+            threads.append((self._hash, ()))
+        self.running = len(threads)
+        for target, args in threads:
+            thread = threading.Thread(target=target, args=args)
+            thread.daemon = True
+            thread.start()
+        return self
+
+
+    def _write_block(self, fd, block):
+        """writes one block, returns the number of written bytes
+        """
+        data = self.image.read_block(block)
+        if data is None or is_zero(data):
+            return 0
+        offset = block * self.image.block_size
+        data = data[:self.size - offset]
+        os.lseek(fd, offset, os.SEEK_SET)
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        return written
+
+
+    def _hash(self):
+        """hashes the disk in order, runs next to the workers
+        """
+        try:
+            hasher = BlockHasher(self.hashes, self.block_size)
+            disk = self.image.raw()
+            buf = bytearray(self.block_size)
+            view = memoryview(buf)
+            while not self.cancelled:
+                read = disk.readinto(buf)
+                if not read:
+                    break
+                hasher.update(view[:read])
+            if not self.cancelled:
+                self.block_hashes = hasher.finish()
+                self.digests = self.block_hashes.digests
+                if self.sidecar:
+                    self.block_hashes.write(self.sidecar)
+        except Exception as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+            self.cancelled = True
+        finally:
+            self._stopped()
+
+
+    def _stopped(self):
+        """called by every thread, when it stops
+        """
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last:
+            self._finish()
+
+
+    def _work(self, jobs):
+        fd = None
+        try:
+            fd = os.open(self.path, os.O_WRONLY)
+            while not self.cancelled:
+                try:
+                    batch = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                for block in batch:
+                    if self.cancelled:
+                        break
+                    written = self._write_block(fd, block)
+                    with self.lock:
+                        self.blocks_done += 1
+                        self.bytes_written += written
+        except Exception as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+            self.cancelled = True
+        finally:
+            if fd is not None:
+                os.close(fd)
+            self._stopped()
+
+
+    def _finish(self):
+        if self.close_image:
+            self.image.close()
+        self.end_time = time.time()
+        self.done.set()
+
+
+    @property
+    def completed(self):
+        return self.done.is_set()
+
+
+    @property
+    def percent(self):
+        """Share of the stored blocks, which are exported, from 0 to 100
+        """
+        if not self.blocks:
+            return 100 if self.start_time else 0
+        return self.blocks_done * 100 // self.blocks
+
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+
+    @property
+    def throughput(self):
+        """Bytes of the stored blocks handled per second, including stored
+        blocks skipped as zeros. Blocks, which are not stored in any image,
+        are never read and not counted.
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.blocks_done * self.image.block_size / self.elapsed
+
+
+    @property
+    def write_rate(self):
+        """Bytes actually written to the RAW image per second
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.bytes_written / self.elapsed
+
+
+    def cancel(self):
+        """Stops the workers after their current block, the RAW image stays
+        incomplete
+        """
+        self.cancelled = True
+
+
+    def wait_for_completion(self, timeout=-1):
+        """Blocks until the export finished
+
+        Arguments:
+            timeout - time in milliseconds, -1 waits forever, like the
+                progress objects of VirtualBox
+
+        Returns:
+            True, if the export finished, raises the first error of a worker
+        """
+        self.done.wait(None if timeout < 0 else timeout / 1000.0)
+        if self.error is not None:
+            raise self.error
+        return self.completed
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import time
+import threading
+try:
+    from .param import BootTarget  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    from param import BootTarget  # local import
+
+__doc__ = """\
+Event driven waiting for state changes of a virtual machine and polling of
+conditions inside the guest, see class documentation for details
+"""
+
+
+class ReadinessTimeout(Exception):
+    """Raised, if a condition was not met within the given timeout
+    """
+    pass
+
+
+def poll_until(condition, timeout=60, name="condition", interval=0.25,
+               max_interval=5.0):
+    """Checks a condition with exponential backoff until it holds
+
+    Used for conditions, VirtualBox sends no events for, like files or windows
+    inside the guest. The first checks follow each other quickly, so short
+    waits return early, while long waits cause little load on the guest.
+
+    Arguments:
+        condition - callable without arguments, returning True once reached
+        timeout - time in seconds, None waits forever
+        name - used in the error message only
+        interval - time in seconds between the first two checks, doubled
+            after every check
+        max_interval - upper bound for the time between two checks
+
+    Returns:
+        time in seconds it took for the condition to become true
+    """
+    start = time.time()
+    while not condition():
+        if timeout is None:
+            delay = interval
+        else:
+            remaining = start + timeout - time.time()
+            if remaining <= 0:
+                raise ReadinessTimeout("%s not reached after %s seconds"
+                                       % (name, timeout))
+            delay = min(interval, remaining)
+        time.sleep(delay)
+        interval = min(interval * 2, max_interval)
+    return time.time() - start
+
+
+class VboxEventSource():
+    """Wakes up a waiting caller, whenever VirtualBox reports an event
+
+    Wraps a passive listener on a VirtualBox IEventSource. The content of the
+    events is not interpreted, every event is only a hint, that the state of
+    the machine changed and conditions should be checked again.
+    """
+
+    def __init__(self, event_source, event_types):
+        """Registers a listener on the event source
+
+        Arguments:
+            event_source - IEventSource, for example console.event_source
+            event_types - list of VBoxEventType members to listen for
+        """
+        self.event_source = event_source
+        self.listener = event_source.create_listener()
+        event_source.register_listener(self.listener, event_types, False)
+
+
+    def wait(self, timeout):
+        """Waits for the next event and drains all queued ones
+
+        Arguments:
+            timeout - time in seconds
+
+        Returns:
+            True if at least one event arrived, False on timeout
+        """
+        event = self.event_source.get_event(self.listener,
+                                            int(timeout * 1000))
+        if not event:
+            return False
+        while event:
+            self.event_source.event_processed(self.listener, event)
+            event = self.event_source.get_event(self.listener, 0)
+        return True
+
+
+    def close(self):
+        """Unregisters the listener, the event source can not be used
+        afterwards
+        """
+        try:
+            self.event_source.unregister_listener(self.listener)
+        except:
+            pass
+
+
+class FakeEventSource():
+    """Stand-in for VboxEventSource, to test waiting without VirtualBox
+
+    Events are injected with fire(), usually from another thread, after
+    changing the state the checked conditions look at.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.closed = False
+
+
+    def fire(self, count=1):
+        """Injects events, waking up a waiting caller
+
+        Arguments:
+            count - number of events to inject
+        """
+        with self.condition:
+            self.pending += count
+            self.condition.notify_all()
+
+
+    def wait(self, timeout):
+        """Same interface as VboxEventSource.wait
+        """
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(timeout)
+            if self.pending:
+                self.pending = 0
+                return True
+            return False
+
+
+    def close(self):
+        self.closed = True
+
+
+class ReadinessWaiter():
+    """Waits for conditions, checking them only when something happened
+
+    Every condition is checked once and then again after each event of the
+    event source, so a condition is noticed right after it became true instead
+    of after a fixed sleep. Conditions without a matching event, like the
+    ability to create a guest session, are covered by poll_interval, which is
+    the longest time between two checks.
+    """
+
+    def __init__(self, event_source, checks=None, poll_interval=1.0):
+        """Initializes the waiter
+
+        Arguments:
+            event_source - VboxEventSource or FakeEventSource
+            checks - dict mapping BootTarget members to callables, returning
+                True once the stage is reached
+            poll_interval - maximum time in seconds between two checks
+        """
+        self.event_source = event_source
+        self.checks = checks if checks is not None else {}
+        self.poll_interval = poll_interval
+
+
+    def wait_for(self, condition, timeout=None, name="condition"):
+        """Blocks until condition() returns True
+
+        Arguments:
+            condition - callable without arguments
+            timeout - time in seconds, None waits forever
+            name - used in the error message only
+
+        Returns:
+            time in seconds it took for the condition to become true
+        """
+        start = time.time()
+        while not condition():
+            if timeout is None:
+                remaining = self.poll_interval
+            else:
+                remaining = start + timeout - time.time()
+                if remaining <= 0:
+                    raise ReadinessTimeout("%s not reached after %s seconds"
+                                           % (name, timeout))
+            self.event_source.wait(min(remaining, self.poll_interval))
+        return time.time() - start
+
+
+    def wait(self, target=BootTarget.additions, timeout=600):
+        """Blocks until the machine reached the given stage
+
+        All earlier stages with a check are waited for first, so expensive
+        checks only run once the cheap ones are satisfied.
+
+        Arguments:
+            target - BootTarget to wait for
+            timeout - time in seconds for all stages together, None waits
+                forever
+
+        Returns:
+            dict mapping the names of the passed stages to the time in seconds
+            it took to reach them
+        """
+        if not isinstance(target, BootTarget):
+            raise TypeError("target needs to be of type BootTarget")
+
+        start = time.time()
+        timings = {}
+        for stage in sorted(self.checks, key=lambda x: x.value):
+            if stage.value > target.value:
+                break
+            if timeout is None:
+                remaining = None
+            else:
+                remaining = max(start + timeout - time.time(), 0)
+            self.wait_for(self.checks[stage], remaining, stage.name)
+            timings[stage.name] = time.time() - start
+        return timings
+
+
+    def close(self):
+        self.event_source.close()
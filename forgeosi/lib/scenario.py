@@ -0,0 +1,336 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import json
+import threading
+import time
+try:
+    from . import param  # local import
+except (ImportError, ValueError):
+    # used as a script or from the lib directory
+    import param  # local import
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+__doc__ = """\
+Declarative scenarios, running steps on several virtual machines
+concurrently, see class documentation for details
+"""
+
+
+class Ref():
+    """Placeholder for the result of an earlier step
+
+    Used as argument of a step, it is replaced by the return value of the
+    referenced step, when the step runs. The referenced step is added to the
+    dependencies automatically.
+    """
+
+    def __init__(self, step, fmt="{0}"):
+        """
+        Arguments:
+            step - name of the step, whose result should be used
+            fmt - format string, the result is inserted as {0}
+        """
+        self.step = step
+        self.fmt = fmt
+
+
+    def resolve(self, results):
+        if self.fmt == "{0}":
+            return results[self.step]
+        return self.fmt.format(results[self.step])
+
+
+def _resolve(value, results):
+    """replaces Ref objects in arguments, including nested lists and dicts
+    """
+    if isinstance(value, Ref):
+        return value.resolve(results)
+    if isinstance(value, list):
+        return [_resolve(each, results) for each in value]
+    if isinstance(value, dict):
+        return dict((k, _resolve(v, results)) for k, v in value.items())
+    return value
+
+
+def _refs(value):
+    """returns the names of all steps referenced in arguments
+    """
+    if isinstance(value, Ref):
+        return [value.step]
+    if isinstance(value, list):
+        return [ref for each in value for ref in _refs(each)]
+    if isinstance(value, dict):
+        return [ref for each in value.values() for ref in _refs(each)]
+    return []
+
+
+def _from_json_value(value):
+    """converts JSON values to arguments, strings like "SessionType.gui" become
+    members of the enums in param, {"ref": ...} becomes a Ref
+    """
+    if isinstance(value, dict):
+        if "ref" in value:
+            return Ref(value["ref"], value.get("format", "{0}"))
+        return dict((k, _from_json_value(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_from_json_value(each) for each in value]
+    if isinstance(value, string_types) and value.count(".") == 1:
+        enum_name, member = value.split(".")
+        if enum_name in param.__all__:
+            return getattr(param, enum_name)[member]
+    return value
+
+
+class Step():
+    """A single action of a scenario
+
+    The action is either the name of a method of the Vbox instance, like
+    "start" or "os.download_file", or a callable, which gets the Vbox instance
+    as first argument. Waiting for a condition, like Vbox.wait_for_boot, is a
+    step of its own, so following steps start as soon as the condition holds.
+    """
+
+    def __init__(self, name, vm, action, args=[], kwargs={}, after=[]):
+        """
+        Arguments:
+            name - unique name of the step, also used to reference its result
+            vm - name of the virtual machine, None for steps on the host
+            action - method name or callable
+            args - list of positional arguments, may contain Ref objects
+            kwargs - dict of keyword arguments, may contain Ref objects
+            after - list of names of steps, which need to finish first
+        """
+        self.name = name
+        self.vm = vm
+        self.action = action
+        self.args = list(args)
+        self.kwargs = dict(kwargs)
+        self.after = list(after)
+        for ref in _refs(self.args) + _refs(self.kwargs):
+            if ref not in self.after:
+                self.after.append(ref)
+
+
+    def execute(self, vbox, results):
+        """runs the action and returns its result
+        """
+        args = _resolve(self.args, results)
+        kwargs = _resolve(self.kwargs, results)
+        if callable(self.action):
+            return self.action(vbox, *args, **kwargs)
+        func = vbox
+        for attr in self.action.split("."):
+            func = getattr(func, attr)
+        return func(*args, **kwargs)
+
+
+class Scenario():
+    """A set of steps on several virtual machines with dependencies
+
+    The steps form a directed acyclic graph, independent steps run
+    concurrently, while steps on the same virtual machine never overlap, so
+    the scenario takes about as long as its longest chain of dependencies.
+
+    Example:
+        sc = Scenario({"server": vbox_s, "client": vbox_c})
+        sc.step("boot_s", "server", "start")
+        sc.step("boot_c", "client", "start")
+        sc.step("ip", "server", "get_ip", after=["boot_s"])
+        sc.step("browse", "client", "os.open_browser",
+                args=[Ref("ip", "{0}:8080")], after=["boot_c"])
+        results = sc.run()
+
+    The same scenario can be given as JSON, see from_json.
+    """
+
+    def __init__(self, vms={}):
+        """
+        Arguments:
+            vms - dict mapping names to Vbox instances
+        """
+        self.vms = dict(vms)
+        self.steps = {}
+        self.step_order = []
+        self.timings = {}
+
+
+    def add_vm(self, name, vbox):
+        """Adds a virtual machine, steps can refer to by name
+        """
+        self.vms[name] = vbox
+
+
+    def step(self, name, vm, action, args=[], kwargs={}, after=[]):
+        """Adds a step, see Step for the arguments
+
+        Returns:
+            the new Step
+        """
+        if name in self.steps:
+            raise ValueError("duplicate step name: " + name)
+        step = Step(name, vm, action, args, kwargs, after)
+        self.steps[name] = step
+        self.step_order.append(name)
+        return step
+
+
+    @classmethod
+    def from_dict(cls, data, vms={}):
+        """Creates a scenario from a dict
+
+        Arguments:
+            data - dict with a list "steps", each step is a dict with the keys
+                of Step.__init__, action needs to be a method name
+            vms - dict mapping names to Vbox instances
+        """
+        scenario = cls(vms)
+        for each in data["steps"]:
+            scenario.step(each["name"], each.get("vm"), each["action"],
+                          _from_json_value(each.get("args", [])),
+                          _from_json_value(each.get("kwargs", {})),
+                          each.get("after", []))
+        return scenario
+
+
+    @classmethod
+    def from_json(cls, path, vms={}):
+        """Creates a scenario from a JSON file, see from_dict
+
+        Example file:
+            {"steps": [
+                {"name": "boot", "vm": "server", "action": "start",
+                 "kwargs": {"session_type": "SessionType.gui"}},
+                {"name": "ip", "vm": "server", "action": "get_ip",
+                 "after": ["boot"]},
+                {"name": "browse", "vm": "client", "action": "os.open_browser",
+                 "args": [{"ref": "ip", "format": "{0}:8080"}]}
+            ]}
+        """
+        with open(path) as f:
+            return cls.from_dict(json.load(f), vms)
+
+
+    def order(self):
+        """Checks the graph and returns the step names in topological order
+
+        Raises ValueError on unknown vms, unknown dependencies or cycles
+        """
+        for name in self.step_order:
+            step = self.steps[name]
+            if step.vm is not None and step.vm not in self.vms:
+                raise ValueError("step %s uses unknown vm %s" % (name, step.vm))
+            for dep in step.after:
+                if dep not in self.steps:
+                    raise ValueError("step %s depends on unknown step %s"
+                                     % (name, dep))
+
+        ret = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("cycle in scenario: "
+                                 + " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for dep in self.steps[name].after:
+                visit(dep, path + [name])
+            state[name] = "done"
+            ret.append(name)
+
+        for name in self.step_order:
+            visit(name, [])
+        return ret
+
+
+    def run(self, workers=8):
+        """Runs all steps, each as soon as its dependencies are finished
+
+        If a step fails, no further steps are started, the exception is
+        raised once the running steps finished, with the name of the step in
+        its attribute step. A warning is added to the log of the VM of the
+        step.
+
+        Arguments:
+            workers - maximum number of steps running at the same time
+
+        Returns:
+            dict mapping step names to the return values of their actions
+        """
+        order = self.order()
+        results = {}
+        running = set()
+        busy_vms = set()
+        errors = []
+        condition = threading.Condition()
+        self.timings = {}
+
+        def execute(step):
+            start = time.time()
+            try:
+                result = step.execute(self.vms.get(step.vm), results)
+            except Exception as e:
+                result = None
+                errors.append((step.name, e))
+            with condition:
+                self.timings[step.name] = (start, time.time())
+                results[step.name] = result
+                running.discard(step.name)
+                busy_vms.discard(step.vm)
+                condition.notify_all()
+
+        with condition:
+            while len(results) < len(order) and not errors:
+                for name in order:
+                    if len(running) >= workers:
+                        break
+                    step = self.steps[name]
+                    if name in results or name in running:
+                        continue
+                    if step.vm is not None and step.vm in busy_vms:
+                        continue
+                    if not all(dep in results for dep in step.after):
+                        continue
+                    running.add(name)
+                    if step.vm is not None:
+                        busy_vms.add(step.vm)
+                    thread = threading.Thread(target=execute, args=(step,))
+                    thread.daemon = True
+                    thread.start()
+                condition.wait()
+            while running:
+                condition.wait()
+
+        if errors:
+            name, error = errors[0]
+            error.step = name
+            vbox = self.vms.get(self.steps[name].vm)
+            if vbox is not None:
+                vbox.log.add_warning("step %s failed: %s" % (name, error))
+            raise error
+        return results
+
+
+    def critical_path(self):
+        """Returns the chain of steps of the last run, which determined its
+        duration, as list of step names
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda x: self.timings[x][1])
+        path = [name]
+        while self.steps[name].after:
+            name = max(self.steps[name].after,
+                       key=lambda x: self.timings[x][1])
+            path.insert(0, name)
+        return path
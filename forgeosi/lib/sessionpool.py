@@ -0,0 +1,294 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+__doc__ = """\
+Pool of guest sessions, to run processes of one or more users in parallel,
+see class documentation for details
+"""
+
+
+TRANSIENT = "transient"
+"""the guest is not ready yet, for example the additions are still loading"""
+CREDENTIALS = "credentials"
+"""username or password are wrong, retrying is pointless"""
+GONE = "gone"
+"""the machine is not running anymore, retrying is pointless"""
+
+_CREDENTIAL_HINTS = ["authentication", "logon failure", "unable to logon",
+                     "not able to logon", "wrong password"]
+_GONE_HINTS = ["not running", "invalid_vm_state", "invalid vm state",
+               "machine is not", "object is not ready", "no longer available"]
+
+
+class SessionError(Exception):
+    """Raised, if no guest session could be created
+
+    Attributes:
+        kind - TRANSIENT, CREDENTIALS or GONE
+        cause - the original exception, if any
+    """
+
+    def __init__(self, kind, message, cause=None):
+        Exception.__init__(self, "%s: %s" % (kind, message))
+        self.kind = kind
+        self.cause = cause
+
+
+def classify_error(error):
+    """Guesses from an exception or an error message reported by the guest,
+    if creating a guest session can succeed later
+
+    Returns:
+        TRANSIENT, CREDENTIALS or GONE
+    """
+    if isinstance(error, SessionError):
+        return error.kind
+    message = str(error).lower()
+    for hint in _CREDENTIAL_HINTS:
+        if hint in message:
+            return CREDENTIALS
+    for hint in _GONE_HINTS:
+        if hint in message:
+            return GONE
+    return TRANSIENT
+
+
+def establish_session(create, timeout=300, base_delay=0.5, max_delay=10.0,
+                      stats=None):
+    """Creates a guest session, retrying with exponential backoff and jitter
+
+    Permanent errors, see classify_error, are raised right away as
+    SessionError, transient ones are retried until timeout.
+
+    Arguments:
+        create - callable without arguments, returning a started session
+        timeout - time in seconds, 0 tries only once
+        base_delay - upper bound of the first delay in seconds, doubled after
+            every failure
+        max_delay - upper bound of all delays
+        stats - optional dict, filled with timing information:
+            attempts - number of calls to create
+            attempt_times - duration of every call in seconds
+            waited - time in seconds spent sleeping between attempts
+            errors - classification of every failed attempt
+            total - time in seconds until the session was ready
+
+    Returns:
+        the session returned by create
+    """
+    if stats is None:
+        stats = {}
+    stats.update({'attempts': 0, 'attempt_times': [], 'waited': 0.0,
+                  'errors': [], 'total': 0.0})
+    start = time.time()
+    delay = base_delay
+
+    while True:
+        stats['attempts'] += 1
+        attempt = time.time()
+        try:
+            session = create()
+        except Exception as e:
+            stats['attempt_times'].append(time.time() - attempt)
+            kind = classify_error(e)
+            stats['errors'].append(kind)
+            if kind != TRANSIENT:
+                stats['total'] = time.time() - start
+                raise SessionError(kind, str(e), e)
+            remaining = start + timeout - time.time()
+            if remaining <= 0:
+                stats['total'] = time.time() - start
+                raise SessionError(kind, "no guest session after %s seconds, "
+                                   "last error: %s" % (timeout, e), e)
+            # full jitter keeps several machines from retrying in lockstep
+            sleep = min(random.uniform(0, delay), remaining)
+            time.sleep(sleep)
+            stats['waited'] += sleep
+            delay = min(delay * 2, max_delay)
+        else:
+            stats['attempt_times'].append(time.time() - attempt)
+            stats['total'] = time.time() - start
+            return session
+
+
+class GuestSessionPool():
+    """Bounded pool of guest sessions, keyed by username and password
+
+    Every guest session is used by one caller at a time, so independent
+    processes, also of different users, can run in parallel inside one VM.
+    Idle sessions are checked before they are handed out again, sessions,
+    which died, for example because the guest rebooted, are replaced by new
+    ones.
+
+    Creating and checking sessions is done by callables, so the pool can be
+    used without VirtualBox as well.
+    """
+
+    def __init__(self, create, healthy, max_sessions=16, close=None):
+        """Initializes the pool
+
+        Arguments:
+            create - callable(username, password) returning a new session,
+                raising an exception, if that is not possible
+            healthy - callable(session) returning False for dead sessions
+            max_sessions - maximum number of open sessions of all users,
+                VirtualBox allows up to 255 per VM
+            close - optional callable(session), closing a session
+        """
+        self.create = create
+        self.healthy = healthy
+        self.close = close
+        self.max_sessions = max_sessions
+        self.idle = {}
+        self.busy = {}
+        self.count = 0
+        self.condition = threading.Condition()
+
+
+    def _discard(self, session):
+        """closes a session, errors are ignored, since it might be dead
+        """
+        if self.close:
+            try:
+                self.close(session)
+            except:
+                pass
+
+
+    def _take_idle(self, key):
+        """returns a healthy idle session of key or None, must be called with
+        the condition held
+        """
+        idle = self.idle.get(key, [])
+        while idle:
+            session = idle.pop()
+            if self.healthy(session):
+                return session
+            self.count -= 1
+            self._discard(session)
+        return None
+
+
+    def _evict_idle(self):
+        """closes one idle session of any user, to make room for another user,
+        must be called with the condition held
+        """
+        for key in self.idle:
+            if self.idle[key]:
+                self._discard(self.idle[key].pop())
+                self.count -= 1
+                return True
+        return False
+
+
+    def acquire(self, username, password, timeout=60, retry_interval=0.5):
+        """Hands out a guest session of the user, for exclusive use
+
+        Waits if all sessions are in use. If no session can be created, for
+        example while the guest reboots, creating is retried until timeout.
+
+        Arguments:
+            username - user the session should belong to
+            password - password of the user
+            timeout - time in seconds, None waits forever
+            retry_interval - time in seconds between the first retries of
+                creating a session, doubled after every failure
+
+        Returns:
+            guest session, to be given back with release()
+        """
+        key = (username, password)
+        deadline = None if timeout is None else time.time() + timeout
+        error = None
+
+        while True:
+            with self.condition:
+                while True:
+                    session = self._take_idle(key)
+                    if session is not None:
+                        self.busy[id(session)] = key
+                        return session
+                    if self.count < self.max_sessions or self._evict_idle():
+                        # reserve the slot, while creating without the lock
+                        self.count += 1
+                        break
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise RuntimeError("no guest session available "
+                                               "after %s seconds" % timeout)
+                    self.condition.wait(remaining)
+
+            try:
+                session = self.create(username, password)
+            except Exception as e:
+                error = e
+                session = None
+
+            with self.condition:
+                if session is None:
+                    self.count -= 1
+                    self.condition.notify_all()
+                else:
+                    self.busy[id(session)] = key
+                    return session
+
+            kind = classify_error(error)
+            if kind != TRANSIENT:
+                raise SessionError(kind, str(error), error)
+            if deadline is not None and time.time() >= deadline:
+                raise SessionError(kind, str(error), error)
+            time.sleep(retry_interval)
+            retry_interval = min(retry_interval * 2, 5.0)
+
+
+    def release(self, session):
+        """Gives a session back to the pool
+        """
+        with self.condition:
+            key = self.busy.pop(id(session), None)
+            if key is None:
+                # handed out before clear(), the session is gone anyway
+                self._discard(session)
+                return
+            self.idle.setdefault(key, []).append(session)
+            self.condition.notify_all()
+
+
+    @contextmanager
+    def session(self, username, password, timeout=60):
+        """Context manager around acquire() and release()
+
+        Example:
+            with vbox.guest_sessions.session("eve", "secret") as gs:
+                gs.execute("/usr/bin/id")
+        """
+        session = self.acquire(username, password, timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+
+    def clear(self):
+        """Closes all idle sessions and forgets the ones in use, needed after
+        the machine stopped
+        """
+        with self.condition:
+            for key in self.idle:
+                for session in self.idle[key]:
+                    self._discard(session)
+            self.idle = {}
+            self.busy = {}
+            self.count = 0
+            self.condition.notify_all()
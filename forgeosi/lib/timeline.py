@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import csv
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__doc__ = """\
+Reconstruction of the guest clock for log entries, see class documentation
+for details
+
+Needs numpy, which is optional for the rest of ForGeOSI, install it with
+pip install forgeosi[numpy]
+"""
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("the timeline needs numpy, install it with "
+                          "pip install forgeosi[numpy]")
+
+
+def guest_clock(times, change_times, change_rates, change_offsets,
+                change_anchors, default_offsets=None):
+    """Maps host times to the virtual time of the guest
+
+    The guest clock is set to host time plus offset, whenever the VM starts
+    (anchor), and then runs at rate percent of the host clock, until the rate
+    changes. The guest time at every change is the cumulative sum of the
+    elapsed host time weighted with the rate before it, restarted at every
+    anchor, all computed without Python loops.
+
+    Arguments:
+        times - host times to map, array of seconds
+        change_times - host times of the rate changes and anchors, sorted
+        change_rates - rate in percent from each change on
+        change_offsets - offset in seconds of the guest clock at each anchor
+        change_anchors - True for changes, which set the guest clock
+        default_offsets - offsets for times before the first change, their
+            rate is assumed to be 100 percent, default 0
+
+    Returns:
+        array of guest times in seconds
+    """
+    _require_numpy()
+    times = numpy.asarray(times, dtype="f8")
+    change_times = numpy.asarray(change_times, dtype="f8")
+    change_rates = numpy.asarray(change_rates, dtype="f8") / 100.0
+    change_offsets = numpy.asarray(change_offsets, dtype="f8")
+    change_anchors = numpy.asarray(change_anchors, dtype=bool)
+    if default_offsets is None:
+        default_offsets = numpy.zeros(len(times))
+    before = times + numpy.asarray(default_offsets, dtype="f8")
+    if not len(change_times):
+        return before
+
+    # the first change always sets the clock, as nothing is known before it
+    change_anchors = change_anchors.copy()
+    change_anchors[0] = True
+
+    # guest time elapsed between two changes, at the rate of the earlier one
+    elapsed = numpy.zeros(len(change_times))
+    elapsed[1:] = numpy.diff(change_times) * change_rates[:-1]
+    total = numpy.cumsum(elapsed)
+
+    # index of the last anchor at or before every change
+    last_anchor = numpy.where(change_anchors,
+                              numpy.arange(len(change_times)), 0)
+    last_anchor = numpy.maximum.accumulate(last_anchor)
+
+    start = change_times[last_anchor] + change_offsets[last_anchor]
+    change_guest = start + total - total[last_anchor]
+
+    index = numpy.searchsorted(change_times, times, side="right") - 1
+    valid = index >= 0
+    index = numpy.maximum(index, 0)
+    guest = change_guest[index] + \
+        (times - change_times[index]) * change_rates[index]
+    return numpy.where(valid, guest, before)
+
+
+class Timeline():
+    """Guest clock timeline of one or more logs
+
+    Every entry with a time is mapped to the time the guest clock showed, when
+    it happened, using the rate changes and starts of the VM recorded as
+    LogTimeRate entries. This is the time, forensic tools find in the file
+    system of the guest. Timelines of several VMs can be merged.
+
+    Attributes, arrays with one element per entry, sorted by guest time:
+        guest_time - time of the guest clock in seconds
+        real_time - time of the host in seconds
+        vm - name of the VM
+        kind - node name of the entry, like "process"
+        text - short description, like the path of a process
+    """
+
+    def __init__(self, guest_time, real_time, vm, kind, text):
+        _require_numpy()
+        order = numpy.argsort(guest_time, kind="mergesort")
+        self.guest_time = numpy.asarray(guest_time, dtype="f8")[order]
+        self.real_time = numpy.asarray(real_time, dtype="f8")[order]
+        self.vm = numpy.asarray(vm, dtype=object)[order]
+        self.kind = numpy.asarray(kind, dtype=object)[order]
+        self.text = numpy.asarray(text, dtype=object)[order]
+
+
+    def __len__(self):
+        return len(self.guest_time)
+
+
+    @classmethod
+    def from_logger(cls, log, vm=None):
+        """Builds the timeline of a Logger
+
+        Arguments:
+            log - Logger
+            vm - name of the VM, default the name in the LogVM entry
+        """
+        if vm is None:
+            vm = next((x.vmname for x in log.log if hasattr(x, 'vmname')),
+                      "")
+
+        changes = ([], [], [], [])
+        columns = ([], [], [], [])
+        for each in log.log:
+            if not hasattr(each, 'real_time'):
+                continue
+            if each.node_name == "time_rate":
+                for column, value in zip(changes, (each.real_time, each.rate,
+                                                   each.offset, each.anchor)):
+                    column.append(value)
+                continue
+            # Vbox stores the offset in milliseconds, added to the seconds
+            for column, value in zip(columns, (
+                    each.real_time, (each.time - each.real_time) / 1000.0,
+                    each.node_name, getattr(each, each.columns[0]))):
+                column.append(value)
+
+        real_time, offsets, kinds, text = columns
+        guest_time = guest_clock(real_time, *(changes + (offsets,)))
+        return cls(guest_time, real_time, [vm] * len(real_time), kinds, text)
+
+
+    @classmethod
+    def from_tables(cls, tables, vm=""):
+        """Builds the timeline of a log exported in npz format, see
+        exporters.NumpyExporter, without looking at single entries
+
+        Arguments:
+            tables - dict of structured arrays, as returned by its load()
+            vm - name of the VM
+        """
+        # local import, exporters are not needed for logs in memory
+        try:
+            from .logger import _LogEntry
+        except (ImportError, ValueError):
+            from logger import _LogEntry
+        node_names = dict((x.__name__, x) for x in _LogEntry.__subclasses__())
+
+        changes = tables.get("LogTimeRate")
+        if changes is None:
+            changes = numpy.zeros(0, dtype=[("real_time", "f8"),
+                                            ("rate", "f8"), ("offset", "f8"),
+                                            ("anchor", "?")])
+        changes = changes[numpy.argsort(changes["real_time"])]
+
+        parts = []
+        for name, table in tables.items():
+            if name not in node_names or name == "LogTimeRate" or \
+                    "real_time" not in (table.dtype.names or ()):
+                continue
+            entry = node_names[name]
+            parts.append((table["real_time"],
+                          (table["time"] - table["real_time"]) / 1000.0,
+                          numpy.full(len(table), entry.node_name, dtype=object),
+                          table[entry.columns[0]].astype(object)))
+        if not parts:
+            return cls([], [], [], [], [])
+        real_time = numpy.concatenate([x[0] for x in parts])
+        guest_time = guest_clock(real_time, changes["real_time"],
+                                 changes["rate"], changes["offset"],
+                                 changes["anchor"],
+                                 numpy.concatenate([x[1] for x in parts]))
+        return cls(guest_time, real_time, [vm] * len(real_time),
+                   numpy.concatenate([x[2] for x in parts]),
+                   numpy.concatenate([x[3] for x in parts]))
+
+
+    @classmethod
+    def merge(cls, timelines):
+        """Merges the timelines of several VMs into one, sorted by guest time
+        """
+        timelines = list(timelines)
+        if not timelines:
+            return cls([], [], [], [], [])
+        return cls(*[numpy.concatenate([getattr(x, name) for x in timelines])
+                     for name in ("guest_time", "real_time", "vm", "kind",
+                                  "text")])
+
+
+    def between(self, start, end):
+        """Returns the part of the timeline with guest times from start to end
+        """
+        lo = numpy.searchsorted(self.guest_time, start, side="left")
+        hi = numpy.searchsorted(self.guest_time, end, side="right")
+        part = Timeline.__new__(Timeline)
+        for name in ("guest_time", "real_time", "vm", "kind", "text"):
+            setattr(part, name, getattr(self, name)[lo:hi])
+        return part
+
+
+    def write_csv(self, path):
+        """Writes the timeline as CSV, one line per entry
+        """
+        with open(path, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["guest_time", "real_time", "vm", "type", "text"])
+            writer.writerows(zip(self.guest_time, self.real_time, self.vm,
+                                 self.kind, self.text))
@@ -0,0 +1,380 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+
+import array
+import io
+import mmap
+import os
+import struct
+import sys
+import uuid
+
+__doc__ = """\
+Memory mapped reader for VirtualBox VDI images and chains of differencing
+images, see class documentation for details
+"""
+
+
+VDI_SIGNATURE = 0xbeda107f
+"""Signature of VDI images, at offset 0x40"""
+
+VDI_TYPE_NORMAL = 1
+VDI_TYPE_FIXED = 2
+VDI_TYPE_DIFF = 4
+
+BLOCK_FREE = 0xffffffff
+"""Block map entry of a block, which was never written, in a differencing
+image it is read from the parent"""
+
+BLOCK_ZERO = 0xfffffffe
+"""Block map entry of a block, which reads as zeros"""
+
+_HEADER = struct.Struct("<64sIIIII256sII16xIQIIII16s16s16s16s")
+
+
+def is_zero(data):
+    """Checks if a block read from an image contains only zeros
+
+    Most blocks differ from zero in their first sector already, only those,
+    which do not, are compared as a whole.
+    """
+    head = bytes(data[:512])
+    if head != b"\0" * len(head):
+        return False
+    return bytes(data) == b"\0" * len(data)
+
+
+class VdiError(Exception):
+    """Raised for files, which are no VDI images or use unsupported features
+    """
+    pass
+
+
+class VdiImage():
+    """A VDI image, read through its block allocation map
+
+    VDI images consist of a header, the block map with one 32 bit entry per
+    block of the virtual disk, and the data of the allocated blocks, in the
+    order they were first written. Differencing images, like those of linked
+    clones, only contain the blocks written since they were created, so the
+    block map tells, which parts of the disk changed, without reading any
+    data.
+
+    The image is memory mapped, blocks are returned as views of the mapping,
+    so reading them copies nothing and costs page faults only for the parts,
+    which are actually used. Views must not be used after close.
+
+    Example:
+        image = VdiImage("clone.vdi")
+        for block in image.allocated_blocks():
+            data = image.read_block(block)
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+            path - path of the .vdi file
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise VdiError("%s is too short for a VDI image" % path)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # Python 2 can not create memoryviews of mmaps, slices are copied
+            self.view = memoryview(self.map)
+        except TypeError:
+            self.view = self.map
+        try:
+            self._read_header()
+            self.block_map = self._read_block_map()
+        except:
+            self.close()
+            raise
+        self.zero_block = b"\0" * self.block_size
+
+
+    def _read_header(self):
+        (_, signature, version, header_size, self.image_type, self.flags,
+         _, self.offset_blocks, self.offset_data, _, self.disk_size,
+         self.block_size, self.block_extra, self.blocks,
+         self.blocks_allocated, create, modify, link,
+         parent_modify) = _HEADER.unpack(self.map[:_HEADER.size])
+
+        if signature != VDI_SIGNATURE:
+            raise VdiError("%s is no VDI image" % self.path)
+        if version >> 16 != 1:
+            raise VdiError("%s has the unsupported VDI version %d.%d"
+                           % (self.path, version >> 16, version & 0xffff))
+        self.version = version
+        self.uuid_create = uuid.UUID(bytes_le=create)
+        self.uuid_modify = uuid.UUID(bytes_le=modify)
+        self.uuid_link = uuid.UUID(bytes_le=link)
+        self.uuid_parent_modify = uuid.UUID(bytes_le=parent_modify)
+
+
+    def _read_block_map(self):
+        block_map = array.array("I")
+        if block_map.itemsize != 4:
+            block_map = array.array("L")
+        raw = self.map[self.offset_blocks:self.offset_blocks + self.blocks * 4]
+        if len(raw) != self.blocks * 4:
+            raise VdiError("block map of %s is truncated" % self.path)
+        if hasattr(block_map, "frombytes"):
+            block_map.frombytes(raw)
+        else:
+            block_map.fromstring(raw)
+        if sys.byteorder != "little":
+            block_map.byteswap()
+        return block_map
+
+
+    def close(self):
+        if self.view is not self.map:
+            self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # blocks returned by read_block are still in use, the mapping is
+            # closed, once they are gone
+            pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    @property
+    def is_diff(self):
+        return self.image_type == VDI_TYPE_DIFF
+
+
+    def allocated_blocks(self):
+        """Yields the numbers of all blocks, which are stored in this image,
+        including blocks marked as zero
+        """
+        for block, entry in enumerate(self.block_map):
+            if entry != BLOCK_FREE:
+                yield block
+
+
+    def block_offset(self, block):
+        """Returns the offset of the data of a block in the file, None for
+        free and zero blocks
+        """
+        entry = self.block_map[block]
+        if entry in (BLOCK_FREE, BLOCK_ZERO):
+            return None
+        return self.offset_data + entry * (self.block_size + self.block_extra) \
+            + self.block_extra
+
+
+    def read_block(self, block):
+        """Returns the data of a block, None for free blocks, which need to be
+        read from the parent of a differencing image
+        """
+        entry = self.block_map[block]
+        if entry == BLOCK_FREE:
+            return None
+        if entry == BLOCK_ZERO:
+            return self.zero_block
+        offset = self.block_offset(block)
+        return self.view[offset:offset + self.block_size]
+
+
+    def raw(self):
+        """Returns a read only, seekable file object of the whole disk, blocks
+        not stored in this image read as zeros
+        """
+        return RawView(self)
+
+
+class VdiChain():
+    """A differencing image together with all its parents
+
+    Linked clones write to a differencing image, every block they did not
+    write is read from the parent, up to the base image. Blocks missing in
+    all images read as zeros. Every image stores the creation UUID of its
+    parent, which is checked when opening the chain.
+
+    Example:
+        with VdiChain.open("clone.vdi", ["/vms/base"]) as chain:
+            disk = chain.raw()
+            disk.seek(446)
+            partitions = disk.read(64)
+    """
+
+    def __init__(self, paths):
+        """
+        Arguments:
+            paths - paths of the images, the differencing image first, its
+                base last
+        """
+        self.images = []
+        try:
+            for path in paths:
+                self.images.append(VdiImage(path))
+        except:
+            self.close()
+            raise
+        if not self.images:
+            raise VdiError("a chain needs at least one image")
+        for child, parent in zip(self.images, self.images[1:]):
+            if child.uuid_link != parent.uuid_create:
+                self.close()
+                raise VdiError("%s is not the parent of %s"
+                               % (parent.path, child.path))
+            if (child.block_size, child.blocks) != \
+                    (parent.block_size, parent.blocks):
+                self.close()
+                raise VdiError("%s and %s differ in their block layout"
+                               % (parent.path, child.path))
+        self.path = self.images[0].path
+        self.block_size = self.images[0].block_size
+        self.blocks = self.images[0].blocks
+        self.disk_size = self.images[0].disk_size
+        self.zero_block = self.images[0].zero_block
+
+
+    @classmethod
+    def open(cls, path, search=None):
+        """Opens a differencing image and finds its parents
+
+        Arguments:
+            path - path of the differencing image
+            search - directories to look for parents in, default the
+                directory of path. VirtualBox keeps linked clones in the
+                Snapshots folder of the clone, so the folder of the base VM
+                usually needs to be given.
+        """
+        if search is None:
+            search = [os.path.dirname(os.path.abspath(path))]
+        candidates = {}
+        for directory in search:
+            for root, _, filenames in os.walk(directory):
+                for name in filenames:
+                    if name.lower().endswith(".vdi"):
+                        candidate = os.path.join(root, name)
+                        try:
+                            with VdiImage(candidate) as image:
+                                candidates[image.uuid_create] = candidate
+                        except (VdiError, EnvironmentError, ValueError):
+                            continue
+
+        paths = [path]
+        with VdiImage(path) as image:
+            link = image.uuid_link if image.is_diff else None
+        while link is not None:
+            if link not in candidates:
+                raise VdiError("parent %s of %s not found" % (link, paths[-1]))
+            paths.append(candidates[link])
+            with VdiImage(paths[-1]) as image:
+                link = image.uuid_link if image.is_diff else None
+        return cls(paths)
+
+
+    def close(self):
+        for image in self.images:
+            image.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def read_block(self, block):
+        """Returns the data of a block from the first image storing it
+        """
+        for image in self.images:
+            data = image.read_block(block)
+            if data is not None:
+                return data
+        return self.zero_block
+
+
+    def allocated_blocks(self):
+        """Yields the numbers of all blocks stored in any image of the chain
+        """
+        for block in range(self.blocks):
+            for image in self.images:
+                if image.block_map[block] != BLOCK_FREE:
+                    yield block
+                    break
+
+
+    def raw(self):
+        """Returns a read only, seekable file object of the whole disk
+        """
+        return RawView(self)
+
+
+class RawView(io.RawIOBase):
+    """Read only, seekable view of the virtual disk of a VdiImage or VdiChain,
+    as if it was exported as RAW image
+
+    Reads copy only the requested bytes out of the memory mapped images, so
+    it can be handed to any tool reading file objects. It is only valid, as
+    long as the images are open.
+    """
+
+    def __init__(self, image):
+        io.RawIOBase.__init__(self)
+        self.image = image
+        self.size = image.disk_size
+        self.position = 0
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def tell(self):
+        return self.position
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("invalid whence %r" % whence)
+        if position < 0:
+            raise ValueError("negative seek position %d" % position)
+        self.position = position
+        return position
+
+
+    def readinto(self, buf):
+        view = memoryview(buf)
+        count = min(len(view), max(0, self.size - self.position))
+        done = 0
+        block_size = self.image.block_size
+        while done < count:
+            block, offset = divmod(self.position + done, block_size)
+            length = min(block_size - offset, count - done)
+            data = self.image.read_block(block)
+            if data is None:
+                data = self.image.zero_block
+            view[done:done + length] = data[offset:offset + length]
+            done += length
+        self.position += done
+        return done
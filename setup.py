@@ -18,5 +18,6 @@ setup(
     license="simplified BSD",
     zip_safe=False,
     install_requires=['pyvbox', 'enum34', 'decorator'],
+    extras_require={'numpy': ['numpy']},
     platforms=['cygwin', 'linux'],
 )
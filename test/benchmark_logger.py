@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'forgeosi', 'lib'))
+
+import logger
+
+
+def linear_pid(log, pid):
+    """lookup as done before the logger kept indexes"""
+    return [each for each in log.log
+            if isinstance(each, logger.LogProcess) and each.pid == pid]
+
+
+def linear_type(log, logtype):
+    return [each for each in log.log if isinstance(each, logtype)]
+
+
+def linear_prefix(log, prefix):
+    return [each.pid for each in log.log if isinstance(each, logger.LogProcess)
+            and each.path.startswith(prefix)]
+
+
+def linear_path(log, path):
+    return [each.pid for each in log.log if isinstance(each, logger.LogProcess)
+            and path in each.path]
+
+
+def linear_time(log, start, end):
+    ret = [each for each in log.log if hasattr(each, 'time')
+           and start <= each.time <= end]
+    return sorted(ret, key=lambda x: x.time)
+
+
+def check(log, pid, start, end):
+    """the indexed lookups need to return the same as linear scans"""
+    assert log.get_process(pid) == linear_pid(log, pid)
+    for logtype in (logger.LogVM, logger.LogProcess, logger.LogMouse,
+                    logger.LogRawKeyboard):
+        assert log.get_log_object_by_type(logtype) == \
+            linear_type(log, logtype)
+    for prefix in ("/usr/bin/prog4", "/usr/bin/", "/nowhere"):
+        assert log.get_pid_by_prefix(prefix) == linear_prefix(log, prefix)
+    for path in ("prog4", "prog49", ""):
+        assert log.get_pid(path) == linear_path(log, path)
+    assert log.get_by_time(start, end) == linear_time(log, start, end)
+    assert log.get_by_time() == linear_time(log, float('-inf'),
+                                            float('inf'))
+
+
+def run(entries=100000):
+    """benchmark of logger lookups
+
+    Fills a log with entries, a third of them processes, and compares the
+    indexed lookups with linear scans over the log
+    """
+    log = logger.Logger()
+    log.add_vm("bench", "bench-base", "Linux")
+    start = time.time()
+    for i in range(entries):
+        if i % 3 == 0:
+            log.add_process(None, "/usr/bin/prog%d" % (i % 50), [], pid=i,
+                            time_offset=i)
+        elif i % 3 == 1:
+            log.add_keyboard("x", time_offset=i)
+        else:
+            log.add_mouse(1, 2, True, False, False, time_offset=i)
+    print("filling %d entries: %.3fs" % (entries, time.time() - start))
+
+    pid = (entries // 3) * 3 - 3
+    check(log, pid, time.time() + 500, time.time() + 600)
+
+    cases = [
+        ("pid, linear", lambda: linear_pid(log, pid)),
+        ("pid, indexed", lambda: log.get_process(pid)),
+        ("type, linear", lambda: linear_type(log, logger.LogVM)),
+        ("type, indexed", lambda: log.get_log_object_by_type(logger.LogVM)),
+        ("path prefix", lambda: log.get_pid_by_prefix("/usr/bin/prog4")),
+        ("time range", lambda: log.get_by_time(time.time() + 500,
+                                               time.time() + 600)),
+    ]
+    for name, func in cases:
+        print("%-14s %.6fs" % (name, min(timeit.repeat(func, number=10,
+                                                       repeat=3)) / 10))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
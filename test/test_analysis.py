@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Scans the logs of fake runs into a database, without VirtualBox, run with
+#   python -m unittest test_analysis
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import analysis, filestore, logger
+
+
+IDIFF = """New files:
+  /home/default/a.txt
+Deleted files:
+  /tmp/old
+"""
+
+
+class RunDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, "output")
+        self.store = filestore.FileStore(os.path.join(self.tmp, "store"))
+        self.db = analysis.RunDatabase(os.path.join(self.tmp, "runs.sqlite"))
+
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp)
+
+
+    def run_dir(self, name, content, fmt):
+        """writes the log of a run, which copied a file and typed"""
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory)
+        source = os.path.join(self.tmp, name + ".txt")
+        with open(source, "w") as f:
+            f.write(content)
+        log = logger.Logger(self.store)
+        log.add_process(None, "/usr/bin/xterm", [], key_input="ls\n", pid=7)
+        log.add_file(source, "/home/default/a.txt")
+        log.add_keyboard("secret")
+        if fmt == "xml":
+            log.add_warning("guest slow", verbose=False)
+            log.write_xml_log(os.path.join(directory, "log.xml"))
+        else:
+            log.export(os.path.join(directory, "log.jsonl.gz"))
+        log.cleanup()
+        return directory
+
+
+    def test_scan(self):
+        first = self.run_dir("run1", "one", "xml")
+        second = self.run_dir("run2", "two", "jsonl")
+        with open(os.path.join(first, "idiff.log"), "w") as f:
+            f.write(IDIFF)
+
+        self.assertEqual(self.db.scan(self.root, workers=2), 3)
+        self.assertEqual(self.db.runs_with_warnings(), [(first, 1)])
+        keyboard = self.db.keyboard_timeline()
+        self.assertEqual([(x[0], x[4]) for x in keyboard],
+                         [(first, "ls\n"), (first, "secret"),
+                          (second, "ls\n"), (second, "secret")])
+        differing = self.db.differing_files()
+        self.assertEqual([x[:2] for x in differing],
+                         [("/home/default/a.txt", 2)])
+        # the xml log leaves out the pid
+        self.assertEqual(self.db.query(
+            "SELECT source LIKE '%.xml', pid FROM entries "
+            "WHERE type = 'process' ORDER BY source"), [(1, None), (0, 7)])
+        self.assertEqual(self.db.query(
+            "SELECT section, line FROM idiff ORDER BY section"),
+            [("Deleted files", "  /tmp/old"),
+             ("New files", "  /home/default/a.txt")])
+
+
+    def test_rescan(self):
+        first = self.run_dir("run1", "one", "xml")
+        self.assertEqual(self.db.scan(self.root, workers=1), 1)
+        self.assertEqual(self.db.scan(self.root, workers=1), 0)
+
+        # a changed log replaces its rows
+        path = os.path.join(first, "log.xml")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(self.db.scan(self.root, workers=1), 1)
+        self.assertEqual(self.db.query("SELECT COUNT(*) FROM copied"), [(1,)])
+        self.assertEqual(self.db.query("SELECT COUNT(*) FROM runs"), [(1,)])
+
+
+    def test_is_log(self):
+        for name in ("log.xml", "log_c1.xml.gz", "log.jsonl", "log.jsonl.gz"):
+            self.assertTrue(analysis.is_log(name))
+        for name in ("idiff.log", "disk.img", "catalog.xml"):
+            self.assertFalse(analysis.is_log(name))
+
+
+if __name__ == '__main__':
+    unittest.main()
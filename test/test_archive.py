@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Archives the disks of a synthetic base image and linked clone, read through
+# the VDI reader, without VirtualBox, run with
+#   python -m unittest test_archive
+#
+
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import archive, blockhash, diff, rawexport, vdi
+import vdifile
+
+BLOCK = 16 * 1024
+BLOCKS = 64
+
+
+def random_bytes(rnd, length):
+    return bytes(bytearray(rnd.getrandbits(8) for _ in range(length)))
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.base = os.path.join(self.tmp, "base.vdi")
+        self.clone = os.path.join(self.tmp, "clone.vdi")
+        rnd = random.Random(4)
+        # the end of the disk is never written and reads as zeros
+        parent = vdifile.write_vdi(self.base, BLOCKS, BLOCK, dict(
+            (i, random_bytes(rnd, BLOCK)) for i in range(40)))
+        vdifile.write_vdi(self.clone, BLOCKS, BLOCK,
+                          {7: random_bytes(rnd, BLOCK), 50: b"new file"},
+                          parent=parent)
+        self.archive = archive.Archive(os.path.join(self.tmp, "archive"))
+
+
+    def tearDown(self):
+        self.archive.close()
+        shutil.rmtree(self.tmp)
+
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+
+    def add_both(self):
+        """archives the base and the clone, only the blocks written by the
+        clone are read
+        """
+        with vdi.VdiImage(self.base) as image:
+            self.base_data = image.raw().read()
+            full = self.archive.add("base", image.raw(),
+                                    identity=str(image.uuid_create))
+        with vdi.VdiChain([self.clone, self.base]) as chain:
+            self.clone_data = chain.raw().read()
+            with vdi.VdiImage(self.clone) as image:
+                changed = diff.changed_runs(image)
+            self.assertEqual(changed, [(7 * BLOCK, BLOCK),
+                                       (50 * BLOCK, BLOCK)])
+            stored = self.archive.add("clone", chain.raw(), base="base",
+                                      changed=changed)
+        return full, stored
+
+
+    def test_round_trip(self):
+        full, stored = self.add_both()
+        self.assertGreater(full, 30 * BLOCK)
+        self.assertLess(stored, full // 5)
+        self.assertEqual(self.archive.images(),
+                         [("base", BLOCKS * BLOCK, None),
+                          ("clone", BLOCKS * BLOCK, "base")])
+        with vdi.VdiImage(self.base) as image:
+            self.assertEqual(self.archive.identity("base"),
+                             str(image.uuid_create))
+        self.assertIsNone(self.archive.identity("clone"))
+        self.assertRaises(KeyError, self.archive.identity, "missing")
+
+        for name, data in (("base", self.base_data),
+                           ("clone", self.clone_data)):
+            path = os.path.join(self.tmp, name + ".img")
+            self.archive.restore(name, path)
+            self.assertEqual(self.read(path), data)
+            extents = self.archive.extents(name)
+            self.assertEqual(sum(x[1] for x in extents), len(data))
+
+        disk = self.archive.open("clone")
+        disk.seek(50 * BLOCK - 3)
+        self.assertEqual(disk.read(11), b"\0\0\0new file")
+        disk.seek(-10, io.SEEK_END)
+        self.assertEqual(disk.read(100), b"\0" * 10)
+
+
+    def test_reopen(self):
+        self.add_both()
+        self.archive.close()
+        self.archive = archive.Archive(os.path.join(self.tmp, "archive"))
+        self.assertEqual(self.archive.add("again", io.BytesIO(
+            self.clone_data)), 0)
+        path = os.path.join(self.tmp, "again.img")
+        self.archive.restore("again", path)
+        self.assertEqual(self.read(path), self.clone_data)
+        stats = self.archive.stats()
+        self.assertEqual(stats["images"], 3 * BLOCKS * BLOCK)
+
+
+    def test_script_with_block_digests(self):
+        raws = []
+        for paths in ([self.base], [self.clone, self.base]):
+            raw = paths[0] + ".img"
+            with vdi.VdiChain(paths) as chain:
+                rawexport.RawExport(
+                    chain, raw, sidecar=raw + blockhash.SIDECAR_SUFFIX,
+                    block_size=BLOCK).start().wait_for_completion()
+            raws.append(raw)
+        path = self.archive.path
+        self.archive.close()
+        archive.main([path, "add", "base", raws[0]])
+        archive.main([path, "add", "clone", raws[1], "--base", "base",
+                      "--changed"] + [x + blockhash.SIDECAR_SUFFIX
+                                      for x in raws])
+        restored = os.path.join(self.tmp, "restored.img")
+        archive.main([path, "restore", "clone", restored])
+        self.assertEqual(self.read(restored), self.read(raws[1]))
+        self.archive = archive.Archive(path)
+
+
+    def test_content_defined_chunks(self):
+        rnd = random.Random(7)
+        data = random_bytes(rnd, 600 * 1024)
+        chunks = list(archive.chunk_stream(io.BytesIO(data), len(data)))
+        self.assertEqual(b"".join(chunks), data)
+        for each in chunks[:-1]:
+            self.assertTrue(archive.MIN_CHUNK <= len(each) <=
+                            archive.MAX_CHUNK)
+        # inserting a byte only changes the chunks around it
+        moved = data[:1000] + b"x" + data[1000:]
+        other = list(archive.chunk_stream(io.BytesIO(moved), len(moved)))
+        self.assertEqual(other[1:], chunks[1:])
+
+
+    @unittest.skipIf(archive.numpy is None, "numpy is not installed")
+    def test_cut_candidates_without_numpy(self):
+        data = random_bytes(random.Random(9), 200 * 1024)
+        fast = archive._cut_candidates(data, 40)
+        numpy = archive.numpy
+        archive.numpy = None
+        try:
+            self.assertEqual(archive._cut_candidates(data, 40), fast)
+        finally:
+            archive.numpy = numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Tests of the asyncio front-end with fake machines, needs pyvbox and
+# Python 3.5 or newer, but no virtual machine, run with
+#   python -m unittest test_asyncvbox
+#
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+try:
+    import asyncio
+    import virtualbox
+    from forgeosi.lib import asyncvbox
+except (ImportError, SyntaxError):
+    asyncvbox = None
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class FakeProcess():
+    """Runs for a number of status queries, printing one chunk each"""
+
+    def __init__(self, chunks, pid=42):
+        self.chunks = list(chunks)
+        self.pid = pid
+
+    @property
+    def status(self):
+        library = virtualbox.library
+        if self.chunks:
+            return library.ProcessStatus.started
+        return library.ProcessStatus.terminated_normally
+
+    def read(self, handle, size, timeout):
+        if handle == 1 and self.chunks:
+            return self.chunks.pop(0)
+        return b""
+
+
+class FakeProgress():
+
+    completed = True
+    result_code = 0
+
+
+class FakeGuestSession():
+
+    def __init__(self, process=None, delay=0):
+        self.process = process
+        self.delay = delay
+        self.copied = []
+
+    def copy_to(self, source, dest, flags):
+        time.sleep(self.delay)
+        self.copied.append((source, dest))
+        return FakeProgress()
+
+    def process_create(self, command, arguments, environment, flags,
+                       timeout_ms):
+        return self.process
+
+
+@unittest.skipIf(asyncvbox is None, "pyvbox or asyncio is not available")
+class WaitConditionTest(unittest.TestCase):
+
+    def run_async(self, coroutine):
+        return run_async(coroutine)
+
+
+    def test_blocking_condition(self):
+        """a blocking condition must not stop other coroutines"""
+        ticks = []
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return len(calls) >= 2
+
+        async def ticker():
+            for _ in range(10):
+                ticks.append(time.time())
+                await asyncio.sleep(0.02)
+
+        async def both():
+            await asyncio.gather(
+                asyncvbox.wait_condition(slow, 5, blocking=True), ticker())
+
+        self.run_async(both())
+        self.assertEqual(len(calls), 2)
+        self.assertLess(max(b - a for a, b in zip(ticks, ticks[1:])), 0.15)
+
+
+    def test_timeout(self):
+        self.assertRaises(asyncio.TimeoutError, self.run_async,
+                          asyncvbox.wait_condition(lambda: False, 0.1))
+
+
+@unittest.skipIf(asyncvbox is None, "pyvbox or asyncio is not available")
+class RunProcessTest(unittest.TestCase):
+
+    def setUp(self):
+        import forgeosi
+        from forgeosi.lib import logger
+        self.vbox = forgeosi.Vbox.__new__(forgeosi.Vbox)
+        self.vbox.log = logger.Logger()
+        self.vbox.offset = 0
+        self.vbox.speedup = 100
+        self.vbox.running = True
+
+
+    def test_output_and_log(self):
+        self.vbox.guestsession = FakeGuestSession(
+            FakeProcess([b"hello ", b"world"]))
+        pid, stdout, stderr = run_async(
+            asyncvbox.AsyncVbox(self.vbox).run_process("/bin/echo"))
+        self.assertEqual((pid, stdout, stderr), (42, "hello world", ""))
+        entry = self.vbox.log.get_process(42)[0]
+        self.assertEqual(entry.stdout, "hello world")
+        # the log keeps no references to finished processes
+        self.assertIsNone(entry.process)
+
+
+    def test_key_input_waits_for_window(self):
+        calls = []
+
+        class FakeOS():
+            def wait_for_window(self, pid, timeout):
+                calls.append(("window", pid, timeout))
+
+            def keyboard_input(self, key_input, pid):
+                calls.append(("keys", pid, key_input))
+
+        self.vbox.os = FakeOS()
+        self.vbox.guestsession = FakeGuestSession(FakeProcess([b"x"] * 3))
+        start = time.time()
+        run_async(asyncvbox.AsyncVbox(self.vbox).run_process(
+            "/usr/bin/gedit", key_input="text", native_input=True,
+            wait_time=30))
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(calls, [("window", 42, 30), ("keys", 42, "text")])
+
+
+
+@unittest.skipIf(asyncvbox is None, "pyvbox or asyncio is not available")
+class CopyTest(unittest.TestCase):
+
+    def setUp(self):
+        import forgeosi
+        from forgeosi.lib import logger
+        self.vbox = forgeosi.Vbox.__new__(forgeosi.Vbox)
+        self.vbox.log = logger.Logger()
+        self.vbox.offset = 0
+        self.vbox.speedup = 100
+        self.vbox.running = True
+        self.source = os.path.abspath(__file__)
+
+
+    def test_copy_does_not_block(self):
+        ticks = []
+        self.vbox.guestsession = FakeGuestSession(delay=0.3)
+
+        async def ticker():
+            for _ in range(10):
+                ticks.append(time.time())
+                await asyncio.sleep(0.02)
+
+        async def both():
+            await asyncio.gather(asyncvbox.AsyncVbox(self.vbox).copy_to_vm(
+                self.source, "/tmp/x"), ticker())
+
+        run_async(both())
+        self.assertEqual(self.vbox.guestsession.copied,
+                         [(self.source, "/tmp/x")])
+        self.assertEqual(len(self.vbox.log.log), 1)
+        self.assertLess(max(b - a for a, b in zip(ticks, ticks[1:])), 0.15)
+        self.vbox.log.log[0].cleanup()
+
+
+    def test_not_running(self):
+        self.vbox.running = False
+        self.vbox.guestsession = None
+        run_async(asyncvbox.AsyncVbox(self.vbox).copy_to_vm(self.source,
+                                                            "/tmp/x"))
+        run_async(asyncvbox.AsyncVbox(self.vbox).copy_from_vm("/tmp/x",
+                                                              self.source))
+        self.assertEqual(self.vbox.log.log, [])
+
+
+
+@unittest.skipIf(asyncvbox is None, "pyvbox or asyncio is not available")
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        import forgeosi
+        import vdifile
+        self.tmp = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmp, "disk.vdi")
+        self.blocks = dict((x, bytes(bytearray([x + 1])) * 4096)
+                           for x in (0, 3, 5))
+        vdifile.write_vdi(self.image, 8, 4096, self.blocks)
+        self.vbox = forgeosi.Vbox.__new__(forgeosi.Vbox)
+        self.vbox.running = False
+        self.vbox._disk_chain = lambda controller, port, disk: [self.image]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_raw(self):
+        path = os.path.join(self.tmp, "disk.img")
+        hashes = run_async(asyncvbox.AsyncVbox(self.vbox).export(
+            path, raw=True, hashes=("sha256",), block_hashes=True))
+        with open(path, "rb") as f:
+            data = f.read()
+        self.assertEqual(len(data), 8 * 4096)
+        for block, content in self.blocks.items():
+            self.assertEqual(data[block * 4096:(block + 1) * 4096], content)
+        self.assertEqual(data[4096:2 * 4096], b"\0" * 4096)
+        self.assertEqual(hashes.digests["sha256"],
+                         hashlib.sha256(data).hexdigest())
+        self.assertTrue(os.path.exists(path + ".blockhashes"))
+
+
+if __name__ == '__main__':
+    unittest.main()
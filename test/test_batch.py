@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Runs batches of OSLinux with the bash of the host instead of a guest,
+# without VirtualBox, run with
+#   python -m unittest test_batch
+#
+
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib.batch import Batch
+from lib.oslinux import OSLinux
+
+
+class FakeLog():
+
+    def __init__(self):
+        self.processes = []
+
+    def add_process(self, process, path, arguments, stdout, stderr, pid,
+                    time_offset, time_rate):
+        self.processes.append((arguments[1], stdout, stderr, pid))
+
+
+class HostVbox():
+    """Runs the processes of the guest on the host"""
+
+    username = "default"
+    offset = 0
+    speedup = 100
+
+    def __init__(self):
+        self.log = FakeLog()
+        self.scripts = 0
+
+    def run_process(self, command, arguments=[], environment=[], log=True,
+                    **kwargs):
+        self.scripts += 1
+        proc = subprocess.Popen([command] + arguments, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        return proc.pid, stdout.decode("utf-8"), stderr.decode("utf-8")
+
+
+@unittest.skipIf(not os.path.exists("/bin/bash"), "bash is not installed")
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vbox = HostVbox()
+        self.os = OSLinux(self.vbox)
+
+
+    def test_split(self):
+        with self.os.batch() as b:
+            self.os.run_shell_cmd("echo one; echo two")
+            self.os.run_shell_cmd("printf partial")
+            self.os.run_shell_cmd("echo error >&2; exit 3")
+            self.os.run_shell_cmd("true")
+        self.assertEqual(self.vbox.scripts, 1)
+        self.assertEqual([x[1:] for x in b.results],
+                         [("one\ntwo\n", "", 0), ("partial", "", 0),
+                          ("", "error\n", 3), ("", "", 0)])
+        self.assertEqual([x[0] for x in self.vbox.log.processes],
+                         b.operations)
+        self.assertEqual(set(x[3] for x in self.vbox.log.processes),
+                         set([None]))
+
+
+    def test_chunks(self):
+        batch = Batch(self.os)
+        self.assertEqual(batch.chunks(["a" * 40, "b" * 40, "c" * 40], 100),
+                         [[0, 1], [2]])
+        self.assertEqual(batch.chunks(["a" * 200, "b"], 100), [[0], [1]])
+
+        big = "x" * 40000
+        with self.os.batch() as b:
+            for i in range(3):
+                self.os.run_shell_cmd("echo %d %s" % (i, big))
+        self.assertEqual(self.vbox.scripts, 2)
+        self.assertEqual([x[1] for x in b.results],
+                         ["%d %s\n" % (i, big) for i in range(3)])
+
+
+    def test_unfinished(self):
+        batch = Batch(self.os)
+        batch.add("a")
+        batch.add("b")
+        marker = batch.marker
+        stdout = "%s begin 0\nout\n\n%s end 0 0\n%s begin 1\nhalf" % (
+            marker, marker, marker)
+        self.assertEqual(batch.split_output(stdout, ""),
+                         [("a", "out\n", "", 0), ("b", "half", "", None)])
+
+
+    def test_nested_and_errors(self):
+        def nested():
+            with self.os.batch():
+                with self.os.batch():
+                    pass
+        self.assertRaises(RuntimeError, nested)
+        self.assertIsNone(self.os._batch)
+
+        try:
+            with self.os.batch():
+                self.os.run_shell_cmd("echo never")
+                raise KeyError("abort")
+        except KeyError:
+            pass
+        self.assertEqual(self.vbox.scripts, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Tests of the block digests of images, exported from synthetic VDI images,
+# without VirtualBox, run with
+#   python -m unittest test_blockhash
+#
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import blockhash, rawexport, vdi
+import vdifile
+
+BLOCK = 1024
+
+
+class BlockHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data = os.urandom(10 * BLOCK + 100)
+        self.image = os.path.join(self.tmp, "disk.img")
+        with open(self.image, "wb") as f:
+            f.write(self.data)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_pieces(self):
+        hasher = blockhash.BlockHasher(("md5", "sha1"), BLOCK)
+        for start, end in ((0, 7), (7, 3000), (3000, 3072),
+                           (3072, len(self.data))):
+            hasher.update(self.data[start:end])
+        hashes = hasher.finish()
+        self.assertEqual(hashes.size, len(self.data))
+        self.assertEqual(hashes.digests["sha1"],
+                         hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(hashes.blocks, [
+            hashlib.sha256(self.data[x:x + BLOCK]).hexdigest()
+            for x in range(0, len(self.data), BLOCK)])
+        self.assertEqual(blockhash.hash_image(self.image, ("md5", "sha1"),
+                                              BLOCK).blocks, hashes.blocks)
+
+
+    def test_sidecar_and_verify(self):
+        sidecar = self.image + blockhash.SIDECAR_SUFFIX
+        hashes = blockhash.hash_image(self.image, block_size=BLOCK,
+                                      sidecar=sidecar)
+        read = blockhash.BlockHashes.read(sidecar)
+        self.assertEqual(read.__dict__, hashes.__dict__)
+        self.assertEqual(blockhash.verify(self.image), [])
+
+        with open(self.image, "r+b") as f:
+            f.seek(3 * BLOCK + 5)
+            f.write(b"x")
+        self.assertEqual(blockhash.verify(self.image), [3])
+        self.assertEqual(blockhash.verify(self.image, sidecar, [2, 3, 20]),
+                         [3, 20])
+
+
+    def test_changed_blocks(self):
+        first = blockhash.BlockHashes(0, BLOCK, "sha256", ["a", "b", "c"], {})
+        second = blockhash.BlockHashes(0, BLOCK, "sha256", ["a", "x"], {})
+        self.assertEqual(first.changed_blocks(second), [1, 2])
+        self.assertEqual(second.changed_blocks(first), [1, 2])
+        other = blockhash.BlockHashes(0, BLOCK, "md5", ["a"], {})
+        self.assertRaises(ValueError, first.changed_blocks, other)
+
+
+    def test_exported_clone(self):
+        base = os.path.join(self.tmp, "base.vdi")
+        clone = os.path.join(self.tmp, "clone.vdi")
+        parent = vdifile.write_vdi(base, 16, BLOCK,
+                                   dict((i, os.urandom(BLOCK))
+                                        for i in range(12)))
+        vdifile.write_vdi(clone, 16, BLOCK, {5: b"five", 14: b"new"},
+                          parent=parent)
+        hashes = []
+        for paths in ([base], [clone, base]):
+            with vdi.VdiChain(paths) as chain:
+                raw = paths[0] + ".img"
+                export = rawexport.RawExport(
+                    chain, raw, sidecar=raw + blockhash.SIDECAR_SUFFIX,
+                    block_size=4 * BLOCK).start()
+                export.wait_for_completion()
+                hashes.append(export.block_hashes)
+                self.assertEqual(blockhash.verify(raw), [])
+        # digests of 4 VDI blocks each
+        self.assertEqual(hashes[0].changed_blocks(hashes[1]), [1, 3])
+        self.assertEqual(blockhash.verify(base + ".img",
+                                          clone + ".img.blockhashes"), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
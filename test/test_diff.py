@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Finds the changed files of a synthetic linked clone, without VirtualBox,
+# run with
+#   python -m unittest test_diff
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lxml import etree
+
+from lib import diff
+import vdifile
+
+BLOCK = 4096
+
+DFXML = """<?xml version="1.0"?>
+<dfxml xmlns="%s" version="1.0">
+  <volume>
+    <fileobject>
+      <filename>boot.bin</filename>
+      <inode>2</inode>
+      <filesize>512</filesize>
+      <meta_type>1</meta_type>
+      <byte_runs><byte_run img_offset="0" len="512" file_offset="0"/>
+      </byte_runs>
+    </fileobject>
+    <fileobject>
+      <filename>home/a.txt</filename>
+      <inode>12</inode>
+      <filesize>1024</filesize>
+      <meta_type>1</meta_type>
+      <byte_runs><byte_run img_offset="4608" len="1024" file_offset="0"/>
+      </byte_runs>
+    </fileobject>
+    <fileobject>
+      <filename>home</filename>
+      <meta_type>2</meta_type>
+    </fileobject>
+  </volume>
+</dfxml>
+""" % diff.DFXML_NS
+
+
+class DiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.base = os.path.join(self.tmp, "base.vdi")
+        self.clone = os.path.join(self.tmp, "clone.vdi")
+        self.dfxml = os.path.join(self.tmp, "base.dfxml")
+        first = b"\1" * BLOCK
+        parent = vdifile.write_vdi(self.base, 4, BLOCK,
+                                   {0: b"boot", 1: first})
+        # the clone rewrote block 1, but changed only its second sector, and
+        # wrote block 3, which is empty in the base
+        changed = first[:512] + b"\2" * 512 + first[1024:]
+        vdifile.write_vdi(self.clone, 4, BLOCK, {1: changed, 3: b"new"},
+                          parent=parent)
+        with open(self.dfxml, "w") as f:
+            f.write(DFXML)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_changed_runs(self):
+        with diff.VdiImage(self.clone) as image:
+            self.assertEqual(diff.changed_runs(image),
+                             [(BLOCK, BLOCK), (3 * BLOCK, BLOCK)])
+            with diff.VdiImage(self.base) as base:
+                self.assertEqual(diff.changed_runs(image, base),
+                                 [(BLOCK + 512, 512), (3 * BLOCK, 512)])
+
+
+    def test_report(self):
+        report = diff.diff_image(self.clone, diff.DfxmlReader(self.dfxml),
+                                 os.path.join(self.tmp, "diff.xml"),
+                                 [self.base])
+        self.assertEqual(report.changed_bytes(), 1024)
+        modified = report.modified_files()
+        self.assertEqual([x[0].filename for x in modified], ["home/a.txt"])
+        self.assertEqual(modified[0][1], [(BLOCK + 512, 512, 0)])
+        self.assertEqual(report.unattributed, [(3 * BLOCK, 512)])
+
+        tree = etree.parse(os.path.join(self.tmp, "diff.xml"))
+        ns = {"d": diff.DFXML_NS}
+        self.assertEqual(tree.xpath("//d:fileobject/d:filename/text()",
+                                    namespaces=ns), ["home/a.txt"])
+        self.assertEqual(tree.xpath("//d:fileobject/@delta:modified_file",
+                                    namespaces={"d": diff.DFXML_NS,
+                                                "delta": diff.DELTA_NS}),
+                         ["1"])
+
+
+    def test_without_base(self):
+        report = diff.diff_image(self.clone, diff.get_reader("dfxml",
+                                                             self.dfxml))
+        modified = report.modified_files()
+        self.assertEqual(modified[0][1], [(BLOCK + 512, 1024, 0)])
+        self.assertEqual(report.unattributed,
+                         [(BLOCK, 512), (BLOCK + 1536, BLOCK - 1536),
+                          (3 * BLOCK, BLOCK)])
+        self.assertRaises(ValueError, diff.get_reader, "missing", self.dfxml)
+
+
+    def test_overlapping_runs(self):
+        big = diff.FileObject("big", byte_runs=[(0, 10000, 0)])
+        small = diff.FileObject("small", byte_runs=[(2000, 100, 0)])
+        late = diff.FileObject("late", byte_runs=[(9000, 50, 7)])
+        index = diff.RunIndex([small, big, late])
+        found = sorted((x[0].filename,) + x[1:]
+                       for x in index.overlapping(8990, 20))
+        self.assertEqual(found, [("big", 8990, 20, 8990),
+                                 ("late", 9000, 10, 7)])
+        self.assertEqual(list(index.overlapping(10000, 100)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Exports logs to npz and reads them back, needs numpy but no VirtualBox, run
+# with
+#   python -m unittest test_exporters
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from lib import exporters, logger, timeline
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class NumpyExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def export(self, name, pids):
+        log = logger.Logger()
+        log.add_time_rate(100, 0, anchor=True)
+        for pid in pids:
+            log.add_process(None, "/bin/bash", ["-c", "true"], pid=pid)
+        log.add_mouse(1, 2, True, False, None)
+        path = os.path.join(self.tmp, name + ".npz")
+        log.export(path)
+        return path
+
+
+    def test_types_from_columns(self):
+        tables = exporters.get_exporter("npz").load(
+            self.export("mixed", [7, None]))
+        process = tables["LogProcess"]
+        self.assertEqual(process.dtype["pid"], numpy.dtype("i8"))
+        self.assertEqual(list(process["pid"]), [7, -1])
+        self.assertEqual(process.dtype["real_time"], numpy.dtype("f8"))
+        mouse = tables["LogMouse"]
+        self.assertEqual(mouse.dtype["x"], numpy.dtype("i8"))
+        self.assertEqual(list(mouse[["lmb", "mmb", "rmb"]][0]),
+                         [True, False, False])
+        self.assertEqual(tables["LogTimeRate"].dtype["anchor"],
+                         numpy.dtype("?"))
+
+
+    def test_runs_share_fields(self):
+        """a run with only batched operations stacks with the others"""
+        paths = [self.export("one", [7]), self.export("two", [None, None])]
+        tables = exporters.load_runs(paths)
+        process = tables["LogProcess"]
+        self.assertEqual(process.dtype["pid"], numpy.dtype("i8"))
+        self.assertEqual(list(process["pid"]), [7, -1, -1])
+        self.assertEqual(list(process["run"]), [0, 1, 1])
+        self.assertEqual(len(timeline.Timeline.from_tables(tables)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Tests of the streaming hashes and the file store, without VirtualBox, run
+# with
+#   python -m unittest test_filestore
+#
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import filestore, logger
+
+
+class FileStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data = os.urandom(3000) * 7
+        self.source = self.write("a.bin", self.data)
+        self.store = filestore.FileStore(os.path.join(self.tmp, "store"))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+
+    def stored(self):
+        return [x for x in os.listdir(self.store.root)
+                if x.endswith(".forensig20")]
+
+
+    def test_hash_file(self):
+        copy = os.path.join(self.tmp, "copy.bin")
+        size, digests = filestore.hash_file(self.source, ["md5", "sha1"],
+                                            chunk_size=1000,
+                                            destination=copy)
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(digests["md5"], hashlib.md5(self.data).hexdigest())
+        self.assertEqual(digests["sha1"], hashlib.sha1(self.data).hexdigest())
+        with open(copy, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+
+    def test_deduplication(self):
+        other = self.write("b.bin", self.data)
+        key, size, digests = self.store.add(self.source)
+        self.assertEqual(self.store.add(other)[0], key)
+        self.assertEqual(key, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(self.store.references(key), 2)
+        self.assertEqual(len(self.stored()), 1)
+
+        self.assertFalse(self.store.release(key))
+        self.assertTrue(os.path.exists(self.store.path(key)))
+        self.assertTrue(self.store.release(key))
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(self.store.refs, {})
+
+
+    def test_unchanged_source_is_not_read(self):
+        key = self.store.add(self.source)[0]
+        read = []
+        hash_file = filestore.hash_file
+
+        def counting(path, *args, **kwargs):
+            read.append(path)
+            return hash_file(path, *args, **kwargs)
+
+        filestore.hash_file = counting
+        try:
+            self.assertEqual(self.store.add(self.source)[0], key)
+            self.assertEqual(read, [])
+            digests = self.store.add(self.source, ["sha1"])[2]
+        finally:
+            filestore.hash_file = hash_file
+        # digests missing so far are taken from the stored copy
+        self.assertEqual(read, [self.store.path(key)])
+        self.assertEqual(digests["sha1"], hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(self.store.references(key), 3)
+
+
+    def test_concurrent_adds(self):
+        sources = [self.write("%d.bin" % i, self.data) for i in range(8)]
+        threads = [threading.Thread(target=self.store.add, args=(x,))
+                   for x in sources]
+        for each in threads:
+            each.start()
+        for each in threads:
+            each.join()
+        key = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(self.store.references(key), 8)
+        self.assertEqual(os.listdir(self.store.root), [key + ".forensig20"])
+
+
+    def test_logged_copies(self):
+        log = logger.Logger(self.store)
+        log.add_file(self.source, "/tmp/a.bin", extra_hashes=["sha1"])
+        log.add_file(self.source, "/tmp/b.bin")
+        first, second = log.log
+        self.assertEqual(first.tmp, second.tmp)
+        self.assertEqual(first.sha1sum, hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(first.calc_md5sum(), first.md5sum)
+        self.assertEqual(first.get_file_size(), len(self.data))
+        # the copy is only released, nothing is left to delete for the log
+        self.assertEqual(first.cleanup(), False)
+        self.assertEqual(len(self.stored()), 1)
+        second.cleanup()
+        self.assertEqual(self.stored(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
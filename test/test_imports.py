@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Checks, that the library imports with the running interpreter, run with
+#   python -m unittest test_imports
+#
+
+import importlib
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+try:
+    import virtualbox
+except ImportError:
+    virtualbox = None
+
+LIB_MODULES = ["logger", "oslinux", "oswindows", "param", "readiness",
+               "scenario", "batch", "sessionpool", "filestore", "isocache",
+               "exporters", "analysis", "timeline", "vdi", "diff",
+               "rawexport", "blockhash", "archive"]
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_lib_package(self):
+        """the modules of lib as a package, without the VirtualBox API"""
+        sys.path.insert(0, os.path.join(ROOT, 'forgeosi'))
+        try:
+            for name in LIB_MODULES:
+                importlib.import_module("lib." + name)
+        finally:
+            sys.path.remove(os.path.join(ROOT, 'forgeosi'))
+
+
+    def test_without_numpy(self):
+        """numpy is optional, only its users fail, with a clear error"""
+        script = "\n".join([
+            "import sys",
+            "sys.modules['numpy'] = None",
+            "sys.path.insert(0, %r)" % os.path.join(ROOT, 'forgeosi'),
+            "from lib import " + ", ".join(LIB_MODULES),
+            "try:",
+            "    timeline.Timeline([], [], [], [], [])",
+            "except ImportError as e:",
+            "    print(e)"])
+        output = subprocess.check_output([sys.executable, "-c", script])
+        self.assertIn(b"forgeosi[numpy]", output)
+
+
+    @unittest.skipIf(virtualbox is None, "pyvbox is not installed")
+    def test_forgeosi(self):
+        import forgeosi
+        self.assertTrue(hasattr(forgeosi, "Vbox"))
+
+
+    @unittest.skipIf(virtualbox is None or sys.version_info < (3, 5),
+                     "pyvbox is not installed or Python is too old")
+    def test_asyncvbox(self):
+        from forgeosi.lib import asyncvbox
+        self.assertTrue(hasattr(asyncvbox, "AsyncVbox"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Tests of the cache of CD images, the images are only built, if mkisofs,
+# genisoimage or pycdlib is installed, run with
+#   python -m unittest test_isocache
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import isocache
+
+
+class IsoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.folder = os.path.join(self.tmp, "cd")
+        os.makedirs(os.path.join(self.folder, "sub"))
+        self.write("a.txt", b"a")
+        self.write("sub/b.txt", b"b")
+        self.cache = isocache.IsoCache(os.path.join(self.tmp, "iso"))
+        self.builds = []
+        self.build_iso = isocache.build_iso
+        isocache.build_iso = self.fake_build
+
+
+    def tearDown(self):
+        isocache.build_iso = self.build_iso
+        shutil.rmtree(self.tmp)
+
+
+    def write(self, name, data):
+        with open(os.path.join(self.folder, name), "wb") as f:
+            f.write(data)
+
+
+    def fake_build(self, folder, iso_path, cdlabel):
+        self.builds.append(cdlabel)
+        with open(iso_path, "wb") as f:
+            f.write(cdlabel.encode("ascii"))
+        time.sleep(0.05)
+
+
+    def test_manifest(self):
+        manifest = isocache.folder_manifest(self.folder)
+        self.assertEqual([x[0] for x in manifest],
+                         ["a.txt", "sub", os.path.join("sub", "b.txt")])
+        self.assertEqual(manifest[1][1:], (None, None))
+
+        copy = os.path.join(self.tmp, "copy")
+        shutil.copytree(self.folder, copy)
+        # folders are equal by their content, only if it is hashed
+        self.assertNotEqual(isocache.manifest_hash(self.folder, "CD"),
+                            isocache.manifest_hash(copy, "CD"))
+        self.assertEqual(isocache.manifest_hash(self.folder, "CD", True),
+                         isocache.manifest_hash(copy, "CD", True))
+        self.assertNotEqual(isocache.manifest_hash(self.folder, "CD", True),
+                            isocache.manifest_hash(self.folder, "DVD", True))
+
+
+    def test_reuse_and_rebuild(self):
+        first = self.cache.get(self.folder, "CD")
+        self.assertEqual(self.cache.get(self.folder, "CD"), first)
+        self.assertEqual(self.builds, ["CD"])
+        self.write("a.txt", b"changed")
+        second = self.cache.get(self.folder, "CD")
+        self.assertNotEqual(second, first)
+        self.assertEqual(len(self.builds), 2)
+        self.assertEqual(os.listdir(self.cache.root).count(
+            os.path.basename(first)), 1)
+
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.cache.root), [])
+
+
+    def test_concurrent_get(self):
+        paths = []
+        threads = [threading.Thread(target=lambda: paths.append(
+            self.cache.get(self.folder))) for _ in range(6)]
+        for each in threads:
+            each.start()
+        for each in threads:
+            each.join()
+        self.assertEqual(len(self.builds), 1)
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(len(paths), 6)
+
+
+    def test_failed_build(self):
+        def broken(folder, iso_path, cdlabel):
+            with open(iso_path, "wb") as f:
+                f.write(b"half")
+            raise OSError("disk full")
+        isocache.build_iso = broken
+        self.assertRaises(OSError, self.cache.get, self.folder)
+        self.assertEqual(os.listdir(self.cache.root), [])
+
+
+    @unittest.skipIf(not (isocache.which("mkisofs") or
+                          isocache.which("genisoimage") or
+                          isocache.pycdlib), "no tool to build images")
+    def test_build(self):
+        isocache.build_iso = self.build_iso
+        path = self.cache.get(self.folder, "CD")
+        with open(path, "rb") as f:
+            f.seek(0x8001)
+            self.assertEqual(f.read(5), b"CD001")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Tests of the logger, without VirtualBox, run with
+#   python -m unittest test_logger
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import logger
+
+
+TERMINAL_OUTPUT = u"\x1b[1;32mok\x1b[0m\x00 wörld\x07"
+
+
+class LoggerXmlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = logger.Logger()
+
+
+    def tearDown(self):
+        self.log.close_stream()
+        shutil.rmtree(self.tmp)
+
+
+    def test_control_characters(self):
+        stream = os.path.join(self.tmp, "stream.xml")
+        self.log.stream_xml_log(stream)
+        self.log.add_process(None, "/bin/ls", ["--color"],
+                             stdout=TERMINAL_OUTPUT,
+                             stderr=TERMINAL_OUTPUT.encode("utf-8"), pid=7)
+        self.log.add_warning(u"bell \x07")
+        self.log.close_stream()
+
+        path = os.path.join(self.tmp, "log.xml")
+        self.log.write_xml_log(path)
+        for each in (stream, path):
+            root = logger.read_xml_log(each)
+            process = root.find("process")
+            self.assertEqual(process.find("stdout").text,
+                             u"\\x1b[1;32mok\\x1b[0m\\x00 wörld\\x07")
+            self.assertEqual(process.find("stderr").text,
+                             process.find("stdout").text)
+        self.assertIn(b"bell \\x07", self.log.get_xml_log())
+        self.assertEqual(len(self.log.log), 2)
+
+
+    def test_plain_text_unchanged(self):
+        self.assertEqual(logger._xml_text(u"a\tb\nc\r"), u"a\tb\nc\r")
+        self.assertEqual(logger._xml_text(12), u"12")
+        self.assertEqual(logger._xml_text(u"\ud800"), u"\\ud800")
+
+
+if __name__ == '__main__':
+    unittest.main()
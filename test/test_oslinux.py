@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Types into a fake guest, without VirtualBox, run with
+#   python -m unittest test_oslinux
+#
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib.oslinux import OSLinux
+
+
+class FakeVbox():
+    """Records processes, sudo asks for a password on the third probe"""
+
+    username = "default"
+    password = "12345"
+
+    def __init__(self):
+        self.calls = []
+        self.probes = 0
+
+    def run_process(self, command, arguments=[], environment=[], wait=True,
+                    log=True, **kwargs):
+        if command == "/usr/bin/pgrep":
+            self.probes += 1
+            return 1, "123\n" if self.probes >= 3 else "", ""
+        self.calls.append((command, arguments, log))
+        return 42, "", ""
+
+    def _wait_for_input_window(self, pid, timeout):
+        self.calls.append(("window", pid))
+
+
+class SleepHackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vbox = FakeVbox()
+        self.os = OSLinux(self.vbox)
+
+
+    def test_uninstall_waits_for_sudo(self):
+        start = time.time()
+        self.os.uninstall_program("nano")
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.vbox.probes, 3)
+        typed = [x[1][-1] for x in self.vbox.calls
+                 if x[0] == self.os.xdt]
+        self.assertEqual(typed, ["sudo apt-get remove nano\n", "12345\n",
+                                 "\n", "  exit\n"])
+        self.assertEqual(self.vbox.calls[0][0], self.os.term)
+        self.assertEqual(self.vbox.calls[1], ("window", 42))
+
+
+    def test_condition_per_sleep_hack(self):
+        seen = []
+        self.os.keyboard_input("a\nsleep_hack\nb\nsleep_hack\nc\n",
+                               sleep_time=0.1,
+                               until=[lambda: seen.append(1) or True, None])
+        self.assertEqual(seen, [1])
+
+
+    def test_timeout_continues(self):
+        start = time.time()
+        self.os._sleep_hack(0.2, lambda: False)
+        self.assertLess(time.time() - start, 5)
+
+
+    def test_errors_are_raised(self):
+        def broken():
+            raise IOError("guest gone")
+        self.assertRaises(IOError, self.os._sleep_hack, 10, broken)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Exports synthetic VDI images to RAW images, without VirtualBox, run with
+#   python -m unittest test_rawexport
+#
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import blockhash, rawexport, vdi
+import vdifile
+
+BLOCK = 512
+BLOCKS = 50
+
+
+class Broken():
+    """A chain, which fails to read one block"""
+
+    def __init__(self, chain, block):
+        self.chain = chain
+        self.block = block
+        self.disk_size = chain.disk_size
+        self.block_size = chain.block_size
+        self.closed = 0
+
+    def allocated_blocks(self):
+        return self.chain.allocated_blocks()
+
+    def read_block(self, block):
+        if block == self.block:
+            raise IOError("bad sector")
+        return self.chain.read_block(block)
+
+    def close(self):
+        self.closed += 1
+
+
+class RawExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.base = os.path.join(self.tmp, "base.vdi")
+        self.clone = os.path.join(self.tmp, "clone.vdi")
+        self.raw = os.path.join(self.tmp, "disk.img")
+        # more blocks than one batch, one stored block only holds zeros
+        data = dict((i, os.urandom(BLOCK)) for i in range(0, BLOCKS, 2))
+        data[10] = b""
+        parent = vdifile.write_vdi(self.base, BLOCKS, BLOCK, data)
+        vdifile.write_vdi(self.clone, BLOCKS, BLOCK,
+                          {3: b"three", 4: b"four"}, parent=parent)
+        self.chain = vdi.VdiChain([self.clone, self.base])
+
+
+    def tearDown(self):
+        self.chain.close()
+        shutil.rmtree(self.tmp)
+
+
+    def expected(self):
+        return self.chain.raw().read()
+
+
+    def test_export(self):
+        export = rawexport.RawExport(self.chain, self.raw, workers=3)
+        self.assertEqual(export.percent, 0)
+        self.assertIs(export.start(), export)
+        self.assertTrue(export.wait_for_completion())
+        self.assertEqual(export.percent, 100)
+        self.assertEqual(export.blocks, BLOCKS // 2 + 1)
+        # the zero block is not written
+        self.assertEqual(export.bytes_written, (BLOCKS // 2) * BLOCK)
+        self.assertIsNone(export.block_hashes)
+        with open(self.raw, "rb") as f:
+            self.assertEqual(f.read(), self.expected())
+
+
+    def test_hashes(self):
+        sidecar = self.raw + blockhash.SIDECAR_SUFFIX
+        export = rawexport.RawExport(self.chain, self.raw, hashes=("md5",),
+                                     sidecar=sidecar,
+                                     block_size=10 * BLOCK).start()
+        export.wait_for_completion()
+        expected = self.expected()
+        self.assertEqual(export.digests,
+                         {"md5": hashlib.md5(expected).hexdigest()})
+        self.assertEqual(len(export.block_hashes.blocks), BLOCKS // 10)
+        self.assertEqual(blockhash.verify(self.raw), [])
+
+
+    def test_error(self):
+        broken = Broken(self.chain, 20)
+        export = rawexport.RawExport(broken, self.raw, workers=2,
+                                     close_image=True).start()
+        self.assertRaises(IOError, export.wait_for_completion)
+        self.assertTrue(export.completed)
+        self.assertLess(export.percent, 100)
+        self.assertEqual(broken.closed, 1)
+
+
+    def test_empty(self):
+        empty = os.path.join(self.tmp, "empty.vdi")
+        vdifile.write_vdi(empty, 8, BLOCK, {})
+        image = vdi.VdiImage(empty)
+        export = rawexport.RawExport(image, self.raw, close_image=True)
+        export.start().wait_for_completion(5000)
+        self.assertEqual(export.percent, 100)
+        self.assertEqual(os.path.getsize(self.raw), 8 * BLOCK)
+        self.assertEqual(export.bytes_written, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
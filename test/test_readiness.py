@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Runs the readiness engine against FakeEventSource, without VirtualBox, run
+# with
+#   python -m unittest test_readiness
+#
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+# appended, so forgeosi/forgeosi.py does not hide the package of the same name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib.param import BootTarget
+from lib.readiness import FakeEventSource, ReadinessTimeout, ReadinessWaiter
+
+
+class FakeMachine():
+    """Boots through the BootTarget stages, one stage per step()"""
+
+    def __init__(self, events):
+        self.events = events
+        self.stage = 0
+        self.checked = set()
+
+    def checks(self):
+        def check(target):
+            def reached():
+                self.checked.add(target)
+                return self.stage >= target.value
+            return reached
+        return dict((x, check(x)) for x in BootTarget)
+
+    def step(self):
+        self.stage += 1
+        self.events.fire()
+
+    def boot(self, delay=0.01):
+        """boots in the background, firing an event for every stage"""
+        def run():
+            for _ in BootTarget:
+                time.sleep(delay)
+                self.step()
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class ReadinessWaiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = FakeEventSource()
+        self.machine = FakeMachine(self.events)
+        # events, not polling, need to wake up the waiter
+        self.waiter = ReadinessWaiter(self.events, self.machine.checks(),
+                                      poll_interval=30)
+
+
+    def test_each_target(self):
+        for target in BootTarget:
+            self.setUp()
+            thread = self.machine.boot()
+            start = time.time()
+            timings = self.waiter.wait(target, timeout=10)
+            self.assertLess(time.time() - start, 5)
+            self.assertEqual(sorted(timings),
+                             sorted(x.name for x in BootTarget
+                                    if x.value <= target.value))
+            self.assertGreaterEqual(self.machine.stage, target.value)
+            # later stages are not checked
+            self.assertFalse([x for x in self.machine.checked
+                              if x.value > target.value])
+            thread.join()
+
+
+    def test_already_reached(self):
+        self.machine.stage = BootTarget.session.value
+        timings = self.waiter.wait(BootTarget.session, timeout=0)
+        self.assertEqual(len(timings), len(BootTarget))
+
+
+    def test_timeout(self):
+        self.waiter.poll_interval = 0.05
+        self.machine.step()
+        start = time.time()
+        self.assertRaises(ReadinessTimeout, self.waiter.wait,
+                          BootTarget.desktop, 0.3)
+        self.assertLess(time.time() - start, 5)
+
+
+    def test_wait_for(self):
+        flag = []
+        timer = threading.Timer(0.05, lambda: (flag.append(1),
+                                               self.events.fire()))
+        timer.start()
+        self.waiter.wait_for(lambda: flag, timeout=10)
+        self.assertRaises(ReadinessTimeout, ReadinessWaiter(
+            FakeEventSource(), poll_interval=0.05).wait_for, lambda: False,
+            0.2)
+
+
+    def test_wrong_target(self):
+        self.assertRaises(TypeError, self.waiter.wait, "session")
+
+
+    def test_default_checks(self):
+        a = ReadinessWaiter(FakeEventSource())
+        b = ReadinessWaiter(FakeEventSource())
+        a.checks[BootTarget.launched] = lambda: True
+        self.assertEqual(b.checks, {})
+
+
+    def test_close(self):
+        self.waiter.close()
+        self.assertTrue(self.events.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
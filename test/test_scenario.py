@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Runs scenarios on fake machines, without VirtualBox, run with
+#   python -m unittest test_scenario
+#
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib.param import SessionType
+from lib.scenario import Ref, Scenario
+
+
+class FakeLog():
+
+    def __init__(self):
+        self.warnings = []
+
+    def add_warning(self, warning):
+        self.warnings.append(warning)
+
+
+class FakeVbox():
+    """Records, when its methods run, and fails, if two overlap"""
+
+    def __init__(self, name):
+        self.name = name
+        self.log = FakeLog()
+        self.calls = []
+        self.busy = threading.Lock()
+
+    def work(self, result=None, delay=0.1):
+        if not self.busy.acquire(False):
+            raise RuntimeError("steps on %s overlap" % self.name)
+        try:
+            self.calls.append(result)
+            time.sleep(delay)
+            return result
+        finally:
+            self.busy.release()
+
+    def fail(self):
+        raise IOError("guest gone")
+
+
+class ScenarioTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeVbox("server")
+        self.client = FakeVbox("client")
+        self.scenario = Scenario({"server": self.server,
+                                  "client": self.client})
+
+
+    def test_dag(self):
+        sc = self.scenario
+        sc.step("boot_s", "server", "work", args=["s"])
+        sc.step("boot_c", "client", "work", args=["c"])
+        sc.step("ip", "server", "work", args=["10.0.0.1"], after=["boot_s"])
+        sc.step("browse", "client", "work",
+                args=[Ref("ip", "http://{0}:8080")], after=["boot_c"])
+        sc.step("host", None, lambda vbox, x: x.upper(),
+                args=[Ref("browse")])
+
+        order = sc.order()
+        for step, dep in (("ip", "boot_s"), ("browse", "ip"),
+                          ("browse", "boot_c"), ("host", "browse")):
+            self.assertLess(order.index(dep), order.index(step))
+
+        results = sc.run()
+        # both machines boot at the same time
+        boot_s, boot_c = sc.timings["boot_s"], sc.timings["boot_c"]
+        self.assertLess(boot_s[0], boot_c[1])
+        self.assertLess(boot_c[0], boot_s[1])
+        self.assertEqual(results["browse"], "http://10.0.0.1:8080")
+        self.assertEqual(results["host"], "HTTP://10.0.0.1:8080")
+        self.assertEqual(self.server.calls, ["s", "10.0.0.1"])
+        self.assertEqual(sc.critical_path(), ["boot_s", "ip", "browse",
+                                              "host"])
+
+
+    def test_same_vm_never_overlaps(self):
+        for i in range(4):
+            self.scenario.step("w%d" % i, "server", "work", args=[i],
+                               kwargs={"delay": 0.02})
+        self.assertEqual(sorted(self.scenario.run().values()), [0, 1, 2, 3])
+
+
+    def test_cycle(self):
+        sc = self.scenario
+        sc.step("a", "server", "work", after=["c"])
+        sc.step("b", "server", "work", after=["a"])
+        sc.step("c", "client", "work", args=[Ref("b")])
+        self.assertRaises(ValueError, sc.order)
+        self.assertRaises(ValueError, sc.run)
+        self.assertEqual(self.server.calls, [])
+
+
+    def test_unknown_names(self):
+        self.scenario.step("a", "server", "work", after=["missing"])
+        self.assertRaises(ValueError, self.scenario.order)
+        other = Scenario()
+        other.step("a", "nowhere", "work")
+        self.assertRaises(ValueError, other.order)
+        self.assertRaises(ValueError, self.scenario.step, "a", None, "work")
+
+
+    def test_failure(self):
+        sc = self.scenario
+        sc.step("boot", "server", "work")
+        sc.step("broken", "server", "fail", after=["boot"])
+        sc.step("never", "client", "work", args=["late"], after=["broken"])
+        try:
+            sc.run()
+            self.fail("the step did not fail")
+        except IOError as e:
+            self.assertEqual(e.step, "broken")
+        self.assertEqual(self.client.calls, [])
+        self.assertEqual(len(self.server.log.warnings), 1)
+
+
+    def test_from_dict(self):
+        sc = Scenario.from_dict({"steps": [
+            {"name": "boot", "vm": "server", "action": "work",
+             "args": ["SessionType.gui"]},
+            {"name": "echo", "vm": "client", "action": "work",
+             "kwargs": {"result": {"ref": "boot", "format": "<{0}>"},
+                        "delay": 0}}]},
+            {"server": self.server, "client": self.client})
+        self.assertEqual(sc.steps["echo"].after, ["boot"])
+        results = sc.run()
+        self.assertIs(results["boot"], SessionType.gui)
+        self.assertEqual(results["echo"], "<SessionType.gui>")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Streams the output of a fake guest process, needs pyvbox for its enums but
+# no virtual machine, run with
+#   python -m unittest test_stream
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+try:
+    import virtualbox
+except ImportError:
+    virtualbox = None
+
+
+class FakeProcess():
+    """Returns prepared chunks of output, then terminates"""
+
+    def __init__(self, stdout, stderr, pid=42):
+        self.chunks = {1: list(stdout), 2: list(stderr)}
+        self.pid = pid
+
+    @property
+    def status(self):
+        library = virtualbox.library
+        if self.chunks[1] or self.chunks[2]:
+            return library.ProcessStatus.started
+        return library.ProcessStatus.terminated_normally
+
+    def wait_for_array(self, flags, timeout):
+        pass
+
+    def read(self, handle, size, timeout):
+        if self.chunks[handle]:
+            return self.chunks[handle].pop(0)
+        return b""
+
+
+@unittest.skipIf(virtualbox is None, "pyvbox is not installed")
+class StreamOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        import forgeosi
+        from forgeosi.lib import logger
+        self.vbox = forgeosi.Vbox.__new__(forgeosi.Vbox)
+        self.vbox.log = logger.Logger()
+        self.vbox.offset = 0
+        self.vbox.speedup = 100
+        self.tmp = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_spool(self):
+        spool = os.path.join(self.tmp, "out")
+        process = FakeProcess([b"hello ", u"wörld\n".encode("utf-8")],
+                              [b"error\n"])
+        chunks = list(self.vbox._stream_output(process, "/bin/prog", [],
+                                               spool=spool))
+        self.assertEqual(len(chunks), 3)
+        with open(spool, "rb") as f:
+            self.assertEqual(f.read(), u"hello wörld\n".encode("utf-8"))
+        with open(spool + ".stderr", "rb") as f:
+            self.assertEqual(f.read(), b"error\n")
+        entry = self.vbox.log.get_process(42)[0]
+        self.assertEqual(entry.spool, spool)
+
+
+    def test_callback(self):
+        seen = []
+        process = FakeProcess([b"a", b"b"], [])
+        list(self.vbox._stream_output(process, "/bin/prog", [],
+                                      callback=lambda h, d: seen.append(d)))
+        self.assertEqual("".join(seen), "ab")
+        self.assertEqual(self.vbox.log.get_process(42)[0].stdout, "ab")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Copies directory trees through a fake guest session, needs pyvbox for its
+# enums but no virtual machine, run with
+#   python -m unittest test_tree
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+try:
+    import virtualbox
+except ImportError:
+    virtualbox = None
+
+
+class FakeProgress():
+
+    def __init__(self, result_code=0):
+        self.result_code = result_code
+
+    def wait_for_completion(self, timeout=-1):
+        pass
+
+
+class FakeInfo():
+
+    def __init__(self, name, type_p):
+        self.name = name
+        self.type_p = type_p
+
+
+class FakeDirectory():
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+
+    def read(self):
+        if not self.entries:
+            raise virtualbox.library.VBoxErrorObjectNotFound()
+        return self.entries.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeGuestSession():
+    """Guest file system, backed by a directory of the host"""
+
+    def __init__(self, root, native=True, fail_copy=False):
+        self.root = root
+        self.native = native
+        self.fail_copy = fail_copy
+        self.native_calls = []
+
+    def _host(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _native(self, name, flags):
+        if not self.native:
+            raise virtualbox.library.OleErrorNotimpl()
+        self.native_calls.append((name, flags))
+        # the fallback is tested on its own
+        return FakeProgress(1)
+
+    def directory_copy_to_guest(self, source, dest, flags):
+        return self._native("to_guest", flags)
+
+    def directory_copy_from_guest(self, source, dest, flags):
+        return self._native("from_guest", flags)
+
+    def directory_create(self, path, mode, flags):
+        if not os.path.isdir(self._host(path)):
+            os.makedirs(self._host(path))
+
+    def copy_to(self, source, dest, flags):
+        if self.fail_copy:
+            raise IOError("guest is full")
+        shutil.copyfile(source, self._host(dest))
+        return FakeProgress()
+
+    def copy_from(self, source, dest, flags=[]):
+        shutil.copyfile(self._host(source), dest)
+        return FakeProgress()
+
+    def directory_open(self, path, pattern, flags):
+        obj_type = virtualbox.library.FsObjType
+        regular_file = getattr(obj_type, 'file_p', None) or obj_type.file
+        entries = [FakeInfo(".", obj_type.directory),
+                   FakeInfo("..", obj_type.directory)]
+        for name in sorted(os.listdir(self._host(path))):
+            if os.path.isdir(os.path.join(self._host(path), name)):
+                entries.append(FakeInfo(name, obj_type.directory))
+            else:
+                entries.append(FakeInfo(name, regular_file))
+        return FakeDirectory(entries)
+
+
+@unittest.skipIf(virtualbox is None, "pyvbox is not installed")
+class CopyTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        import forgeosi
+        from forgeosi.lib import logger, filestore
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, "source")
+        os.makedirs(os.path.join(self.source, "sub"))
+        for name, data in (("a.txt", b"a"), ("sub/b.txt", b"b")):
+            with open(os.path.join(self.source, name), "wb") as f:
+                f.write(data)
+        self.guest = os.path.join(self.tmp, "guest")
+        os.makedirs(self.guest)
+
+        self.store = filestore.FileStore(os.path.join(self.tmp, "store"))
+        self.vbox = forgeosi.Vbox.__new__(forgeosi.Vbox)
+        self.vbox.log = logger.Logger(self.store)
+        self.vbox.offset = 0
+        self.vbox.speedup = 100
+        self.vbox.running = True
+        self.vbox.os = None
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_to_vm_native_flag(self):
+        self.vbox.guestsession = FakeGuestSession(self.guest)
+        self.vbox.copy_tree_to_vm(self.source, "/dest")
+        name, flags = self.vbox.guestsession.native_calls[0]
+        self.assertEqual(flags, [
+            virtualbox.library.DirectoryCopyFlag.copy_into_existing])
+        with open(os.path.join(self.guest, "dest", "sub", "b.txt")) as f:
+            self.assertEqual(f.read(), "b")
+        tree = self.vbox.log.get_log_object_by_type(
+            self.vbox.log.log[0].__class__)[0]
+        self.assertEqual(len(tree.files), 2)
+
+
+    def test_to_vm_failure_releases_files(self):
+        self.vbox.guestsession = FakeGuestSession(self.guest, native=False,
+                                                  fail_copy=True)
+        self.assertRaises(IOError, self.vbox.copy_tree_to_vm, self.source,
+                          "/dest")
+        self.assertEqual(self.vbox.log.log, [])
+        self.assertEqual(self.store.refs, {})
+
+
+    def test_from_vm_fallback(self):
+        self.vbox.guestsession = FakeGuestSession(self.tmp, native=False)
+        dest = os.path.join(self.tmp, "back")
+        digests = self.vbox.copy_tree_from_vm("/source", dest)
+        self.assertEqual(sorted(digests),
+                         sorted(["a.txt", os.path.join("sub", "b.txt")]))
+        with open(os.path.join(dest, "sub", "b.txt")) as f:
+            self.assertEqual(f.read(), "b")
+
+
+if __name__ == '__main__':
+    unittest.main()
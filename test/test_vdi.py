@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Reads synthetic VDI images and chains of differencing images, without
+# VirtualBox, run with
+#   python -m unittest test_vdi
+#
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import vdi
+import vdifile
+
+BLOCK = 1024
+
+
+class VdiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.base = os.path.join(self.tmp, "base.vdi")
+        self.middle = os.path.join(self.tmp, "middle.vdi")
+        os.makedirs(os.path.join(self.tmp, "Snapshots"))
+        self.clone = os.path.join(self.tmp, "Snapshots", "clone.vdi")
+        base = vdifile.write_vdi(self.base, 5, BLOCK,
+                                 {0: b"a" * BLOCK, 1: b"b", 2: b"c"})
+        middle = vdifile.write_vdi(self.middle, 5, BLOCK, {1: b"B"},
+                                   parent=base)
+        # block 2 is zeroed by the clone
+        vdifile.write_vdi(self.clone, 5, BLOCK, {4: b"E", 0: b"A"},
+                          parent=middle, zero=[2])
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+    def test_image(self):
+        with vdi.VdiImage(self.clone) as image:
+            self.assertTrue(image.is_diff)
+            self.assertEqual((image.blocks, image.block_size,
+                              image.disk_size), (5, BLOCK, 5 * BLOCK))
+            self.assertEqual(list(image.allocated_blocks()), [0, 2, 4])
+            # blocks are stored in the order they were written
+            self.assertLess(image.block_offset(0), image.block_offset(4))
+            self.assertIsNone(image.block_offset(2))
+            self.assertIsNone(image.read_block(1))
+            self.assertEqual(bytes(image.read_block(2)), b"\0" * BLOCK)
+            self.assertEqual(bytes(image.read_block(4)[:2]), b"E\0")
+        with vdi.VdiImage(self.base) as image:
+            self.assertFalse(image.is_diff)
+            self.assertEqual(bytes(image.read_block(0)), b"a" * BLOCK)
+
+
+    def test_chain(self):
+        with vdi.VdiChain.open(self.clone, [self.tmp]) as chain:
+            self.assertEqual([os.path.basename(x.path) for x in chain.images],
+                             ["clone.vdi", "middle.vdi", "base.vdi"])
+            self.assertEqual(list(chain.allocated_blocks()), [0, 1, 2, 4])
+            self.assertEqual([bytes(chain.read_block(x)[:1])
+                              for x in range(5)],
+                             [b"A", b"B", b"\0", b"\0", b"E"])
+
+
+    def test_raw(self):
+        with vdi.VdiChain([self.clone, self.middle, self.base]) as chain:
+            disk = chain.raw()
+            disk.seek(BLOCK - 2)
+            self.assertEqual(disk.read(4), b"\0\0B\0")
+            self.assertEqual(disk.tell(), BLOCK + 2)
+            disk.seek(-BLOCK, io.SEEK_END)
+            self.assertEqual(disk.read(1), b"E")
+            # reads stop at the end of the disk
+            self.assertEqual(len(disk.read(5 * BLOCK)), BLOCK - 1)
+            self.assertEqual(disk.read(1), b"")
+            self.assertRaises(ValueError, disk.seek, -1)
+            disk.seek(0)
+            whole = io.BufferedReader(disk).read()
+            self.assertEqual(len(whole), 5 * BLOCK)
+            self.assertEqual(whole[BLOCK * 2:BLOCK * 4], b"\0" * 2 * BLOCK)
+
+
+    def test_errors(self):
+        # the base is not the parent of the clone
+        self.assertRaises(vdi.VdiError, vdi.VdiChain, [self.clone, self.base])
+        self.assertRaises(vdi.VdiError, vdi.VdiChain.open, self.clone)
+        self.assertRaises(vdi.VdiError, vdi.VdiChain, [])
+
+        other = os.path.join(self.tmp, "other.vdi")
+        with vdi.VdiImage(self.middle) as middle:
+            vdifile.write_vdi(other, 6, BLOCK, {}, parent=middle.uuid_create)
+        self.assertRaises(vdi.VdiError, vdi.VdiChain, [other, self.middle])
+
+        broken = os.path.join(self.tmp, "broken.vdi")
+        with open(broken, "wb") as f:
+            f.write(b"no image")
+        self.assertRaises(vdi.VdiError, vdi.VdiImage, broken)
+        with open(self.base, "rb") as f:
+            data = bytearray(f.read())
+        data[0x40] ^= 0xff
+        with open(broken, "wb") as f:
+            f.write(bytes(data))
+        self.assertRaises(vdi.VdiError, vdi.VdiImage, broken)
+
+
+    def test_is_zero(self):
+        self.assertTrue(vdi.is_zero(b"\0" * 2048))
+        self.assertFalse(vdi.is_zero(b"\0" * 2047 + b"\1"))
+        self.assertFalse(vdi.is_zero(b"\1" + b"\0" * 2047))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Fills a WarmPool with fake machines, needs pyvbox but no virtual machine,
+# run with
+#   python -m unittest test_warmpool
+#
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+try:
+    import virtualbox
+except ImportError:
+    virtualbox = None
+
+
+class FakeVbox():
+    """Clone, which fails to boot"""
+
+    created = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.running = False
+        self.calls = []
+        FakeVbox.created.append(self)
+
+    def start(self, session_type, target):
+        self.running = True
+        self.calls.append("start")
+
+    def wait_for_boot(self, **kwargs):
+        raise RuntimeError("no guest session")
+
+    def stop(self, stop_mode):
+        self.calls.append(stop_mode.name)
+        self.running = False
+
+    def cleanup_and_delete(self):
+        self.calls.append("delete")
+
+
+class FakeSession():
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.console = self
+
+    def take_snapshot(self, name, description):
+        self.machine.calls.append("snapshot " + name)
+        return self
+
+    def wait_for_completion(self):
+        pass
+
+    def unlock_machine(self):
+        self.machine.calls.append("unlock")
+
+
+class FakeMachine():
+    """Base vm without snapshots"""
+
+    def __init__(self):
+        self.calls = []
+
+    def find_machine(self, name):
+        return self
+
+    def find_snapshot(self, name):
+        if "snapshot " + name not in self.calls:
+            raise virtualbox.library.VBoxErrorObjectNotFound()
+        return name
+
+    def create_session(self, lock_type=None):
+        self.calls.append("lock")
+        return FakeSession(self)
+
+    def discard_saved_state(self, remove_file):
+        self.calls.append("discard")
+
+
+@unittest.skipIf(virtualbox is None, "pyvbox is not installed")
+class WarmPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        import forgeosi
+        self.module = sys.modules['forgeosi.forgeosi']
+        self.machine = FakeMachine()
+        self.saved = (self.module.Vbox, virtualbox.VirtualBox)
+        self.module.Vbox = FakeVbox
+        virtualbox.VirtualBox = lambda: self.machine
+        FakeVbox.created = []
+
+
+    def tearDown(self):
+        self.module.Vbox, virtualbox.VirtualBox = self.saved
+
+
+    def test_failed_clone_is_deleted(self):
+        # the snapshot exists already
+        self.machine.calls.append("snapshot warm")
+        pool = self.module.WarmPool("base", size=1, warm_name="warm",
+                                    max_failures=1)
+        self.assertRaises(RuntimeError, pool.acquire, 10)
+        pool.close()
+        clone = [x for x in FakeVbox.created if "clonename" in x.kwargs][0]
+        self.assertEqual(clone.calls, ["start", "poweroff", "delete"])
+
+
+    def test_base_state_discarded(self):
+        pool = self.module.WarmPool.__new__(self.module.WarmPool)
+        pool.basename = "base"
+        calls = self.machine.calls
+        self.module._find_or_take_snapshot(
+            self.machine, "base", "warm",
+            prepare=lambda: calls.append("prepare"),
+            finish=pool._discard_base_state)
+        self.assertEqual(calls, ["prepare", "lock", "snapshot warm", "unlock",
+                                 "lock", "discard", "unlock"])
+
+
+if __name__ == '__main__':
+    unittest.main()
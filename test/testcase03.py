@@ -28,22 +28,12 @@ def run(vm="", output="/tmp/tc3", verbose=True, run="1"):
     """
     vboxcfg = forgeosi.VboxConfig()
     vboxcfg.get_nat_network(run)
-    vbox_c1 = forgeosi.Vbox(basename=vm1, clonename="testrun"+run+"client1")
+    pool = forgeosi.ClonePool(workers=4)
+    vbox_c1, vbox_c2, vbox_c3, vbox_s = pool.create_all(
+        [(vm1, "testrun"+run+"client1"), (vm2, "testrun"+run+"client2"),
+         (vm3, "testrun"+run+"client3"), (vms, "testrun"+run+"server")])
     if verbose:
-        print "vm1 created"
-    time.sleep(10)
-    vbox_c2 = forgeosi.Vbox(basename=vm2, clonename="testrun"+run+"client2")
-    if verbose:
-        print "vm2 created"
-    time.sleep(10)
-    vbox_c3 = forgeosi.Vbox(basename=vm3, clonename="testrun"+run+"client3")
-    if verbose:
-        print "vm3 created"
-    time.sleep(10)
-    vbox_s = forgeosi.Vbox(basename=vms, clonename="testrun"+run+"server")
-    if verbose:
-        print "vms created"
-    time.sleep(10)
+        print "all vms created"
     p_c1 = vbox_c1.start(session_type=forgeosi.SessionType.gui, wait=False)
     p_c2 = vbox_c2.start(session_type=forgeosi.SessionType.gui, wait=False)
     vbox_s.start(session_type=forgeosi.SessionType.gui, wait=True)
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+#
+# By Maximilian Krueger
+# [maximilian.krueger@fau.de]
+#
+# Writes small VDI images for the tests, no VirtualBox needed
+#
+
+import os
+import struct
+import sys
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'forgeosi'))
+
+from lib import vdi
+
+_SIGNATURE_TEXT = b"<<< Oracle VM VirtualBox Disk Image >>>\n"
+
+
+def write_vdi(path, blocks, block_size, data, parent=None, zero=()):
+    """Writes a dynamic or, with parent, a differencing VDI image
+
+    Arguments:
+        path - path of the new image
+        blocks - number of blocks of the virtual disk
+        block_size - bytes per block, at least 512
+        data - dict of block number and its content, stored in this order
+        parent - creation UUID of the parent image
+        zero - block numbers, which are marked as zero blocks
+
+    Returns:
+        the creation UUID of the image
+    """
+    offset_blocks = 0x200
+    offset_data = offset_blocks + ((blocks * 4 + 511) // 512) * 512
+    block_map = [vdi.BLOCK_FREE] * blocks
+    order = sorted(data)
+    for i, block in enumerate(order):
+        block_map[block] = i
+    for block in zero:
+        block_map[block] = vdi.BLOCK_ZERO
+
+    create = uuid.uuid4()
+    image_type = vdi.VDI_TYPE_DIFF if parent else vdi.VDI_TYPE_NORMAL
+    header = vdi._HEADER.pack(
+        _SIGNATURE_TEXT, vdi.VDI_SIGNATURE, 0x00010001, 0x190, image_type, 0,
+        b"", offset_blocks, offset_data, 0, blocks * block_size, block_size, 0,
+        blocks, len(order), create.bytes_le, uuid.uuid4().bytes_le,
+        (parent or uuid.UUID(int=0)).bytes_le, uuid.UUID(int=0).bytes_le)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(b"\0" * (offset_blocks - len(header)))
+        f.write(struct.pack("<%dI" % blocks, *block_map))
+        f.seek(offset_data)
+        for block in order:
+            f.write(data[block].ljust(block_size, b"\0"))
+    return create